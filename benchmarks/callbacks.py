@@ -0,0 +1,201 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Compare the cost of sending queries through UdpDnsClient.send_query,
+which hands each result to a Deferred, with send_query_callbacks,
+which hands it to plain callables.  The client runs against an
+in-memory socket and a fake clock so that only the client's own work
+is measured: each round sends a batch of queries, then either answers
+all of them or lets all of them time out.  Timeouts are scheduled on
+a TimerWheel and the query is a pre-rendered QueryTemplate, as they
+would be for a client sending at a high rate.
+
+For each path it reports the CPU time per answered and per timed out
+query, and the memory and number of allocated blocks each query holds
+while it is in flight.  The memory figures need tracemalloc, so they
+are only reported on Python 3.
+
+Run it like this:
+
+    PYTHONPATH=src python benchmarks/callbacks.py
+
+and see --help for the knobs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+
+try:
+    import tracemalloc
+
+except ImportError:
+    tracemalloc = None
+
+from twisted.internet import task
+
+import dns.message
+
+import txdnspython.decode
+import txdnspython.template
+import txdnspython.timer
+import txdnspython.udp
+
+from clients import cpu_seconds
+
+class Transport(object):
+    def __init__(self):
+        self.written = []
+
+    def connect(self, address, port):
+        pass
+
+    def write(self, data, address = None):
+        self.written.append(data)
+
+    def loseConnection(self):
+        pass
+
+class Reactor(task.Clock):
+    def listenUDP(self, port, protocol, interface = ''):
+        transport = Transport()
+        protocol.makeConnection(transport)
+        return transport
+
+def ignore(result):
+    pass
+
+def send_deferred(client, query, count, timeout, decode):
+    for i in range(count):
+        client.send_query(query, timeout, decode).addCallbacks(ignore, ignore)
+
+def send_callbacks(client, query, count, timeout, decode):
+    for i in range(count):
+        client.send_query_callbacks(query, ignore, ignore, timeout, decode)
+
+PATHS = [('deferred', send_deferred), ('callbacks', send_callbacks)]
+
+def answer(protocol):
+    written = protocol.transport.written
+    protocol.transport.written = []
+    for packet in written:
+        response = bytearray(packet)
+        response[2] |= 0x80
+        protocol.datagramReceived(bytes(response), None)
+
+def run_round(send, clock, client, query, options, answered):
+    send(client, query, options.batch, options.timeout, options.decode)
+    if answered:
+        answer(client.protocol)
+
+    else:
+        client.protocol.transport.written = []
+        clock.advance(options.timeout + 0.1)
+
+def make_client(clock):
+    return txdnspython.udp.UdpDnsClient(clock, '127.0.0.1', timer = txdnspython.timer.TimerWheel(clock))
+
+def cpu_per_query(send, query, options, answered):
+    clock = Reactor()
+    client = make_client(clock)
+
+    # warm up
+    run_round(send, clock, client, query, options, answered)
+
+    rounds = max(1, options.queries // options.batch)
+    start = cpu_seconds()
+    for i in range(rounds):
+        run_round(send, clock, client, query, options, answered)
+
+    cpu = cpu_seconds() - start
+    return cpu / (rounds * options.batch) * 1e6
+
+def held_per_query(send, query, options):
+    """
+    The bytes and blocks held by each query in flight, or C{None}s
+    without tracemalloc.
+    """
+
+    if tracemalloc is None:
+        return None, None
+
+    clock = Reactor()
+    client = make_client(clock)
+    run_round(send, clock, client, query, options, False)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    send(client, query, options.batch, options.timeout, options.decode)
+    client.protocol.transport.written = []
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    clock.advance(options.timeout + 0.1)
+    return float(size) / options.batch, float(blocks) / options.batch
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare the Deferred and callback ways of sending queries.')
+    parser.add_argument('--queries', default = 200000, type = int,
+                        help = 'queries sent for each measurement (default: 200000)')
+    parser.add_argument('--batch', default = 1000, type = int,
+                        help = 'queries in flight at once (default: 1000)')
+    parser.add_argument('--timeout', default = 2.0, type = float,
+                        help = 'seconds before a query times out (default: 2)')
+    parser.add_argument('--decode', default = txdnspython.decode.RAW,
+                        choices = [txdnspython.decode.MESSAGE, txdnspython.decode.LAZY, txdnspython.decode.HEADER,
+                                   txdnspython.decode.RAW],
+                        help = 'how responses are decoded (default: raw, which leaves out parsing)')
+    parser.add_argument('--output', help = 'file to write the results to as JSON')
+    options = parser.parse_args()
+
+    query = txdnspython.template.render(dns.message.make_query('www.example.com.', 'A'))
+
+    print('{:>10} {:>17} {:>18} {:>15} {:>16}'.format(
+        'path', 'answered us/query', 'timed out us/query', 'bytes in flight', 'blocks in flight'))
+
+    results = []
+    for name, send in PATHS:
+        size, blocks = held_per_query(send, query, options)
+        result = {
+            'path': name,
+            'answered_cpu_us_per_query': cpu_per_query(send, query, options, True),
+            'timed_out_cpu_us_per_query': cpu_per_query(send, query, options, False),
+            'bytes_per_query_in_flight': size,
+            'blocks_per_query_in_flight': blocks,
+        }
+        results.append(result)
+
+        print('{path:>10} {answered_cpu_us_per_query:>17.2f} {timed_out_cpu_us_per_query:>18.2f} {size:>15} '
+              '{blocks:>16}'.format(size = '-' if size is None else '{:.0f}'.format(size),
+                                    blocks = '-' if blocks is None else '{:.1f}'.format(blocks), **result))
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'options': vars(options), 'results': results}, output, indent = 2)
+
+if __name__ == '__main__':
+    main()
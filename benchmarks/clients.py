@@ -0,0 +1,238 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Drive UdpDnsClient and TcpDnsClient against a stand-in server on
+loopback at fixed concurrency levels, and report queries per second,
+median and 99th percentile latency, CPU time per query and peak
+resident memory for each run.  The results are also written as JSON
+so that runs before and after a change can be compared.
+
+The stand-in server runs in the same process as the clients, so the
+CPU time includes the time spent answering the queries.  That cost
+is the same for every run, so differences between runs are still
+down to the clients.
+
+Run it like this:
+
+    PYTHONPATH=src python benchmarks/clients.py --output results.json
+
+and see --help for the knobs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import resource
+import sys
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python import failure
+
+import dns.message
+import dns.version
+import twisted
+
+import txdnspython.tcp
+import txdnspython.testing
+import txdnspython.udp
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return None
+
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+
+    return peak
+
+def drive(client, queries, concurrency, timeout):
+    """
+    Send every query through the client, keeping C{concurrency} in
+    flight, and fire with the latency of each answered query and the
+    number of queries that failed.
+    """
+
+    done = defer.Deferred()
+    latencies = []
+    state = {'next': 0, 'in_flight': 0, 'errors': 0}
+
+    def finished(result, start):
+        state['in_flight'] -= 1
+        if isinstance(result, failure.Failure):
+            state['errors'] += 1
+
+        else:
+            latencies.append(reactor.seconds() - start)
+
+        send()
+
+    def send():
+        while state['in_flight'] < concurrency and state['next'] < len(queries):
+            query = queries[state['next']]
+            state['next'] += 1
+            state['in_flight'] += 1
+            d = client.send_query(query, timeout)
+            d.addBoth(finished, reactor.seconds())
+
+        if not state['in_flight'] and not done.called:
+            done.callback((latencies, state['errors']))
+
+    send()
+    return done
+
+def make_client(transport, port, connections):
+    if transport == 'udp':
+        return txdnspython.udp.UdpDnsClient(reactor, '127.0.0.1', port, sockets = connections)
+
+    return txdnspython.tcp.TcpDnsClient(reactor, '127.0.0.1', port, connections = connections)
+
+@defer.inlineCallbacks
+def run(options, port):
+    results = []
+    queries = [dns.message.make_query('host{}.example.'.format(i), 'A') for i in range(options.queries)]
+
+    print('{:>9} {:>11} {:>10} {:>8} {:>10} {:>10} {:>12} {:>10}'.format(
+        'transport', 'concurrency', 'qps', 'errors', 'p50 ms', 'p99 ms', 'cpu us/query', 'rss kB'))
+
+    for transport in options.transport:
+        for concurrency in options.concurrency:
+            client = make_client(transport, port, options.connections)
+
+            # Warm up so that connections are open and code paths are
+            # hot before timing starts.
+            yield drive(client, queries[:min(len(queries), 1000)], concurrency, options.timeout)
+
+            cpu_start = cpu_seconds()
+            start = reactor.seconds()
+            latencies, errors = yield drive(client, queries, concurrency, options.timeout)
+            elapsed = reactor.seconds() - start
+            cpu = cpu_seconds() - cpu_start
+
+            client.close()
+
+            latencies.sort()
+            result = {
+                'transport': transport,
+                'concurrency': concurrency,
+                'queries': len(queries),
+                'answered': len(latencies),
+                'errors': errors,
+                'seconds': elapsed,
+                'qps': len(latencies) / elapsed,
+                'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+                'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+                'cpu_us_per_query': cpu / len(queries) * 1e6,
+                'peak_rss_kb': peak_rss_kb(),
+            }
+            results.append(result)
+
+            print('{transport:>9} {concurrency:>11} {qps:>10.0f} {errors:>8} {p50:>10.3f} {p99:>10.3f} '
+                  '{cpu_us_per_query:>12.1f} {peak_rss_kb:>10}'.format(
+                      p50 = result['p50_ms'] or 0.0, p99 = result['p99_ms'] or 0.0, **result))
+
+    defer.returnValue(results)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the txdnspython clients against a local server.')
+    parser.add_argument('--transport', default = 'udp,tcp', type = lambda value: value.split(','),
+                        help = 'comma separated transports to run (default: udp,tcp)')
+    parser.add_argument('--concurrency', default = '1,10,100,1000',
+                        type = lambda value: [int(level) for level in value.split(',')],
+                        help = 'comma separated numbers of queries in flight (default: 1,10,100,1000)')
+    parser.add_argument('--queries', default = 20000, type = int,
+                        help = 'queries sent in each run (default: 20000)')
+    parser.add_argument('--connections', default = 1, type = int,
+                        help = 'UDP sockets or TCP connections per client (default: 1)')
+    parser.add_argument('--timeout', default = 2.0, type = float,
+                        help = 'seconds before a query times out (default: 2)')
+    parser.add_argument('--latency', default = 0.0, type = float,
+                        help = 'seconds the server waits before answering (default: 0)')
+    parser.add_argument('--loss', default = 0.0, type = float,
+                        help = 'fraction of UDP queries the server drops (default: 0)')
+    parser.add_argument('--truncate', default = 0.0, type = float,
+                        help = 'fraction of UDP responses the server truncates (default: 0)')
+    parser.add_argument('--seed', default = 0, type = int,
+                        help = 'seed for the server\'s choice of queries to drop and truncate (default: 0)')
+    parser.add_argument('--output', help = 'file to write the results to as JSON')
+    options = parser.parse_args()
+
+    server = txdnspython.testing.StandInServer(reactor, latency = options.latency, loss = options.loss,
+                                               truncate = options.truncate, seed = options.seed)
+    port = server.listen()
+
+    outcome = {}
+
+    def finished(results):
+        outcome['results'] = results
+        reactor.stop()
+
+    def failed(reason):
+        outcome['error'] = reason
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: run(options, port).addCallbacks(finished, failed))
+    reactor.run()
+
+    if 'error' in outcome:
+        outcome['error'].printTraceback()
+        return 1
+
+    if options.output:
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'twisted': twisted.__version__,
+                'dnspython': dns.version.version,
+            },
+            'parameters': {
+                'queries': options.queries,
+                'connections': options.connections,
+                'timeout': options.timeout,
+                'latency': options.latency,
+                'loss': options.loss,
+                'truncate': options.truncate,
+                'seed': options.seed,
+            },
+            'results': outcome['results'],
+        }
+
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent = 2, sort_keys = True)
+            output.write('\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
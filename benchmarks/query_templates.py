@@ -0,0 +1,124 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Measure the CPU cost of handing a query to UdpDnsClientProtocol when
+it is built and rendered for every send, when only the rendering is
+repeated, and when a pre-rendered template from QueryTemplateCache is
+sent.  Query IDs are released straight after each send and nothing
+is written to a socket, so only the work done before the write is
+measured.
+
+Run it like this:
+
+    PYTHONPATH=src python benchmarks/query_templates.py
+
+and see --help for the knobs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import timeit
+
+import dns.message
+
+from txdnspython.template import QueryTemplateCache
+from txdnspython.udp import UdpDnsClientProtocol
+
+class NullTransport(object):
+    def write(self, data):
+        pass
+
+class SendOnly(UdpDnsClientProtocol):
+    def __init__(self):
+        UdpDnsClientProtocol.__init__(self, None, '127.0.0.1', 53, False)
+        self.transport = NullTransport()
+
+    def _write(self, query_id, wire_data):
+        self.transport.write(wire_data)
+        del self.pending[query_id]
+        self.ids.release(query_id)
+
+def make_and_send(protocol, names, count):
+    for i in range(count):
+        protocol.send_query(dns.message.make_query(names[i % len(names)], 'A'), None)
+
+def send_message(protocol, queries, count):
+    for i in range(count):
+        protocol.send_query(queries[i % len(queries)], None)
+
+def send_template(protocol, templates, names, count):
+    for i in range(count):
+        protocol.send_query(templates.get(names[i % len(names)], 'A'), None)
+
+def best(func, repeat = 3):
+    times = []
+    for i in range(repeat):
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure the cost of building, rendering and sending queries.')
+    parser.add_argument('--names', default = '1,100,10000',
+                        type = lambda value: [int(count) for count in value.split(',')],
+                        help = 'comma separated numbers of distinct names queried (default: 1,100,10000)')
+    parser.add_argument('--queries', default = 20000, type = int,
+                        help = 'queries sent for each measurement (default: 20000)')
+    parser.add_argument('--repeat', default = 3, type = int,
+                        help = 'times each measurement is repeated, keeping the best (default: 3)')
+    parser.add_argument('--output', help = 'file to write the results to as JSON')
+    options = parser.parse_args()
+
+    count = options.queries
+
+    print('{:>8} {:>22} {:>22} {:>22}'.format('names', 'make_query us/send', 'to_wire us/send', 'template us/send'))
+
+    results = []
+    for distinct in options.names:
+        names = ['host{}.example.com.'.format(i) for i in range(distinct)]
+        queries = [dns.message.make_query(name, 'A') for name in names]
+        templates = QueryTemplateCache(max_entries = distinct)
+        protocol = SendOnly()
+
+        elapsed = [best(lambda: make_and_send(protocol, names, count), options.repeat),
+                   best(lambda: send_message(protocol, queries, count), options.repeat),
+                   best(lambda: send_template(protocol, templates, names, count), options.repeat)]
+        per_send = [seconds / count * 1e6 for seconds in elapsed]
+
+        results.append({
+            'names': distinct,
+            'make_query_us_per_send': per_send[0],
+            'to_wire_us_per_send': per_send[1],
+            'template_us_per_send': per_send[2],
+        })
+
+        print('{:>8} {:>22.2f} {:>22.2f} {:>22.2f}'.format(distinct, *per_send))
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'options': vars(options), 'results': results}, output, indent = 2)
+
+if __name__ == '__main__':
+    main()
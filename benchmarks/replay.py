@@ -0,0 +1,146 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Replay a capture of real traffic (see txdnspython.capture) against a
+stand-in server on loopback that answers with the recorded
+responses, at the recorded pace or a multiple of it, and report
+queries per second, latency percentiles and CPU time per query.  The
+results can also be written as JSON so that runs before and after a
+change can be compared.
+
+The server runs in the same process as the client and parses every
+query, so it takes a share of the CPU time.  When the process cannot
+keep up with the pace of the capture, UDP queries are dropped by the
+kernel and show up as timeouts.
+
+Record the traffic by handing a txdnspython.capture.Capture to a
+client, or with txdnspython-bulk --capture, then run:
+
+    PYTHONPATH=src python benchmarks/replay.py traffic.cap --speed 10
+
+and see --help for the knobs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+
+from twisted.internet import reactor
+
+import txdnspython.capture
+import txdnspython.decode
+import txdnspython.stats
+import txdnspython.tcp
+import txdnspython.testing
+import txdnspython.udp
+
+from clients import cpu_seconds
+from clients import peak_rss_kb
+
+def make_client(options, port, stats):
+    if options.transport == 'tcp':
+        return txdnspython.tcp.TcpDnsClient(reactor, '127.0.0.1', port, connections = options.connections,
+                                            stats = stats)
+
+    return txdnspython.udp.UdpDnsClient(reactor, '127.0.0.1', port, sockets = options.connections, stats = stats)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Replay captured traffic against a local server.')
+    parser.add_argument('capture', help = 'capture file to replay')
+    parser.add_argument('--speed', default = 1.0, type = float,
+                        help = 'how many times faster than recorded to send the queries (default: 1)')
+    parser.add_argument('--transport', default = 'udp', choices = ['udp', 'tcp'],
+                        help = 'transport to replay over (default: udp)')
+    parser.add_argument('--connections', default = 1, type = int,
+                        help = 'UDP sockets or TCP connections (default: 1)')
+    parser.add_argument('--timeout', default = 2.0, type = float,
+                        help = 'seconds before a query times out (default: 2)')
+    parser.add_argument('--latency', default = 0.0, type = float,
+                        help = 'seconds the server waits before answering (default: 0)')
+    parser.add_argument('--decode', default = txdnspython.decode.MESSAGE,
+                        choices = [txdnspython.decode.MESSAGE, txdnspython.decode.LAZY, txdnspython.decode.HEADER,
+                                   txdnspython.decode.RAW],
+                        help = 'how responses are decoded (default: message)')
+    parser.add_argument('--output', help = 'file to write the results to as JSON')
+    options = parser.parse_args()
+
+    with open(options.capture, 'rb') as input:
+        exchanges = txdnspython.capture.exchanges(txdnspython.capture.read(input))
+
+    answer = txdnspython.capture.ReplayAnswer(exchanges)
+    server = txdnspython.testing.StandInServer(reactor, latency = options.latency, answer = answer)
+    port = server.listen()
+
+    stats = txdnspython.stats.Stats()
+    client = make_client(options, port, stats)
+    replay = txdnspython.capture.Replay(reactor, client, exchanges, options.speed, options.timeout, options.decode)
+
+    outcome = {}
+
+    def finished(result):
+        outcome['result'] = result
+        outcome['seconds'] = reactor.seconds() - outcome['start']
+        outcome['cpu'] = cpu_seconds() - outcome['cpu_start']
+        client.close()
+        reactor.stop()
+
+    def start():
+        outcome['start'] = reactor.seconds()
+        outcome['cpu_start'] = cpu_seconds()
+        replay.run().addBoth(finished)
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+
+    if 'result' not in outcome or not isinstance(outcome['result'], txdnspython.capture.Replay):
+        print(outcome.get('result'))
+        return
+
+    wire = stats.snapshot()
+    result = {
+        'exchanges': len(exchanges),
+        'sent': replay.sent,
+        'responses': replay.responses,
+        'errors': dict(replay.errors),
+        'skipped': replay.skipped + answer.skipped,
+        'seconds': outcome['seconds'],
+        'qps': replay.responses / outcome['seconds'] if outcome['seconds'] else None,
+        'latency_p50': wire['latency_p50'],
+        'latency_p99': wire['latency_p99'],
+        'cpu_us_per_query': outcome['cpu'] / replay.sent * 1e6 if replay.sent else None,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+    print('{sent} queries in {seconds:.2f}s, {responses} answered, {qps:.0f} answered/s, errors {errors}'.format(
+        **dict(result, qps = result['qps'] or 0.0)))
+    print('latency p50 {latency_p50} p99 {latency_p99} (seconds, histogram bucket bounds), '
+          '{cpu:.1f} us CPU per query, {peak_rss_kb} kB peak RSS'.format(cpu = result['cpu_us_per_query'] or 0.0,
+                                                                         **result))
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'options': vars(options), 'result': result}, output, indent = 2)
+
+if __name__ == '__main__':
+    main()
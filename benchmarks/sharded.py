@@ -0,0 +1,162 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Compare a single process UdpDnsClient with ShardedDnsClient at
+different numbers of worker processes, reporting queries per second
+and median and 99th percentile latency for each.
+
+The server is a separate process that answers each query by setting
+the QR bit and sending it back, so that it costs next to nothing and
+does not compete with the front end for its core.  With the default
+handler the workers parse every response and pass back a summary of
+it, so the parsing, which is what limits a single process, is spread
+over the workers.  Throughput can only grow with the number of
+workers on a machine with cores to spare for them.
+
+Run it like this:
+
+    PYTHONPATH=src python benchmarks/sharded.py --workers 1,2,4
+
+and see --help for the knobs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+
+from twisted.internet import defer
+from twisted.internet import reactor
+
+import dns.message
+
+import txdnspython.shard
+import txdnspython.udp
+
+from clients import drive
+from clients import percentile
+
+def respond():
+    """Answer queries on a loopback UDP port until killed."""
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    print(server.getsockname()[1])
+    sys.stdout.flush()
+
+    while True:
+        data, address = server.recvfrom(65535)
+        server.sendto(data[:2] + bytearray([bytearray(data[2:3])[0] | 0x80]) + data[3:], address)
+
+@defer.inlineCallbacks
+def run(options, port, results):
+    queries = [dns.message.make_query('host{}.example.'.format(i), 'A') for i in range(options.queries)]
+
+    print('{:>7} {:>10} {:>8} {:>10} {:>10}'.format('workers', 'qps', 'errors', 'p50 ms', 'p99 ms'))
+
+    for workers in options.workers:
+        if workers:
+            client = txdnspython.shard.ShardedDnsClient(reactor, '127.0.0.1', port, workers = workers,
+                                                        handler = options.handler or None)
+
+        else:
+            client = txdnspython.udp.UdpDnsClient(reactor, '127.0.0.1', port)
+
+        yield drive(client, queries[:min(len(queries), 1000)], options.concurrency, options.timeout)
+
+        start = reactor.seconds()
+        latencies, errors = yield drive(client, queries, options.concurrency, options.timeout)
+        elapsed = reactor.seconds() - start
+
+        yield client.close()
+
+        latencies.sort()
+        result = {
+            'workers': workers,
+            'qps': len(latencies) / elapsed,
+            'errors': errors,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p99': percentile(latencies, 0.99),
+        }
+        results.append(result)
+
+        print('{:>7} {:>10.0f} {:>8} {:>10.3f} {:>10.3f}'.format(
+            workers or 'none', result['qps'], errors,
+            (result['latency_p50'] or 0.0) * 1000, (result['latency_p99'] or 0.0) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark ShardedDnsClient against a local server.')
+    parser.add_argument('--workers', default = '0,1,{}'.format(multiprocessing.cpu_count()),
+                        type = lambda value: [int(count) for count in value.split(',')],
+                        help = 'comma separated numbers of worker processes, 0 for a single process '
+                        'UdpDnsClient (default: 0, 1 and one per CPU)')
+    parser.add_argument('--concurrency', default = 100, type = int,
+                        help = 'number of queries in flight (default: 100)')
+    parser.add_argument('--queries', default = 50000, type = int,
+                        help = 'queries sent in each run (default: 50000)')
+    parser.add_argument('--timeout', default = 5.0, type = float,
+                        help = 'seconds before a query times out (default: 5)')
+    parser.add_argument('--handler', default = 'txdnspython.shard.answers',
+                        help = 'handler for the workers to call, or an empty string to pass back '
+                        'the responses (default: txdnspython.shard.answers)')
+    parser.add_argument('--output', help = 'file to write the results to as JSON')
+    parser.add_argument('--respond', action = 'store_true', help = argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.respond:
+        respond()
+        return 0
+
+    responder = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--respond'], stdout = subprocess.PIPE)
+    try:
+        port = int(responder.stdout.readline())
+        outcome = {}
+        results = []
+
+        def failed(reason):
+            outcome['error'] = reason
+
+        reactor.callWhenRunning(lambda: run(options, port, results).addErrback(failed)
+                                .addBoth(lambda ignored: reactor.stop()))
+        reactor.run()
+
+    finally:
+        responder.kill()
+        responder.wait()
+
+    if 'error' in outcome:
+        outcome['error'].printTraceback()
+        return 1
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'options': vars(options), 'results': results}, output, indent = 2)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
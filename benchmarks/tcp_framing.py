@@ -0,0 +1,174 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Measure how fast TcpDnsClientProtocol splits a TCP stream into DNS
+messages, as the number of messages per read and the size of the
+messages vary, both with reads that hold whole messages and with
+reads that end part way through a message.  The string-concatenating reassembly that the protocol
+used before is measured alongside for comparison.  Parsing of the
+messages is left out so that only the framing is measured.
+
+Run it like this:
+
+    PYTHONPATH=src python benchmarks/tcp_framing.py
+
+and see --help for the knobs; --per-read, --sizes and --bytes make a
+quick run possible.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import struct
+import timeit
+
+from txdnspython.tcp import TcpDnsClientProtocol
+
+class FramingOnly(TcpDnsClientProtocol):
+    def __init__(self):
+        TcpDnsClientProtocol.__init__(self, None, False, None)
+        self.messages = 0
+
+    def _process_response(self, wire_data):
+        self.messages += 1
+
+class ConcatenatingFraming(FramingOnly):
+    """The reassembly loop TcpDnsClientProtocol used to have."""
+
+    def __init__(self):
+        FramingOnly.__init__(self)
+        self.buffer = b''
+        self.waiting_for = None
+
+    def dataReceived(self, data):
+        self.buffer += data
+        while True:
+            if self.waiting_for is None and len(self.buffer) < 2:
+                return
+
+            if self.waiting_for is None and len(self.buffer) >= 2:
+                (self.waiting_for,) = struct.unpack('!H', self.buffer[:2])
+                self.buffer = self.buffer[2:]
+
+            if self.waiting_for > len(self.buffer):
+                return
+
+            wire_data = self.buffer[:self.waiting_for]
+            self.buffer = self.buffer[self.waiting_for:]
+            self.waiting_for = None
+
+            self._process_response(wire_data)
+
+def make_reads(per_read, size, total_bytes, straddle):
+    """
+    Build the reads for a stream of messages of the given size.  If
+    C{straddle} is true the reads are shifted so that every read ends
+    part way through a message.
+    """
+
+    message = struct.pack('!H', size) + b'\x00' * size
+    read = message * per_read
+    count = max(1, total_bytes // len(read))
+    stream = read * count
+    step = len(read)
+
+    if straddle:
+        shift = min(step // 3, 1000)
+        reads = [stream[:shift]] + [stream[i:i + step] for i in range(shift, len(stream), step)]
+
+    else:
+        reads = [read] * count
+
+    return reads, per_read * count
+
+def run(factory, reads, repeat = 3):
+    """
+    Feed the reads to fresh protocols and return the best time, in
+    seconds, that it took to process them all.
+    """
+
+    best = None
+
+    for i in range(repeat):
+        protocol = factory()
+        start = timeit.default_timer()
+        for data in reads:
+            protocol.dataReceived(data)
+        elapsed = timeit.default_timer() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, protocol.messages
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure how fast DNS messages are split out of a TCP stream.')
+    parser.add_argument('--per-read', default = '1,10,100,1000',
+                        type = lambda value: [int(count) for count in value.split(',')],
+                        help = 'comma separated numbers of messages in each read (default: 1,10,100,1000)')
+    parser.add_argument('--sizes', default = '32,512,4096,65535',
+                        type = lambda value: [int(size) for size in value.split(',')],
+                        help = 'comma separated message sizes in bytes (default: 32,512,4096,65535)')
+    parser.add_argument('--bytes', default = 16 * 1024 * 1024, type = int,
+                        help = 'bytes fed to the protocol for each measurement (default: 16 MiB)')
+    parser.add_argument('--repeat', default = 3, type = int,
+                        help = 'times each measurement is repeated, keeping the best (default: 3)')
+    parser.add_argument('--output', help = 'file to write the results to as JSON')
+    options = parser.parse_args()
+
+    print('{:>10} {:>8} {:>9} {:>14} {:>14} {:>10}'.format('per read', 'size', 'reads',
+                                                           'new msg/s', 'old msg/s', 'speedup'))
+
+    results = []
+    for per_read in options.per_read:
+        for size in options.sizes:
+            if per_read * size > options.bytes:
+                continue
+
+            for straddle in (False, True):
+                reads, messages = make_reads(per_read, size, options.bytes, straddle)
+
+                rates = []
+                for factory in (FramingOnly, ConcatenatingFraming):
+                    elapsed, received = run(factory, reads, options.repeat)
+                    assert received == messages
+                    rates.append(messages / elapsed)
+
+                results.append({
+                    'per_read': per_read,
+                    'size': size,
+                    'reads': 'straddle' if straddle else 'aligned',
+                    'messages_per_second': rates[0],
+                    'concatenating_messages_per_second': rates[1],
+                })
+
+                print('{:>10} {:>8} {:>9} {:>14.0f} {:>14.0f} {:>9.1f}x'.format(
+                    per_read, size, 'straddle' if straddle else 'aligned',
+                    rates[0], rates[1], rates[0] / rates[1]))
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'options': vars(options), 'results': results}, output, indent = 2)
+
+if __name__ == '__main__':
+    main()
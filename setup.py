@@ -35,10 +35,12 @@ setup(name = 'txdnspython',
                      'Intended Audience :: Developers',
                      'Programming Language :: Python',
                      'Programming Language :: Python :: 2.7',
+                     'Programming Language :: Python :: 3',
                      'Topic :: Internet :: Name Service (DNS)',
                      'Topic :: Software Development :: Libraries :: Python Modules',
                      'Topic :: System :: Networking'],
 
       packages = ['txdnspython'],
       package_dir = {'': 'src'},
+      scripts = ['scripts/txdnspython-bulk'],
       requires = ['Twisted_Core'] )
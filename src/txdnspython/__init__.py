@@ -21,3 +21,12 @@
 
 from txdnspython.tcp import TcpDnsClient
 from txdnspython.udp import UdpDnsClient
+from txdnspython.cache import DnsCache
+from txdnspython.timer import TimerWheel
+from txdnspython.fallback import FallbackDnsClient
+from txdnspython.multi import MultiServerDnsClient
+from txdnspython.stats import Stats
+from txdnspython.template import QueryTemplateCache
+from txdnspython.shard import ShardedDnsClient
+from txdnspython.limit import Limiter
+from txdnspython.iterative import IterativeResolver
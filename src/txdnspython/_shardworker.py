@@ -0,0 +1,167 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+The worker processes of L{txdnspython.shard.ShardedDnsClient}, which
+are started with C{python -m txdnspython._shardworker}.  The package
+does not import this module, so running it does not load it twice.
+"""
+
+import json
+import marshal
+import struct
+import sys
+
+from twisted.internet.protocol import Protocol
+
+import dns.exception
+import dns.message
+
+import txdnspython.decode
+from txdnspython.shard import _FrameReader
+from txdnspython.shard import _NO_TIMEOUT
+from txdnspython.shard import _request
+from txdnspython.shard import _response
+from txdnspython.shard import _RESPONSE
+from txdnspython.shard import _RESULT
+from txdnspython.shard import _TIMEOUT
+from txdnspython.shard import _ERROR
+
+class _WireQuery(object):
+    """
+    A query a worker received, kept as wire data.  It has just enough
+    of L{dns.message.Message} for the protocols to send it and to
+    hand back the raw response.
+    """
+
+    __slots__ = ('wire', 'id', 'keyring', 'question')
+
+    def __init__(self, wire):
+        self.wire = wire
+        self.id = struct.unpack('!H', wire[:2])[0]
+        self.keyring = None
+        self.question = ()
+
+    def to_wire(self):
+        return self.wire
+
+class _WorkerServer(_FrameReader, Protocol):
+    """The end of the channel inside a worker process."""
+
+    def __init__(self, client, handler):
+        _FrameReader.__init__(self)
+        self.client = client
+        self.handler = handler
+
+    def frameReceived(self, data, start, end):
+        (length, request_id, milliseconds) = _request.unpack_from(data, start - 4)
+        wire_data = data[start + 8:end]
+
+        if milliseconds == _NO_TIMEOUT:
+            timeout = None
+
+        else:
+            timeout = milliseconds / 1000.0
+
+        if self.handler is None:
+            query = _WireQuery(wire_data)
+            decode = txdnspython.decode.RAW
+
+        else:
+            query = dns.message.from_wire(wire_data)
+            decode = txdnspython.decode.MESSAGE
+
+        d = self.client.send_query(query, timeout, decode)
+        d.addCallbacks(self._cbResponse, self._ebResponse, callbackArgs = (request_id, query),
+                       errbackArgs = (request_id,))
+
+    def _cbResponse(self, response, request_id, query):
+        if self.handler is None:
+            self._send(request_id, _RESPONSE, response)
+            return
+
+        try:
+            result = marshal.dumps(self.handler(query, response))
+
+        except Exception as e:
+            self._send(request_id, _ERROR, '{}: {}'.format(type(e).__name__, e).encode('utf-8'))
+
+        else:
+            self._send(request_id, _RESULT, result)
+
+    def _ebResponse(self, reason, request_id):
+        if reason.check(dns.exception.Timeout):
+            self._send(request_id, _TIMEOUT, b'')
+
+        else:
+            self._send(request_id, _ERROR, '{}: {}'.format(reason.type.__name__, reason.value).encode('utf-8'))
+
+    def _send(self, request_id, status, payload):
+        self.transport.write(_response.pack(5 + len(payload), request_id, status) + payload)
+
+    def connectionLost(self, reason):
+        from twisted.internet import reactor
+
+        if reactor.running:
+            reactor.stop()
+
+def _load(name):
+    module, function = name.rsplit('.', 1)
+    __import__(module)
+    return getattr(sys.modules[module], function)
+
+def main(settings):
+    """Run a worker process, reading queries from standard input."""
+
+    from twisted.internet import reactor
+    from twisted.internet import stdio
+
+    settings = json.loads(settings)
+    address = settings['address']
+    port = settings['port']
+    one_rr_per_rrset = settings['one_rr_per_rrset']
+
+    if settings['transport'] == 'tcp':
+        import txdnspython.tcp
+        client = txdnspython.tcp.TcpDnsClient(reactor, address, port, one_rr_per_rrset,
+                                              connections = settings['sockets'])
+
+    elif settings['transport'] == 'fallback':
+        import txdnspython.fallback
+        client = txdnspython.fallback.FallbackDnsClient(reactor, address, port, one_rr_per_rrset,
+                                                        sockets = settings['sockets'])
+
+    else:
+        import txdnspython.udp
+        client = txdnspython.udp.UdpDnsClient(reactor, address, port, one_rr_per_rrset,
+                                              sockets = settings['sockets'])
+
+    if settings['handler'] is None:
+        handler = None
+
+    else:
+        handler = _load(settings['handler'])
+
+    stdio.StandardIO(_WorkerServer(client, handler))
+    reactor.run()
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,432 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import collections
+
+from twisted.internet import error
+from twisted.python import failure
+
+import dns.exception
+
+import txdnspython.decode
+import txdnspython.framing
+import txdnspython.generic
+
+class LoopClock(object):
+    """
+    The C{callLater} and C{seconds} methods of
+    L{twisted.internet.interfaces.IReactorTime} on top of an asyncio
+    event loop, so that L{txdnspython.generic.GenericDnsClientProtocol}
+    schedules its timeouts with the loop's own timers.  It can also be
+    passed to L{txdnspython.cache.DnsCache} as its reactor.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def seconds(self):
+        return self.loop.time()
+
+    def callLater(self, delay, func, *args, **kw):
+        return LoopDelayedCall(self.loop, delay, func, args, kw)
+
+class LoopDelayedCall(object):
+    """
+    A call scheduled with L{LoopClock.callLater}.  Behaves like
+    L{twisted.internet.base.DelayedCall} as far as the protocols need.
+    """
+
+    __slots__ = ('handle', 'func', 'args', 'kw', 'called')
+
+    def __init__(self, loop, delay, func, args, kw):
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.called = False
+        self.handle = loop.call_later(delay, self._run)
+
+    def _run(self):
+        self.called = True
+        self.func(*self.args, **self.kw)
+
+    def getTime(self):
+        return self.handle.when()
+
+    def active(self):
+        return not self.called and not self.handle.cancelled()
+
+    def cancel(self):
+        self.handle.cancel()
+
+class DnsFuture(asyncio.Future):
+    """
+    The future returned by C{send_query}.  It is handed to the
+    protocols in place of a L{twisted.internet.defer.Deferred}, so it
+    has the C{called} attribute and the C{callback} and C{errback}
+    methods they use.  Failures are unwrapped into the exception they
+    carry; timeouts are handed over as bare exceptions.  A future that has been cancelled by the caller is treated
+    as fired and its response is dropped.
+    """
+
+    @property
+    def called(self):
+        return self.done()
+
+    def callback(self, result):
+        if not self.done():
+            self.set_result(result)
+
+    def errback(self, reason):
+        if not self.done():
+            if isinstance(reason, failure.Failure):
+                reason = reason.value
+
+            self.set_exception(reason)
+
+class AsyncioUdpDnsClientProtocol(txdnspython.generic.GenericDnsClientProtocol, asyncio.DatagramProtocol):
+    def __init__(self, clock, one_rr_per_rrset, exhausted_policy = txdnspython.generic.QUEUE, stats = None):
+        txdnspython.generic.GenericDnsClientProtocol.__init__(self, clock, one_rr_per_rrset, exhausted_policy,
+                                                              None, stats)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self._process_response(data)
+
+    def error_received(self, exc):
+        # ICMP errors are left to show up as timeouts, as they do with
+        # the Twisted client
+        pass
+
+    def connection_lost(self, exc):
+        self._fail_all(_lost(exc))
+
+    def _write(self, query_id, wire_data):
+        self.transport.sendto(wire_data)
+
+    def send_query(self, query, query_response, timeout = None, decode = txdnspython.decode.MESSAGE):
+        self._send_query(query.to_wire(), query, query_response, timeout, decode)
+
+class AsyncioTcpDnsClientProtocol(txdnspython.generic.GenericDnsClientProtocol, txdnspython.framing.MessageFraming,
+                                  asyncio.Protocol):
+    id_offset = 2
+
+    def __init__(self, clock, one_rr_per_rrset, exhausted_policy = txdnspython.generic.QUEUE, stats = None):
+        txdnspython.generic.GenericDnsClientProtocol.__init__(self, clock, one_rr_per_rrset, exhausted_policy,
+                                                              None, stats)
+        txdnspython.framing.MessageFraming.__init__(self)
+        self.transport = None
+
+        self.client = None
+        """The L{AsyncioTcpDnsClient} to tell when the connection is lost, or C{None}"""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        client, self.client = self.client, None
+
+        if client is not None:
+            client._connection_lost(self)
+
+        self._fail_all(_lost(exc))
+
+    data_received = txdnspython.framing.MessageFraming.dataReceived
+
+    def send_query(self, query, query_response, timeout = None, decode = txdnspython.decode.MESSAGE):
+        self._send_query(txdnspython.framing.frame(query.to_wire()),
+                         query,
+                         query_response,
+                         timeout,
+                         decode)
+
+def _lost(exc):
+    if exc is None:
+        return failure.Failure(error.ConnectionDone())
+
+    return failure.Failure(error.ConnectionLost(str(exc)))
+
+class _AsyncioDnsClient(object):
+    """
+    The parts of L{AsyncioUdpDnsClient} and L{AsyncioTcpDnsClient}
+    that sit in front of the protocol.  The connection is opened when
+    the first query is sent, and queries sent before it is open wait
+    for it.
+    """
+
+    def __init__(self, address, port, one_rr_per_rrset, source, source_port, exhausted_policy, loop, clock,
+                 cache, decode, stats):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        self.loop = loop
+
+        self.clock = LoopClock(loop) if clock is None else clock
+        """What timeouts are scheduled with, a L{LoopClock} unless another clock was given"""
+
+        self.address = address
+        self.port = port
+        self.one_rr_per_rrset = one_rr_per_rrset
+        self.exhausted_policy = exhausted_policy
+        self.cache = cache
+        self.decode = decode
+        self.stats = stats
+
+        if source or source_port:
+            self.local_address = (source or '0.0.0.0', source_port)
+
+        else:
+            self.local_address = None
+
+        self.protocol = None
+        """The protocol of the open connection, or C{None}"""
+
+        self.connecting = None
+        """The task that is opening the connection, or C{None}"""
+
+        self.closed = False
+
+        self.queued = collections.OrderedDict()
+        """
+        L{collections.OrderedDict} of the queries that are waiting for
+        the connection to open, as tuples of L{dns.message.Message},
+        L{DnsFuture}, the delayed call of its timeout (or C{None}) and
+        the decode mode.
+        """
+
+        self._queue_key = 0
+
+    def send_query(self, query, timeout = None, decode = None):
+        """Send a query to the nameserver.
+
+        @param query: the query
+        @type query: dns.message.Message object
+        @param timeout: The number of seconds to wait before the query times out.
+        If None, the default, wait forever.
+        @type timeout: float
+        @param decode: how to decode the response, one of the modes in
+        L{txdnspython.decode}.  If None, the default, the client's
+        mode is used.  The cache only handles responses that are
+        decoded to L{dns.message.Message}.
+        @type decode: str
+        @return: a future that is awaited for the response
+        @rtype: L{DnsFuture}
+        """
+
+        if decode is None:
+            decode = self.decode
+
+        cache = self.cache if decode == txdnspython.decode.MESSAGE else None
+        query_response = DnsFuture(loop = self.loop)
+
+        if cache is not None:
+            response = cache.get(query)
+            if response is not None:
+                query_response.set_result(response)
+                return query_response
+
+            query_response.add_done_callback(lambda future: _cache_put(cache, future, query))
+
+        protocol = self.protocol
+        if protocol is not None:
+            protocol.send_query(query, query_response, timeout, decode)
+
+        elif self.closed:
+            query_response.errback(failure.Failure(error.ConnectionDone()))
+
+        else:
+            self._queue(query, query_response, timeout, decode)
+
+        return query_response
+
+    def _queue(self, query, query_response, timeout, decode):
+        key = self._queue_key
+        self._queue_key += 1
+
+        if timeout:
+            delayed_call = self.clock.callLater(timeout, self._timeout, key)
+
+        else:
+            delayed_call = None
+
+        self.queued[key] = (query, query_response, delayed_call, decode)
+
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(self._open(), loop = self.loop)
+            self.connecting.add_done_callback(self._opened)
+
+    def _timeout(self, key):
+        entry = self.queued.pop(key, None)
+        if entry is not None:
+            entry[1].errback(dns.exception.Timeout())
+
+    def _opened(self, task):
+        self.connecting = None
+
+        if task.cancelled():
+            reason = failure.Failure(error.ConnectionDone())
+
+        elif task.exception() is not None:
+            reason = failure.Failure(task.exception())
+
+        else:
+            transport, protocol = task.result()
+            if self.closed:
+                transport.close()
+                return
+
+            self._connection_made(protocol)
+            return
+
+        self._fail_queued(reason)
+
+    def _connection_made(self, protocol):
+        """
+        Start using a protocol whose connection has been made and send
+        the queries that were waiting for it.
+        """
+
+        self.protocol = protocol
+        queued = list(self.queued.values())
+        self.queued.clear()
+
+        now = self.clock.seconds()
+        for query, query_response, delayed_call, decode in queued:
+            if delayed_call is not None:
+                delayed_call.cancel()
+                timeout = delayed_call.getTime() - now
+
+            else:
+                timeout = None
+
+            protocol.send_query(query, query_response, timeout, decode)
+
+    def _fail_queued(self, reason):
+        queued = list(self.queued.values())
+        self.queued.clear()
+
+        for query, query_response, delayed_call, decode in queued:
+            if delayed_call is not None and delayed_call.active():
+                delayed_call.cancel()
+
+            query_response.errback(reason)
+
+    def close(self):
+        """
+        Close the connection.  Queries that have not been answered
+        fail with L{twisted.internet.error.ConnectionDone}.
+        """
+
+        self.closed = True
+
+        if self.connecting is not None:
+            self.connecting.cancel()
+
+        self._fail_queued(failure.Failure(error.ConnectionDone()))
+
+        if self.protocol is not None:
+            protocol, self.protocol = self.protocol, None
+            if protocol.transport is not None:
+                protocol.transport.close()
+
+def _cache_put(cache, future, query):
+    if not future.cancelled() and future.exception() is None:
+        cache.put(future.result(), query)
+
+class AsyncioUdpDnsClient(_AsyncioDnsClient):
+    """
+    A UDP client for asyncio.  It shares query ID allocation,
+    response matching and timeouts with
+    L{txdnspython.udp.UdpDnsClient}, but runs on an asyncio event
+    loop: timeouts are the loop's timers, the socket is an asyncio
+    datagram transport and C{send_query} returns an asyncio future.
+    """
+
+    def __init__(self, address, port = 53, one_rr_per_rrset = False, source = '', source_port = 0,
+                 exhausted_policy = txdnspython.generic.QUEUE, loop = None, clock = None, cache = None,
+                 decode = txdnspython.decode.MESSAGE, stats = None):
+        """
+        Initialize the client object.  The socket is opened when the
+        first query is sent.
+
+        @param loop: the event loop to run on.  If None, the default,
+        the current event loop is used.
+        @type loop: L{asyncio.AbstractEventLoop}
+
+        @param clock: what to schedule timeouts with instead of the
+        loop
+        @type clock: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
+
+        @param cache: cache to answer queries from before sending
+        them, and to store responses in.  Give it the client's
+        L{LoopClock} as its reactor.
+        @type cache: L{txdnspython.cache.DnsCache}
+
+        The other arguments are the same as for
+        L{txdnspython.udp.UdpDnsClient}.
+        """
+
+        _AsyncioDnsClient.__init__(self, address, port, one_rr_per_rrset, source, source_port, exhausted_policy,
+                                   loop, clock, cache, decode, stats)
+
+    def _protocol(self):
+        return AsyncioUdpDnsClientProtocol(self.clock, self.one_rr_per_rrset, self.exhausted_policy, self.stats)
+
+    def _open(self):
+        return self.loop.create_datagram_endpoint(self._protocol, remote_addr = (self.address, self.port),
+                                                  local_addr = self.local_address)
+
+class AsyncioTcpDnsClient(_AsyncioDnsClient):
+    """
+    A TCP client for asyncio, the counterpart of
+    L{txdnspython.tcp.TcpDnsClient} with a single connection.  Queries
+    are pipelined over the connection.  If the connection is lost its
+    queries fail, and the next query opens a new one.
+    """
+
+    def __init__(self, address, port = 53, one_rr_per_rrset = False, source = '', source_port = 0,
+                 exhausted_policy = txdnspython.generic.QUEUE, loop = None, clock = None, cache = None,
+                 decode = txdnspython.decode.MESSAGE, stats = None):
+        """
+        Initialize the client object.  The connection is opened when
+        the first query is sent.
+
+        The arguments are the same as for L{AsyncioUdpDnsClient}.
+        """
+
+        _AsyncioDnsClient.__init__(self, address, port, one_rr_per_rrset, source, source_port, exhausted_policy,
+                                   loop, clock, cache, decode, stats)
+
+    def _protocol(self):
+        protocol = AsyncioTcpDnsClientProtocol(self.clock, self.one_rr_per_rrset, self.exhausted_policy, self.stats)
+        protocol.client = self
+        return protocol
+
+    def _open(self):
+        return self.loop.create_connection(self._protocol, self.address, self.port, local_addr = self.local_address)
+
+    def _connection_lost(self, protocol):
+        if protocol is self.protocol:
+            self.protocol = None
@@ -0,0 +1,194 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import collections
+
+from twisted.internet import defer
+from twisted.python import failure
+from twisted.python import log
+
+class QueryBatch(object):
+    """
+    Send a stream of queries through a client, keeping a fixed
+    number of them in flight.
+
+    Queries are pulled from the iterable only when there is room for
+    them, so the iterable may be a generator over any number of
+    queries.  Results are handed out as they arrive, either to a
+    callback or through L{get}.  A result that has arrived but has
+    not been taken with L{get} yet counts against the concurrency, so
+    a consumer that falls behind slows the batch down instead of
+    letting results pile up.
+
+    Each result is a tuple of the query and either the response or a
+    L{twisted.python.failure.Failure}; a failed query does not stop
+    the batch.
+    """
+
+    def __init__(self, client, queries, concurrency, timeout = None, decode = None, callback = None):
+        """
+        Start sending queries.
+
+        @param client: the client to send the queries through
+        @type client: L{txdnspython.generic.GenericDnsClient}
+        @param queries: the queries to send
+        @type queries: iterable of L{dns.message.Message}
+        @param concurrency: the most queries to have in flight at once
+        @type concurrency: C{int}
+        @param timeout: the timeout for each query, or C{None}
+        @type timeout: C{float}
+        @param decode: how to decode the responses, or C{None} for the
+        client's default
+        @type decode: C{str}
+        @param callback: called with the query and its result as
+        each query finishes.  If C{None}, the results are taken with
+        L{get} instead.
+        @type callback: callable
+        """
+
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        self.client = client
+        self.queries = iter(queries)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.decode = decode
+        self.callback = callback
+
+        self.in_flight = 0
+        """Number of queries that have been sent and not finished"""
+
+        self.sent = 0
+        """Number of queries sent so far"""
+
+        self.succeeded = 0
+        """Number of queries that got a response"""
+
+        self.failed = 0
+        """Number of queries that failed"""
+
+        self.results = collections.deque()
+        """Results that have arrived but have not been taken with L{get}"""
+
+        self.done = defer.Deferred()
+        """
+        L{twisted.internet.defer.Deferred} that fires with this
+        batch once every query has finished.  It fails if the
+        iterable of queries raised an exception.
+        """
+
+        self.exhausted = False
+        self._error = None
+        self._getters = collections.deque()
+        self._filling = False
+
+        self._fill()
+
+    def get(self):
+        """
+        Take the next result.
+
+        @return: a L{twisted.internet.defer.Deferred} that fires with
+        a tuple of the query and its result, or with C{None} once all
+        results have been taken
+        @rtype: L{twisted.internet.defer.Deferred}
+        """
+
+        if self.results:
+            result = self.results.popleft()
+            self._fill()
+            return defer.succeed(result)
+
+        if self.exhausted and not self.in_flight:
+            return defer.succeed(None)
+
+        getter = defer.Deferred()
+        self._getters.append(getter)
+        return getter
+
+    def _fill(self):
+        if self._filling:
+            return
+
+        self._filling = True
+        try:
+            while not self.exhausted and self.in_flight + len(self.results) < self.concurrency:
+                try:
+                    query = next(self.queries)
+
+                except StopIteration:
+                    self.exhausted = True
+                    break
+
+                except Exception:
+                    self.exhausted = True
+                    self._error = failure.Failure()
+                    break
+
+                self.in_flight += 1
+                self.sent += 1
+                query_response = self.client.send_query(query, self.timeout, self.decode)
+                query_response.addBoth(self._cbResult, query)
+
+        finally:
+            self._filling = False
+
+        if self.exhausted and not self.in_flight:
+            self._finish()
+
+    def _cbResult(self, result, query):
+        self.in_flight -= 1
+
+        if isinstance(result, failure.Failure):
+            self.failed += 1
+
+        else:
+            self.succeeded += 1
+
+        if self.callback is not None:
+            try:
+                self.callback(query, result)
+
+            except Exception:
+                log.err()
+
+        elif self._getters:
+            self._getters.popleft().callback((query, result))
+
+        else:
+            self.results.append((query, result))
+
+        self._fill()
+
+    def _finish(self):
+        if self.done.called:
+            return
+
+        if not self.results:
+            while self._getters:
+                self._getters.popleft().callback(None)
+
+        if self._error is not None:
+            self.done.errback(self._error)
+
+        else:
+            self.done.callback(self)
@@ -0,0 +1,352 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Resolve a list of names in bulk and write one JSON record per result.
+
+Names are read one per line from files or standard input, optionally
+followed by a record type, and are sent through one of the clients
+with a fixed number in flight and, if asked, a limited rate.  Each
+result is written as a line of JSON as soon as it arrives, and a
+summary of throughput, latency and errors is written to standard
+error at the end.  Only the queries in flight are held in memory,
+so lists of any length can be resolved.
+
+Run it like this:
+
+    txdnspython-bulk --server 192.0.2.53 --concurrency 500 names.txt > results.jsonl
+
+or with C{python -m txdnspython.bulk}, and see --help for the knobs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+from twisted.python import failure
+
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+
+import txdnspython.capture
+import txdnspython.fallback
+import txdnspython.limit
+import txdnspython.stats
+import txdnspython.tcp
+import txdnspython.udp
+
+def read_names(files, default_type):
+    """
+    Read names, and optionally a record type, from lines of text.
+    Blank lines and lines starting with C{#} are skipped.
+
+    @param files: the open files to read, one after the other
+    @type files: iterable of files
+    @param default_type: the record type of names without one
+    @type default_type: C{str}
+    @return: a generator of tuples of name and record type
+    """
+
+    for lines in files:
+        for line in lines:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+
+            if len(fields) > 1:
+                yield fields[0], fields[1].upper()
+
+            else:
+                yield fields[0], default_type
+
+def record(name, rdtype, result, elapsed):
+    """
+    Build the JSON record of a result.
+
+    @param name: the name as it was read
+    @type name: C{str}
+    @param rdtype: the record type as it was read
+    @type rdtype: C{str}
+    @param result: the response or the reason the query failed
+    @type result: L{dns.message.Message} or L{twisted.python.failure.Failure}
+    @param elapsed: seconds from sending the query to the result
+    @type elapsed: C{float}
+    @rtype: C{dict}
+    """
+
+    entry = {'name': name, 'type': rdtype, 'ms': round(elapsed * 1000, 3)}
+
+    if isinstance(result, failure.Failure):
+        entry['error'] = error_name(result)
+        if not result.check(dns.exception.Timeout):
+            entry['detail'] = result.getErrorMessage()
+
+        return entry
+
+    entry['rcode'] = dns.rcode.to_text(result.rcode())
+    entry['answers'] = [[rrset.name.to_text(), rrset.ttl, dns.rdatatype.to_text(rrset.rdtype), rdata.to_text()]
+                        for rrset in result.answer for rdata in rrset]
+    return entry
+
+def error_name(reason):
+    """The name the summary counts a failed query under."""
+
+    if reason.check(dns.exception.Timeout):
+        return 'timeout'
+
+    return reason.type.__name__
+
+class BulkResolver(object):
+    """
+    Send queries for a stream of names through a client and write the
+    results as they arrive.
+    """
+
+    def __init__(self, reactor, client, names, output, concurrency = 100, timeout = 5.0):
+        """
+        @param reactor: what to read the time from
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
+        @param client: the client to send the queries through
+        @type client: L{txdnspython.generic.GenericDnsClient}
+        @param names: tuples of name and record type
+        @type names: iterable
+        @param output: where to write the JSON records
+        @type output: file
+        @param concurrency: the most queries in flight
+        @type concurrency: C{int}
+        @param timeout: seconds before each query times out
+        @type timeout: C{float}
+        """
+
+        self.reactor = reactor
+        self.client = client
+        self.names = names
+        self.output = output
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        self.stats = txdnspython.stats.Stats()
+        """L{txdnspython.stats.Stats} of the queries as the caller sees them, from sending to the result"""
+
+        self.rcodes = {}
+        """Number of responses by rcode"""
+
+        self.errors = {}
+        """Number of failed queries by the kind of failure"""
+
+        self.invalid = 0
+        """Number of lines that could not be turned into a query"""
+
+        self.started = None
+        self.finished = None
+        self._sent_at = {}
+
+    def _queries(self):
+        for name, rdtype in self.names:
+            try:
+                query = dns.message.make_query(name, rdtype)
+
+            except Exception as e:
+                self.invalid += 1
+                self.output.write(json.dumps({'name': name, 'type': rdtype, 'error': 'invalid',
+                                              'detail': str(e)}, sort_keys = True) + '\n')
+                continue
+
+            self._sent_at[id(query)] = (name, rdtype, self.reactor.seconds())
+            self.stats.sent(0)
+            yield query
+
+    def run(self):
+        """
+        Resolve every name.
+
+        @return: a deferred that fires with this object once every
+        result has been written
+        @rtype: L{twisted.internet.defer.Deferred}
+        """
+
+        self.started = self.reactor.seconds()
+        batch = self.client.send_queries(self._queries(), self.concurrency, self.timeout, callback = self._result)
+        return batch.done.addCallback(self._done)
+
+    def _result(self, query, result):
+        name, rdtype, sent = self._sent_at.pop(id(query))
+        elapsed = self.reactor.seconds() - sent
+
+        if isinstance(result, failure.Failure):
+            kind = error_name(result)
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            if kind == 'timeout':
+                self.stats.timed_out()
+
+            else:
+                self.stats.failed()
+
+        else:
+            rcode = dns.rcode.to_text(result.rcode())
+            self.rcodes[rcode] = self.rcodes.get(rcode, 0) + 1
+            self.stats.answered(elapsed)
+
+        self.output.write(json.dumps(record(name, rdtype, result, elapsed), sort_keys = True) + '\n')
+
+    def _done(self, batch):
+        self.finished = self.reactor.seconds()
+        self.output.flush()
+        return self
+
+    def summary(self):
+        """
+        @return: the throughput, latency and error counts of the run
+        @rtype: C{dict}
+        """
+
+        seconds = (self.finished or self.reactor.seconds()) - self.started
+        stats = self.stats
+        return {
+            'queries': stats.queries,
+            'responses': stats.responses,
+            'timeouts': stats.timeouts,
+            'failures': stats.failures,
+            'invalid': self.invalid,
+            'rcodes': self.rcodes,
+            'errors': self.errors,
+            'seconds': seconds,
+            'qps': stats.responses / seconds if seconds > 0 else None,
+            'latency_p50': stats.percentile(0.5),
+            'latency_p90': stats.percentile(0.9),
+            'latency_p99': stats.percentile(0.99),
+        }
+
+def make_client(reactor, options, wire_stats, capture = None):
+    if options.rate:
+        limit = txdnspython.limit.Limiter(reactor, rate = options.rate, max_queued = options.concurrency)
+
+    else:
+        limit = None
+
+    if options.transport == 'tcp':
+        return txdnspython.tcp.TcpDnsClient(reactor, options.server, options.port, connections = options.sockets,
+                                            stats = wire_stats, limit = limit, capture = capture)
+
+    if options.transport == 'fallback':
+        client_class = txdnspython.fallback.FallbackDnsClient
+
+    else:
+        client_class = txdnspython.udp.UdpDnsClient
+
+    return client_class(reactor, options.server, options.port, sockets = options.sockets, retries = options.retries,
+                        edns_payload = options.edns, stats = wire_stats, limit = limit, capture = capture)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description = 'Resolve names in bulk and write the results as JSON lines.')
+    parser.add_argument('files', nargs = '*', default = ['-'],
+                        help = 'files of names, one per line and optionally followed by a record type '
+                        '(default: standard input)')
+    parser.add_argument('--server', required = True, help = 'address of the name server')
+    parser.add_argument('--port', default = 53, type = int, help = 'port of the name server (default: 53)')
+    parser.add_argument('--transport', default = 'fallback', choices = ['udp', 'tcp', 'fallback'],
+                        help = 'udp, tcp, or udp with tcp for truncated responses (default: fallback)')
+    parser.add_argument('--type', default = 'A', help = 'record type of names without one (default: A)')
+    parser.add_argument('--concurrency', default = 100, type = int,
+                        help = 'queries in flight (default: 100)')
+    parser.add_argument('--rate', type = float, help = 'the most queries a second (default: no limit)')
+    parser.add_argument('--timeout', default = 5.0, type = float,
+                        help = 'seconds before a query times out (default: 5)')
+    parser.add_argument('--retries', default = 0, type = int,
+                        help = 'times an unanswered UDP query is sent again (default: 0)')
+    parser.add_argument('--sockets', default = 1, type = int,
+                        help = 'UDP sockets or TCP connections (default: 1)')
+    parser.add_argument('--edns', type = int, metavar = 'PAYLOAD',
+                        help = 'add EDNS0 to UDP queries with this payload size (default: no EDNS0)')
+    parser.add_argument('--output', default = '-', help = 'file to write the results to (default: standard output)')
+    parser.add_argument('--summary', help = 'file to write the summary to as JSON')
+    parser.add_argument('--capture', help = 'file to append the queries and responses to, for replaying them '
+                        'with benchmarks/replay.py')
+    return parser.parse_args(argv)
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+
+    return open(path, mode)
+
+def main(argv = None):
+    from twisted.internet import reactor
+
+    options = parse_args(argv)
+
+    files = (_open(path, 'r') for path in options.files)
+    output = _open(options.output, 'w')
+
+    wire_stats = txdnspython.stats.Stats()
+    capture = txdnspython.capture.Capture(options.capture) if options.capture else None
+    client = make_client(reactor, options, wire_stats, capture)
+    bulk = BulkResolver(reactor, client, read_names(files, options.type.upper()), output, options.concurrency,
+                        options.timeout)
+
+    outcome = {}
+
+    def finished(result):
+        client.close()
+        outcome['result'] = result
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: bulk.run().addBoth(finished))
+    reactor.run()
+
+    if capture is not None:
+        capture.close()
+
+    if isinstance(outcome.get('result'), failure.Failure):
+        outcome['result'].printTraceback()
+        return 1
+
+    summary = bulk.summary()
+    wire = wire_stats.snapshot()
+    summary['wire'] = dict((key, wire[key]) for key in ('queries', 'responses', 'retransmissions', 'truncated',
+                                                         'bytes_sent', 'bytes_received'))
+
+    print('{queries} queries in {seconds:.2f}s, {qps:.0f} answered/s, {timeouts} timeouts, {failures} other '
+          'failures, {invalid} invalid'.format(**dict(summary, qps = summary['qps'] or 0.0)), file = sys.stderr)
+    print('latency p50 {} p90 {} p99 {} (seconds, histogram bucket bounds)'.format(
+        summary['latency_p50'], summary['latency_p90'], summary['latency_p99']), file = sys.stderr)
+    if summary['rcodes']:
+        print('rcodes: ' + ', '.join('{} {}'.format(rcode, count) for rcode, count in sorted(summary['rcodes'].items())),
+              file = sys.stderr)
+
+    if summary['errors']:
+        print('errors: ' + ', '.join('{} {}'.format(kind, count) for kind, count in sorted(summary['errors'].items())),
+              file = sys.stderr)
+
+    if options.summary:
+        with open(options.summary, 'w') as summary_file:
+            json.dump(summary, summary_file, indent = 2, sort_keys = True)
+            summary_file.write('\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import collections
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+
+class DnsCache(object):
+    """
+    A cache of responses, bounded in size and evicting the least
+    recently used entry when it is full.
+
+    Responses are cached for the smallest TTL of the RRsets in their
+    answer and authority sections.  Negative responses (NXDOMAIN, or
+    NOERROR without answers) are cached for the TTL of the SOA record
+    in the authority section, capped at the SOA's minimum field as
+    described in RFC 2308; negative responses without an SOA record
+    are not cached.  Truncated responses, responses with any other
+    rcode and responses to TSIG signed queries are never cached.
+    """
+
+    def __init__(self, reactor, max_entries = 10000, max_ttl = 86400, max_negative_ttl = 10800):
+        """
+        Initialize.
+
+        @param reactor: reactor whose clock is used to expire entries
+        @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param max_entries: the most responses to keep
+        @type max_entries: C{int}
+        @param max_ttl: the longest time in seconds to keep a positive response
+        @type max_ttl: C{int}
+        @param max_negative_ttl: the longest time in seconds to keep a negative response
+        @type max_negative_ttl: C{int}
+        """
+
+        self.reactor = reactor
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.max_negative_ttl = max_negative_ttl
+
+        self.entries = collections.OrderedDict()
+        """
+        L{collections.OrderedDict} of cached responses, least
+        recently used first.  The keys are built by L{key} and the
+        values are tuples of the time the entry expires, the time it
+        was stored and the wire format of the response.
+        """
+
+        self.hits = 0
+        """Number of queries answered from the cache"""
+
+        self.misses = 0
+        """Number of queries that were not found in the cache (or had expired)"""
+
+        self.evictions = 0
+        """Number of entries dropped to make room for new ones"""
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, query):
+        """
+        Build the cache key for a query.
+
+        @param query: the query
+        @type query: L{dns.message.Message}
+        @return: the key or C{None} if the query can not be cached
+        """
+
+        if len(query.question) != 1 or query.keyring is not None:
+            return None
+
+        rrset = query.question[0]
+        return (rrset.name, rrset.rdtype, rrset.rdclass,
+                query.flags & (dns.flags.RD | dns.flags.CD),
+                query.ednsflags & dns.flags.DO)
+
+    def get(self, query):
+        """
+        Look up the response to a query.
+
+        @param query: the query
+        @type query: L{dns.message.Message}
+        @return: a fresh copy of the cached response with its ID set
+        to the ID of the query and its TTLs decremented by the time
+        it has spent in the cache, or C{None}
+        @rtype: L{dns.message.Message}
+        """
+
+        key = self.key(query)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, stored, wire_data = entry
+        now = self.reactor.seconds()
+        if now >= expires:
+            self.misses += 1
+            return None
+
+        self.entries[key] = entry
+        self.hits += 1
+
+        response = dns.message.from_wire(wire_data)
+        response.id = query.id
+
+        elapsed = int(now - stored)
+        if elapsed:
+            for section in (response.answer, response.authority, response.additional):
+                for rrset in section:
+                    rrset.ttl = max(rrset.ttl - elapsed, 0)
+
+        return response
+
+    def put(self, response, query):
+        """
+        Store the response to a query if it can be cached.  Meant to
+        be added as a callback to the query's
+        L{twisted.internet.defer.Deferred}.
+
+        @param response: the response
+        @type response: L{dns.message.Message}
+        @param query: the query
+        @type query: L{dns.message.Message}
+        @return: C{response}
+        """
+
+        key = self.key(query)
+        if key is None:
+            return response
+
+        ttl = self.ttl(response)
+        if not ttl:
+            return response
+
+        now = self.reactor.seconds()
+        self.entries.pop(key, None)
+        self.entries[key] = (now + ttl, now, response.to_wire())
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+        return response
+
+    def ttl(self, response):
+        """
+        Work out how long a response may be cached.
+
+        @param response: the response
+        @type response: L{dns.message.Message}
+        @return: the number of seconds, or C{None} if the response
+        can not be cached
+        @rtype: C{int}
+        """
+
+        if response.flags & dns.flags.TC:
+            return None
+
+        rcode = response.rcode()
+
+        if rcode == dns.rcode.NOERROR and response.answer:
+            ttl = min(rrset.ttl for rrset in response.answer + response.authority)
+            return min(ttl, self.max_ttl)
+
+        if rcode in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    ttl = min(rrset.ttl, rrset[0].minimum)
+                    return min(ttl, self.max_negative_ttl)
+
+        return None
+
+    def clear(self):
+        """Drop every entry."""
+
+        self.entries.clear()
+
+    def stats(self):
+        """
+        @return: the cache counters and the number of entries
+        @rtype: C{dict}
+        """
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries)}
@@ -0,0 +1,398 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Record the DNS messages a client exchanges with its servers and play
+them back later.
+
+A L{Capture} handed to a client as C{capture} appends every query the
+client's protocols send and every response they receive to a file,
+each with the time it went out or came in.  L{read} reads the
+records back, L{exchanges} pairs each query with its response, and
+L{ReplayAnswer} and L{Replay} play the exchanges back: the first as
+the C{answer} of a L{txdnspython.testing.StandInServer} that responds
+with the recorded responses, the second by sending the recorded
+queries through a client at the recorded pace or a multiple of it.
+Together they turn a capture of real traffic into a load test that
+runs anywhere.
+
+The file starts with L{MAGIC}, followed by one record per message:
+the kind of message (L{QUERY} or L{RESPONSE}) as a byte, the number
+of the stream it went over as an unsigned int, the time as a double,
+the length of the message as an unsigned short and the message
+itself, all in network byte order.  Each socket or connection a
+client uses is a stream of its own, so that queries that went out
+with the same ID at the same time can be told apart.  Messages are
+recorded without any framing added by the transport, with the query
+ID that was used on the wire.
+"""
+
+import collections
+import struct
+
+from twisted.internet import defer
+
+import dns.message
+import dns.rcode
+
+import txdnspython.template
+
+MAGIC = b'TXDNSCAP\x02'
+"""The first bytes of every capture file"""
+
+QUERY = 0
+"""Kind of record holding a query that was sent"""
+
+RESPONSE = 1
+"""Kind of record holding a response that was received"""
+
+_record = struct.Struct('!BIdH')
+
+class Capture(object):
+    """
+    An append-only file of the queries and responses of one or more
+    clients.  UDP retransmissions are not recorded, only the first
+    time a query goes out.
+    """
+
+    def __init__(self, output):
+        """
+        Initialize.
+
+        @param output: the name of the file to append to, which is
+        created if it does not exist, or a file opened for writing in
+        binary mode, which L{MAGIC} is written to at once
+        @type output: C{str} or file
+        """
+
+        if isinstance(output, str):
+            self.output = open(output, 'ab')
+            self._own_output = True
+            write_magic = self.output.tell() == 0
+
+        else:
+            self.output = output
+            self._own_output = False
+            write_magic = True
+
+        if write_magic:
+            self.output.write(MAGIC)
+
+        self.records = 0
+        """Number of messages recorded"""
+
+        self.streams = 0
+        """Number of streams handed out by L{stream}"""
+
+    def stream(self):
+        """
+        Number a new stream, for a protocol to record its messages
+        under.
+
+        @rtype: C{int}
+        """
+
+        stream = self.streams
+        self.streams += 1
+        return stream
+
+    def record(self, kind, stream, when, wire_data):
+        """
+        Append a message.
+
+        @param kind: L{QUERY} or L{RESPONSE}
+        @type kind: C{int}
+        @param stream: the stream the message went over, as returned
+        by L{stream}
+        @type stream: C{int}
+        @param when: the time the message was sent or received
+        @type when: C{float}
+        @param wire_data: the message
+        @type wire_data: C{str}
+        """
+
+        self.output.write(_record.pack(kind, stream, when, len(wire_data)) + wire_data)
+        self.records += 1
+
+    def flush(self):
+        self.output.flush()
+
+    def close(self):
+        """Flush the records, and close the file if it was opened here."""
+
+        if self._own_output:
+            self.output.close()
+
+        else:
+            self.output.flush()
+
+def read(input):
+    """
+    Read the records of a capture.  A record that was cut short, for
+    example because the capture was still being written, ends the
+    capture.
+
+    @param input: the capture, opened for reading in binary mode
+    @type input: file
+    @return: an iterator of tuples of the kind, the stream, the time
+    and the message
+    @raise ValueError: if the file is not a capture
+    """
+
+    if input.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a txdnspython capture')
+
+    while True:
+        header = input.read(_record.size)
+        if len(header) < _record.size:
+            return
+
+        kind, stream, when, length = _record.unpack(header)
+        wire_data = input.read(length)
+        if len(wire_data) < length:
+            return
+
+        yield kind, stream, when, wire_data
+
+def exchanges(records):
+    """
+    Pair each query with the first response after it that came over
+    the same stream with the same query ID.
+
+    @param records: records as returned by L{read}
+    @return: a list of tuples of the time the query was sent, the
+    query and the response or C{None} if it was never answered, in
+    the order the queries were sent
+    @rtype: C{list}
+    """
+
+    result = []
+    waiting = collections.defaultdict(collections.deque)
+
+    for kind, stream, when, wire_data in records:
+        if len(wire_data) < 2:
+            continue
+
+        if kind == QUERY:
+            exchange = [when, wire_data, None]
+            result.append(exchange)
+            waiting[stream, wire_data[:2]].append(exchange)
+
+        elif kind == RESPONSE:
+            queue = waiting.get((stream, wire_data[:2]))
+            if queue:
+                queue.popleft()[2] = wire_data
+
+    return [tuple(exchange) for exchange in result]
+
+def _question_key(query):
+    question = query.question[0]
+    return (question.name, question.rdtype, question.rdclass)
+
+class ReplayAnswer(object):
+    """
+    An C{answer} for L{txdnspython.testing.StandInServer} that
+    responds to each question with the responses it got when it was
+    recorded, in the order they were recorded and starting over when
+    they run out.  A question that went unanswered when it was
+    recorded goes unanswered again; questions that were never
+    recorded are refused.
+    """
+
+    def __init__(self, exchanges):
+        """
+        @param exchanges: the exchanges to answer with, as returned
+        by L{exchanges}
+        @type exchanges: C{list}
+        """
+
+        self.responses = {}
+        """
+        L{dict} of L{collections.deque}s of the recorded responses
+        (or C{None}s) to each question, indexed by the name, type and
+        class asked for
+        """
+
+        self.skipped = 0
+        """Number of recorded queries that could not be parsed"""
+
+        for when, query_wire, response_wire in exchanges:
+            try:
+                query = dns.message.from_wire(query_wire)
+
+            except Exception:
+                self.skipped += 1
+                continue
+
+            if query.question:
+                self.responses.setdefault(_question_key(query), collections.deque()).append(response_wire)
+
+    def __call__(self, query):
+        if not query.question:
+            responses = None
+
+        else:
+            responses = self.responses.get(_question_key(query))
+
+        if not responses:
+            response = dns.message.make_response(query)
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+
+        response_wire = responses[0]
+        responses.rotate(-1)
+        return response_wire
+
+class Replay(object):
+    """
+    Send recorded queries through a client with the same gaps between
+    them as when they were recorded, divided by C{speed}.  The
+    queries are sent as they were recorded, apart from their query
+    IDs, so traffic that dnspython would render differently is
+    reproduced as well.
+    """
+
+    def __init__(self, reactor, client, exchanges, speed = 1.0, timeout = 5.0, decode = None):
+        """
+        Initialize.
+
+        @param reactor: reactor to pace the queries with
+        @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param client: the client to send the queries through
+        @type client: L{txdnspython.generic.GenericDnsClient}
+        @param exchanges: the exchanges to replay, as returned by
+        L{exchanges}
+        @type exchanges: C{list}
+        @param speed: how many times faster than recorded to send the
+        queries
+        @type speed: C{float}
+        @param timeout: seconds before each query times out
+        @type timeout: C{float}
+        @param decode: how to decode the responses, see
+        L{txdnspython.generic.GenericDnsClient.send_query}
+        @type decode: C{str}
+        """
+
+        self.reactor = reactor
+        self.client = client
+        self.exchanges = exchanges
+        self.speed = speed
+        self.timeout = timeout
+        self.decode = decode
+
+        self.sent = 0
+        """Number of queries sent"""
+
+        self.responses = 0
+        """Number of queries that were answered"""
+
+        self.errors = collections.Counter()
+        """L{collections.Counter} of the failed queries by exception class name"""
+
+        self.skipped = 0
+        """Number of recorded queries that could not be parsed and were not sent"""
+
+        self.done = defer.Deferred()
+        """L{twisted.internet.defer.Deferred} that fires with this object once every query has finished"""
+
+        self._templates = {}
+        self._next = 0
+        self._outstanding = 0
+        self._start = None
+        self._call = None
+
+    def run(self):
+        """
+        Start sending.
+
+        @return: L{done}
+        """
+
+        self._start = self.reactor.seconds()
+        self._send_due()
+        return self.done
+
+    def stop(self):
+        """Send no more queries.  L{done} fires once the ones in flight have finished."""
+
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+
+        self._call = None
+        self._next = len(self.exchanges)
+        self._check_done()
+
+    def _template(self, query_wire):
+        """
+        A query that is sent as C{query_wire}.  Queries that only
+        differ in their ID share one.
+        """
+
+        key = query_wire[2:]
+        template = self._templates.get(key)
+        if template is None:
+            template = txdnspython.template.render(dns.message.from_wire(query_wire))
+            template.wire = query_wire
+            self._templates[key] = template
+
+        return template
+
+    def _send_due(self):
+        self._call = None
+        exchanges = self.exchanges
+        first = exchanges[0][0] if exchanges else 0.0
+        elapsed = (self.reactor.seconds() - self._start) * self.speed
+
+        while self._next < len(exchanges):
+            when, query_wire, response_wire = exchanges[self._next]
+            if when - first > elapsed:
+                self._call = self.reactor.callLater((when - first - elapsed) / self.speed, self._send_due)
+                return
+
+            self._next += 1
+
+            try:
+                query = self._template(query_wire)
+
+            except Exception:
+                self.skipped += 1
+                continue
+
+            self.sent += 1
+            self._outstanding += 1
+            self.client.send_query_callbacks(query, self._answered, self._failed, self.timeout, self.decode)
+
+        self._check_done()
+
+    def _answered(self, response):
+        self.responses += 1
+        self._outstanding -= 1
+        self._check_done()
+
+    def _failed(self, reason):
+        self.errors[type(reason).__name__] += 1
+        self._outstanding -= 1
+        self._check_done()
+
+    def _check_done(self):
+        if self._next >= len(self.exchanges) and not self._outstanding and not self.done.called:
+            self.done.callback(self)
@@ -0,0 +1,220 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Ways of decoding the responses handed to callers.
+
+Parsing a whole response with L{dns.message.from_wire} is the most
+expensive thing the clients do.  Callers that only need part of the
+response can ask for less:
+
+ - L{MESSAGE} (the default) parses the whole response into a
+   L{dns.message.Message}.
+ - L{LAZY} parses the header and question and returns a
+   L{LazyResponse}, which parses the rest of the response the first
+   time one of the other sections is used.
+ - L{HEADER} parses only the header and question and returns a
+   L{ResponseHeader}.
+ - L{RAW} does not parse the response at all and returns the wire
+   data.
+
+Responses to queries that are signed with TSIG are always parsed
+completely so that the signature is checked.
+"""
+
+import struct
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.query
+import dns.rcode
+
+MESSAGE = 'message'
+"""Parse the whole response into a L{dns.message.Message}"""
+
+LAZY = 'lazy'
+"""Return a L{LazyResponse} that parses the sections when they are first used"""
+
+HEADER = 'header'
+"""Return a L{ResponseHeader} with only the header and question parsed"""
+
+RAW = 'raw'
+"""Return the wire data of the response without parsing it"""
+
+_header = struct.Struct('!HHHHHH')
+_question = struct.Struct('!HH')
+
+class ResponseHeader(object):
+    """
+    The header and question section of a response.
+    """
+
+    def __init__(self, wire_data):
+        """
+        Parse the header and question section.
+
+        @param wire_data: the response
+        @type wire_data: C{str}
+        @raise dns.exception.FormError: if the response is too short
+        """
+
+        if len(wire_data) < 12:
+            raise dns.message.ShortHeader
+
+        self.wire = wire_data
+        """The wire data of the response"""
+
+        (self.id, self.flags, self.qdcount, self.ancount,
+         self.nscount, self.arcount) = _header.unpack_from(wire_data)
+
+        self.questions = []
+        """
+        L{list} of tuples of the L{dns.name.Name}, rdtype and
+        rdclass of each question.
+        """
+
+        offset = 12
+        for i in range(self.qdcount):
+            name, used = dns.name.from_wire(wire_data, offset)
+            offset += used
+            if len(wire_data) < offset + 4:
+                raise dns.exception.FormError
+
+            rdtype, rdclass = _question.unpack_from(wire_data, offset)
+            offset += 4
+            self.questions.append((name, rdtype, rdclass))
+
+    def opcode(self):
+        return dns.opcode.from_flags(self.flags)
+
+    def rcode(self):
+        """
+        The rcode from the header.  Extended rcodes, which are kept
+        in the EDNS OPT record, are not seen.
+        """
+
+        return dns.rcode.from_flags(self.flags, 0)
+
+    def is_response_to(self, query):
+        """
+        Check the header against the query in the same way as
+        L{dns.message.Message.is_response}.
+
+        @param query: the query
+        @type query: L{dns.message.Message}
+        @rtype: C{bool}
+        """
+
+        if self.flags & dns.flags.QR == 0 or self.id != query.id or \
+           dns.opcode.from_flags(self.flags) != query.opcode():
+            return False
+
+        if self.rcode() != dns.rcode.NOERROR or dns.opcode.is_update(self.flags):
+            return True
+
+        asked = set((rrset.name, rrset.rdtype, rrset.rdclass) for rrset in query.question)
+        return asked == set(self.questions)
+
+class LazyResponse(ResponseHeader):
+    """
+    A response whose header and question have been parsed.  The
+    first time any other attribute of L{dns.message.Message} is used,
+    the whole response is parsed and the attribute is taken from the
+    result.
+    """
+
+    def __init__(self, wire_data, one_rr_per_rrset = False):
+        ResponseHeader.__init__(self, wire_data)
+        self.one_rr_per_rrset = one_rr_per_rrset
+        self._message = None
+
+    @property
+    def message(self):
+        """The fully parsed L{dns.message.Message}"""
+
+        if self._message is None:
+            self._message = dns.message.from_wire(self.wire, one_rr_per_rrset = self.one_rr_per_rrset)
+
+        return self._message
+
+    def rcode(self):
+        if self._message is not None:
+            return self._message.rcode()
+
+        return ResponseHeader.rcode(self)
+
+    def __getattr__(self, name):
+        # only called for attributes that the header does not have
+        if name.startswith('__') or name == '_message':
+            raise AttributeError(name)
+
+        return getattr(self.message, name)
+
+def decode(wire_data, query, mode, one_rr_per_rrset = False):
+    """
+    Decode a response the way the caller asked for.  The ID of the
+    response is set to the ID of C{query} and the response is checked
+    against the query as far as C{mode} allows.
+
+    @param wire_data: the response
+    @type wire_data: C{str}
+    @param query: the query the response is for
+    @type query: L{dns.message.Message}
+    @param mode: one of L{MESSAGE}, L{LAZY}, L{HEADER} or L{RAW}
+    @type mode: C{str}
+    @param one_rr_per_rrset: put each RR into its own RRset
+    @type one_rr_per_rrset: C{bool}
+    @raise dns.query.BadResponse: if the response does not answer the query
+    """
+
+    if mode == MESSAGE or query.keyring is not None:
+        response = dns.message.from_wire(wire_data,
+                                         keyring = query.keyring,
+                                         request_mac = query.mac,
+                                         one_rr_per_rrset = one_rr_per_rrset)
+        response.id = query.id
+
+        if not query.is_response(response):
+            raise dns.query.BadResponse
+
+        return response
+
+    wire_data = struct.pack('!H', query.id) + wire_data[2:]
+
+    if mode == RAW:
+        return wire_data
+
+    if mode == LAZY:
+        response = LazyResponse(wire_data, one_rr_per_rrset)
+
+    elif mode == HEADER:
+        response = ResponseHeader(wire_data)
+
+    else:
+        raise ValueError('unknown decode mode {!r}'.format(mode))
+
+    if not response.is_response_to(query):
+        raise dns.query.BadResponse
+
+    return response
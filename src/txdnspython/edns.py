@@ -0,0 +1,194 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+EDNS0 for the UDP client: adding an OPT record to queries that do not
+have one, and learning how large a payload size a server can be sent
+answers at without them getting lost.
+
+Advertising a large UDP payload size saves the round trip over TCP
+that a truncated response costs, but an answer that is larger than
+the path MTU is fragmented, and fragments are often dropped by
+firewalls and middleboxes, so the query just times out.
+L{PayloadSize} starts at the configured size and steps down a ladder
+of sizes when queries keep timing out at the current one, and goes
+back up after a while to find out whether the path has changed.
+"""
+
+import struct
+
+_opt = struct.Struct('!BHHIH')
+"""Root owner name, type, class (the payload size), TTL (the extended flags) and data length of an OPT record"""
+
+_arcount = struct.Struct('!H')
+
+OPT = 41
+"""The type of the OPT record"""
+
+def add_opt(wire_data, payload):
+    """
+    Add an OPT record without options to the end of a query that has
+    none, and count it in the additional section.  The query must not
+    be TSIG signed, because the TSIG record has to stay the last
+    record of the message.
+
+    @param wire_data: the query
+    @type wire_data: C{str}
+    @param payload: the UDP payload size to advertise
+    @type payload: C{int}
+    @rtype: C{str}
+    """
+
+    (arcount,) = _arcount.unpack_from(wire_data, 10)
+    return wire_data[:10] + _arcount.pack(arcount + 1) + wire_data[12:] + _opt.pack(0, OPT, payload, 0, 0)
+
+def advertised(wire_data):
+    """
+    The UDP payload size a query advertises, if its last record is an
+    OPT record without options, as L{add_opt} leaves it.
+
+    @param wire_data: the query
+    @type wire_data: C{str}
+    @return: the payload size, or C{None}
+    @rtype: C{int}
+    """
+
+    if len(wire_data) < 12 + _opt.size or _arcount.unpack_from(wire_data, 10)[0] == 0:
+        return None
+
+    owner, rdtype, payload, ttl, rdlength = _opt.unpack_from(wire_data, len(wire_data) - _opt.size)
+    if owner != 0 or rdtype != OPT or rdlength != 0:
+        return None
+
+    return payload
+
+def set_advertised(wire_data, payload):
+    """
+    Change the payload size of a query for which L{advertised} is not
+    C{None}.
+
+    @rtype: C{str}
+    """
+
+    return wire_data[:-8] + struct.pack('!H', payload) + wire_data[-6:]
+
+class PayloadSize(object):
+    """
+    The EDNS0 UDP payload size to advertise to one server, learnt
+    from which queries are answered and which time out.
+
+    Each time a query that advertised the current size times out
+    counts as a failure.  A response that is larger than the next
+    size down shows that large answers get through, and clears the
+    failures.  After C{threshold} failures the size steps down to the
+    next one, and after C{reprobe} seconds at a smaller size it steps
+    back up to try the larger one again.  Responses smaller than the
+    next size down say nothing about large answers, so they leave the
+    failures alone.
+    """
+
+    def __init__(self, reactor, payload = 1232, sizes = None, threshold = 3, reprobe = 600.0):
+        """
+        @param reactor: what to read the time from
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
+        @param payload: the largest size to advertise.  The default of
+        1232 bytes fits an IPv6 packet into the minimum MTU of 1280
+        bytes, so it is rarely fragmented.
+        @type payload: C{int}
+        @param sizes: the smaller sizes to step down to.  If C{None},
+        the default, 1232 (if that is smaller than C{payload}) and 512.
+        @type sizes: C{list} of C{int}
+        @param threshold: how many timeouts at a size it takes to step
+        down
+        @type threshold: C{int}
+        @param reprobe: seconds to wait after stepping down before
+        trying the larger size again, or C{None} never to go back up
+        @type reprobe: C{float}
+        """
+
+        if sizes is None:
+            sizes = [size for size in (1232, 512) if size < payload]
+
+        self.reactor = reactor
+
+        self.sizes = sorted(set([payload] + [size for size in sizes if size < payload]), reverse = True)
+        """The sizes to advertise, from largest to smallest"""
+
+        self.threshold = threshold
+        self.reprobe = reprobe
+
+        self.level = 0
+        """Index of the current size in L{sizes}"""
+
+        self.failures = 0
+        """Timeouts at the current size since the last large response"""
+
+        self.changed_at = None
+        """When the size last stepped down or up, or C{None}"""
+
+        self.step_downs = 0
+        """Number of times the size stepped down"""
+
+    def current(self):
+        """
+        The size to advertise in the next query.
+
+        @rtype: C{int}
+        """
+
+        if self.level and self.reprobe is not None and self.reactor.seconds() - self.changed_at >= self.reprobe:
+            self._step(-1)
+
+        return self.sizes[self.level]
+
+    def timed_out(self, payload):
+        """
+        Count a query that advertised C{payload} and was not answered.
+
+        @type payload: C{int}
+        """
+
+        if payload != self.sizes[self.level] or self.level == len(self.sizes) - 1:
+            return
+
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.step_downs += 1
+            self._step(1)
+
+    def answered(self, payload, size):
+        """
+        Count a response of C{size} bytes to a query that advertised
+        C{payload}.
+
+        @type payload: C{int}
+        @type size: C{int}
+        """
+
+        if payload == self.sizes[self.level] and self.level < len(self.sizes) - 1 and \
+           size > self.sizes[self.level + 1]:
+            self.failures = 0
+
+    def _step(self, direction):
+        self.level += direction
+        self.failures = 0
+        self.changed_at = self.reactor.seconds()
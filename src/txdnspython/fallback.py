@@ -0,0 +1,119 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.internet import defer
+
+import dns.exception
+
+import txdnspython.tcp
+import txdnspython.udp
+
+class FallbackDnsClient(txdnspython.udp.UdpDnsClient):
+    """
+    A UDP client that repeats a query over TCP when the UDP response
+    comes back truncated.
+
+    The truncated response is recognized from its header, before it
+    is parsed, and the query is sent over a single
+    L{txdnspython.tcp.TcpDnsClient} to the same server that is
+    created on the first truncated response and kept for the ones
+    after it.  The caller's L{twisted.internet.defer.Deferred} is
+    fired with the TCP response, and the TCP query only gets the part
+    of the caller's timeout that was left when the truncated
+    response arrived.
+    """
+
+    def __init__(self, reactor, address, port = 53, one_rr_per_rrset = False, tcp_connections = 1,
+                 tcp_idle_timeout = None, **kwargs):
+        """
+        Initialize the client object.
+
+        @param tcp_connections: The maximum number of TCP connections
+        to use for repeated queries.
+        @type tcp_connections: int
+
+        @param tcp_idle_timeout: The number of seconds a TCP
+        connection may sit idle before it is closed.  If None, the
+        default, idle connections are kept open.
+        @type tcp_idle_timeout: float
+
+        The other arguments are the same as for
+        L{txdnspython.udp.UdpDnsClient}.
+        """
+
+        txdnspython.udp.UdpDnsClient.__init__(self, reactor, address, port, one_rr_per_rrset, **kwargs)
+
+        self.address = address
+        self.port = port
+        self.one_rr_per_rrset = one_rr_per_rrset
+        self.tcp_connections = tcp_connections
+        self.tcp_idle_timeout = tcp_idle_timeout
+
+        self.tcp = None
+        """The L{txdnspython.tcp.TcpDnsClient} truncated queries are repeated over, once it is needed"""
+
+        self.truncated = 0
+        """Number of truncated responses received"""
+
+        self.fallbacks = 0
+        """Number of queries repeated over TCP"""
+
+        self.fallback_failures = 0
+        """Number of queries repeated over TCP that failed"""
+
+    def _build_protocol(self):
+        protocol = txdnspython.udp.UdpDnsClient._build_protocol(self)
+        protocol.truncated = self._truncated
+        return protocol
+
+    def _truncated(self, query, query_response, timeout, decode):
+        self.truncated += 1
+
+        if timeout is not None and timeout <= 0:
+            query_response.errback(dns.exception.Timeout())
+            return
+
+        if self.tcp is None:
+            self.tcp = txdnspython.tcp.TcpDnsClient(self.reactor, self.address, self.port, self.one_rr_per_rrset,
+                                                    connections = self.tcp_connections,
+                                                    idle_timeout = self.tcp_idle_timeout,
+                                                    timer = self.timer, stats = self.stats,
+                                                    capture = self.capture)
+
+        self.fallbacks += 1
+
+        # the TCP leg gets its own deferred so that its failures are
+        # counted before the caller's callbacks see them
+        over_tcp = defer.Deferred()
+        over_tcp.addErrback(self._ebFallback)
+        over_tcp.addCallbacks(query_response.callback, query_response.errback)
+        self.tcp._dispatch(query, over_tcp, timeout, decode)
+
+    def _ebFallback(self, reason):
+        self.fallback_failures += 1
+        return reason
+
+    def close(self):
+        txdnspython.udp.UdpDnsClient.close(self)
+
+        if self.tcp is not None:
+            self.tcp.close()
+            self.tcp = None
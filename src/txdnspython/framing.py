@@ -0,0 +1,108 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import struct
+
+_length = struct.Struct('!H')
+
+def frame(wire_data):
+    """
+    Put the two byte length in front of a DNS message to send it over
+    TCP.
+
+    @type wire_data: C{str}
+    @rtype: C{str}
+    """
+
+    return _length.pack(len(wire_data)) + wire_data
+
+class MessageFraming(object):
+    """
+    Split a TCP stream into the DNS messages in it, each of which is
+    preceded by its length as described in RFC 1035 section 4.2.2.
+    Every complete message is passed to C{_process_response}, which
+    the class this is mixed into provides.  Frames with a length of
+    zero hold no message and are dropped.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        """
+        L{list} of the pieces of a message whose remainder has not
+        been received yet, or the first byte of its length.  The
+        pieces are only joined once the message is complete, so a
+        large message that arrives over many reads is copied once.
+        """
+
+        self.received = 0
+        """The number of bytes of the message that are in L{chunks}"""
+
+        self.waiting_for = None
+        """The length of the message in L{chunks}, once it is known"""
+
+    def dataReceived(self, data):
+        chunks = self.chunks
+        process_response = self._process_response
+        offset = 0
+        end = len(data)
+
+        if chunks:
+            # complete the message that was cut off by an earlier read,
+            # taking only as much of the new data as it needs
+            if self.waiting_for is None:
+                (self.waiting_for,) = _length.unpack(chunks[0] + data[:1])
+                del chunks[:]
+                self.received = 0
+                offset = 1
+
+            needed = offset + self.waiting_for - self.received
+            if end < needed:
+                chunks.append(data[offset:])
+                self.received += end - offset
+                return
+
+            chunks.append(data[offset:needed])
+            wire_data = b''.join(chunks)
+            del chunks[:]
+            self.waiting_for = None
+            offset = needed
+
+            if wire_data:
+                process_response(wire_data)
+
+        # walk the complete messages in the rest of the data with an
+        # offset, so the only copies made are the messages themselves
+        unpack_from = _length.unpack_from
+        while end - offset >= 2:
+            (length,) = unpack_from(data, offset)
+            start = offset + 2
+            if end - start < length:
+                self.waiting_for = length
+                offset = start
+                break
+
+            offset = start + length
+            if length:
+                process_response(data[start:offset])
+
+        if offset < end or self.waiting_for is not None:
+            chunks.append(data[offset:])
+            self.received = end - offset
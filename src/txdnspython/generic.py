@@ -19,17 +19,223 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import array
+import collections
+import copy
+import random
 import struct
-import time
 
+from twisted.internet import defer
+from twisted.internet import error
 from twisted.python import failure
 from twisted.python import log
 
 import dns.exception
-import dns.message
+import dns.flags
+
+import txdnspython.batch
+import txdnspython.capture
+import txdnspython.decode
+
+QUEUE = 'queue'
+"""
+Policy for when all query IDs are in use: hold new queries until an
+ID is released.
+"""
+
+FAIL = 'fail'
+"""
+Policy for when all query IDs are in use: fail new queries
+immediately with L{QueryIdsExhausted}.
+"""
+
+_TC = dns.flags.TC >> 8
+"""The TC flag as it appears in the third byte of a message"""
+
+_query_id = struct.Struct('!H')
+
+_HEADER_SIZE = 12
+"""The size of the header every DNS message starts with"""
+
+def _question(wire_data, offset = 0):
+    """
+    The question section of a message, in lower case so that it can
+    be compared with the question of another message.
+
+    @param wire_data: the message
+    @type wire_data: C{str}
+    @param offset: where the message starts in C{wire_data}
+    @type offset: C{int}
+    @return: the question section, or C{None} if the message is too
+    short to hold its header or the questions its header counts
+    @rtype: C{str}
+    """
+
+    if len(wire_data) < offset + _HEADER_SIZE:
+        return None
+
+    (qdcount,) = _query_id.unpack_from(wire_data, offset + 4)
+    start = end = offset + _HEADER_SIZE
+    for i in range(qdcount):
+        while True:
+            if end >= len(wire_data):
+                return None
+
+            length = ord(wire_data[end:end + 1])
+            if length >= 0xc0:
+                end += 2
+                break
+
+            end += length + 1
+            if length == 0:
+                break
+
+        end += 4
+
+    if end > len(wire_data):
+        return None
+
+    return wire_data[start:end].lower()
+
+class QueryIdsExhausted(dns.exception.DNSException):
+    """All 65,536 query IDs are in use."""
+
+class QueryIdAllocator(object):
+    """
+    Hand out query IDs that are not currently in use.
+
+    The free IDs are kept in a compact array of unsigned shorts.  An
+    ID is allocated by picking a random slot in the array and filling
+    the hole with the last entry, so both allocating and releasing an
+    ID take constant time and the IDs stay unpredictable.
+    """
+
+    def __init__(self):
+        self.free = array.array('H', range(65536))
+        """L{array.array} holding every query ID that is not in use."""
+
+        self._random = random.Random().random
+
+    def __len__(self):
+        return len(self.free)
+
+    def allocate(self):
+        """
+        Allocate a query ID.
+
+        @return: an unused query ID or C{None} if all IDs are in use.
+        @rtype: C{int}
+        """
+
+        free = self.free
+        if not free:
+            return None
+
+        index = int(self._random() * len(free))
+        query_id = free[index]
+        free[index] = free[-1]
+        free.pop()
+        return query_id
+
+    def release(self, query_id):
+        """
+        Return a query ID to the pool.
+
+        @param query_id: an ID previously returned by L{allocate}
+        @type query_id: C{int}
+        """
+
+        self.free.append(query_id)
+
+class PendingQuery(object):
+    """
+    A query that has been sent and not yet answered, as kept in
+    L{GenericDnsClientProtocol.pending}.
+    """
+
+    __slots__ = ('query', 'query_response', 'delayed_call', 'decode', 'question')
+
+    def __init__(self, query, query_response, delayed_call, decode, question = None):
+        self.query = query
+        """The L{dns.message.Message} that was sent"""
+
+        self.query_response = query_response
+        """
+        What to hand the result to, a
+        L{twisted.internet.defer.Deferred} or L{QueryCallbacks}
+        """
+
+        self.delayed_call = delayed_call
+        """The L{twisted.internet.base.DelayedCall} of the timeout, or C{None}"""
+
+        self.decode = decode
+        """How the response is to be decoded (see L{txdnspython.decode})"""
+
+        self.question = question
+        """
+        The question section of the query as sent, in lower case, or
+        C{None} not to check the question of the response
+        """
+
+class QueryCallbacks(object):
+    """
+    Hands the result of a query to a pair of plain callables.
+
+    The protocols and clients only ever call C{callback} or
+    C{errback} once and look at C{called}, so this stands in for a
+    L{twisted.internet.defer.Deferred} at a fraction of the cost.
+    Errors are handed over as exceptions rather than
+    L{twisted.python.failure.Failure}s, and timeouts never create a
+    Failure at all.
+    """
+
+    __slots__ = ('on_response', 'on_error', 'called')
+
+    def __init__(self, on_response, on_error):
+        """
+        Initialize.
+
+        @param on_response: called with the response
+        @type on_response: callable
+        @param on_error: called with the exception the query failed
+        with, for example L{dns.exception.Timeout}
+        @type on_error: callable
+        """
+
+        self.on_response = on_response
+        self.on_error = on_error
+        self.called = False
+
+    def callback(self, result):
+        self.called = True
+
+        try:
+            self.on_response(result)
+
+        except Exception:
+            log.err(None, 'Unhandled error in query callback')
+
+    def errback(self, reason):
+        self.called = True
+
+        if isinstance(reason, failure.Failure):
+            reason = reason.value
+
+        try:
+            self.on_error(reason)
+
+        except Exception:
+            log.err(None, 'Unhandled error in query errback')
 
 class GenericDnsClientProtocol(object):
-    def __init__(self, reactor, one_rr_per_rrset):
+    id_offset = 0
+    """
+    Offset of the query ID in the wire data passed to L{_send_query}.
+    Subclasses that prepend framing to the DNS message must adjust
+    this.
+    """
+
+    def __init__(self, reactor, one_rr_per_rrset, exhausted_policy = QUEUE, timer = None, stats = None):
         """
         Initialize.
 
@@ -37,6 +243,16 @@ class GenericDnsClientProtocol(object):
         @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
         @param one_rr_per_rrset: put each RR into its own RRset
         @type one_rr_per_rrset: C{bool}
+        @param exhausted_policy: what to do with new queries when all
+        query IDs are in use, either L{QUEUE} or L{FAIL}
+        @type exhausted_policy: C{str}
+        @param timer: what to schedule query timeouts with instead of
+        the reactor, for example a shared
+        L{txdnspython.timer.TimerWheel}
+        @type timer: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param stats: what to count queries, responses and latencies
+        in, or C{None} to not count them
+        @type stats: L{txdnspython.stats.Stats}
         """
 
         self.reactor = reactor
@@ -46,21 +262,92 @@ class GenericDnsClientProtocol(object):
         delayed calls to implement timeouts.
         """
 
+        self.timer = reactor if timer is None else timer
+        """
+        Object that implements
+        L{twisted.internet.interfaces.IReactorTime} - used to schedule
+        query timeouts.
+        """
+
         self.one_rr_per_rrset = one_rr_per_rrset
         """Whether to put each RR into its own RRset"""
 
+        self.exhausted_policy = exhausted_policy
+        """What to do with new queries when all query IDs are in use"""
+
+        self.ids = QueryIdAllocator()
+        """
+        L{QueryIdAllocator} that hands out the IDs that are written
+        into outgoing queries.  The ID that the caller put into the
+        query is never sent over the wire, so callers do not need to
+        worry about picking unique IDs.
+        """
+
         self.pending = {}
         """
         L{dict} for keeping track of queries that have been sent to
         the remote nameserver but have not been responded to. The
-        dictionary is indexed by the C{id} parameter of the
-        L{dns.message.Message} object (the query ID).  The values are
-        tuples of L{dns.message.Message},
-        L{twisted.internet.defer.Deferred}, and
-        L{twisted.internet.base.DelayedCall} (or C{None} if there is
-        no timeout associated with the query).
+        dictionary is indexed by the query ID that was allocated from
+        L{ids} and written into the wire data.  The values are
+        L{PendingQuery} records.
+        """
+
+        self.stats = stats
+        """
+        L{txdnspython.stats.Stats} that the traffic of the protocol is
+        counted in, or C{None}.  Sizes are those of the DNS messages,
+        without any framing added by the transport.
+        """
+
+        self.sent_at = {}
+        """
+        L{dict} of the times the queries in L{pending} were sent,
+        indexed by query ID.  Only kept while L{stats} is set.
+        """
+
+        self.truncated = None
+        """
+        Callable that takes over queries whose response has the TC
+        (truncated) flag set, or C{None} to hand truncated responses
+        to the caller like any other response.  It is called with the
+        L{dns.message.Message}, the
+        L{twisted.internet.defer.Deferred}, the number of seconds
+        left before the query times out (or C{None}) and the decode
+        mode of the query.
+        """
+
+        self.capture = None
+        """
+        L{txdnspython.capture.Capture} that the queries sent and the
+        responses received are recorded in, or C{None}
+        """
+
+        self.capture_stream = 0
+        """The number of the stream L{capture} records are made under"""
+
+        self.waiting = collections.deque()
+        """
+        L{collections.deque} of queries that could not be sent
+        because all query IDs were in use.  The values are tuples of
+        the wire data, L{dns.message.Message},
+        L{twisted.internet.defer.Deferred},
+        L{twisted.internet.base.DelayedCall} (or C{None}), and the
+        decode mode.  Entries whose
+        L{twisted.internet.defer.Deferred} has already fired (because
+        they timed out) are skipped when the queue is drained.
+        """
+
+    def load(self):
+        """
+        The number of queries that are pending or waiting for a
+        query ID.  Used by clients that spread queries over several
+        protocols to find the least loaded one.
+
+        @rtype: C{int}
         """
 
+        return len(self.pending) + len(self.waiting)
+
     def _process_response(self, wire_data):
         """
         Process the raw data retrieved from the remote name server.
@@ -69,38 +356,101 @@ class GenericDnsClientProtocol(object):
         query.  Cancel the L{twisted.internet.base.DelayedCall} that
         may be associated with the query as well.
 
+        A response too short to hold a DNS header, or whose question
+        section is not that of the query sent with its ID, such as a late answer to an earlier query
+        whose ID has since been reused, is counted as unmatched and
+        the query is left waiting for its own response.
+
+        The response is decoded as the query asked for (see
+        L{txdnspython.decode}) and its ID is set back to the ID of
+        the original query before it is handed to the caller.
+
         @param wire_data: the raw data received from the remote DNS
         server, after removing any framing that may be required by the
         underlying transport.
         @type wire_data: C{str}
         """
 
-        (query_id,) = struct.unpack('!H', wire_data[:2])
-        
-        if query_id not in self.pending:
+        stats = self.stats
+        if stats is not None:
+            stats.received(len(wire_data))
+
+        if len(wire_data) < _HEADER_SIZE:
+            if stats is not None:
+                stats.unmatched_response()
+
+            log.msg('Response of {} bytes is too short to hold a DNS header!'.format(len(wire_data)))
+            return
+
+        (query_id,) = _query_id.unpack_from(wire_data)
+
+        if self.capture is not None:
+            self.capture.record(txdnspython.capture.RESPONSE, self.capture_stream, self.reactor.seconds(), wire_data)
+
+        entry = self.pending.get(query_id)
+        if entry is None:
+            if stats is not None:
+                stats.unmatched_response()
+
             log.msg('No query with ID {} found to match received response!'.format(query_id))
             return
 
-        query, query_response, delayed_call = self.pending.pop(query_id)
-        
+        if entry.question is not None:
+            # a response that echoes no question cannot be checked
+            question = _question(wire_data)
+            if question and question != entry.question:
+                if stats is not None:
+                    stats.unmatched_response()
+
+                log.msg('Response with ID {} does not match the question of the query!'.format(query_id))
+                return
+
+        self._matched(query_id, wire_data)
+        del self.pending[query_id]
+
+        query_response = entry.query_response
+        delayed_call = entry.delayed_call
+
+        truncated = self.truncated is not None and ord(wire_data[2:3]) & _TC
+        timeout = None
+
         if delayed_call and delayed_call.active():
+            if truncated:
+                timeout = delayed_call.getTime() - self.reactor.seconds()
+
             delayed_call.cancel()
 
-        response = dns.message.from_wire(wire_data,
-                                         keyring = query.keyring,
-                                         request_mac = query.mac,
-                                         one_rr_per_rrset = self.one_rr_per_rrset)
-        
-        if query.is_response(response):
-            query_response.callback(response)
-            
+        if stats is not None:
+            sent = self.sent_at.pop(query_id, None)
+            if sent is not None:
+                stats.answered(self.reactor.seconds() - sent)
+
+        self._release_id(query_id)
+
+        if truncated:
+            if stats is not None:
+                stats.truncated_response()
+
+            self.truncated(entry.query, query_response, timeout, entry.decode)
+            return
+
+        try:
+            response = txdnspython.decode.decode(wire_data, entry.query, entry.decode, self.one_rr_per_rrset)
+
+        except Exception:
+            query_response.errback(failure.Failure())
+
         else:
-            query_response.errback(failure.Failure(BadResponse()))
+            query_response.callback(response)
 
-    def _send_query(self, wire_data, query, query_response, timeout):
+    def _send_query(self, wire_data, query, query_response, timeout, decode = txdnspython.decode.MESSAGE):
         """
         Actually send the query over the wire and handle bookeeping.
 
+        A query ID is allocated from L{ids} and written into the wire
+        data at L{id_offset}.  If no ID is available the query is
+        handled according to L{exhausted_policy}.
+
         @param wire_data: the raw data that is to be sent over the
         wire, created by calling to_wire() on the query object, plus
         any framing that may be needed by the underlying transport.
@@ -116,20 +466,179 @@ class GenericDnsClientProtocol(object):
         @param timeout: The number of seconds to wait before the query
         times out. If C{None}, the default, wait forever.
         @type timeout: C{float}
+
+        @param decode: how to decode the response, one of the modes
+        in L{txdnspython.decode}
+        @type decode: C{str}
         """
-        if timeout:
-            if timeout <= 0:
-                query_response.errback(dms.exception.Timeout)
+
+        if timeout and timeout <= 0:
+            query_response.errback(dns.exception.Timeout())
+            return
+
+        query_id = self.ids.allocate()
+
+        if query_id is None:
+            if self.exhausted_policy == FAIL:
+                query_response.errback(failure.Failure(QueryIdsExhausted()))
                 return
 
-            delayed_call = self.reactor.callLater(timeout, self._timeout, query.id)
+            if timeout:
+                delayed_call = self.timer.callLater(timeout, self._timeout_waiting, query_response)
+
+            else:
+                delayed_call = None
+
+            self.waiting.append((wire_data, query, query_response, delayed_call, decode))
+            return
+
+        if timeout:
+            delayed_call = self.timer.callLater(timeout, self._timeout, query_id)
 
         else:
             delayed_call = None
 
-        self.pending[query.id] = (query, query_response, delayed_call)
+        offset = self.id_offset
+        if offset:
+            wire_data = wire_data[:offset] + _query_id.pack(query_id) + wire_data[offset + 2:]
+
+        else:
+            wire_data = _query_id.pack(query_id) + wire_data[2:]
+
+        self.pending[query_id] = PendingQuery(query, query_response, delayed_call, decode, _question(wire_data, offset))
+
+        if self.stats is not None:
+            self.sent_at[query_id] = self.reactor.seconds()
+            self.stats.sent(len(wire_data) - offset)
+
+        if self.capture is not None:
+            self.capture.record(txdnspython.capture.QUERY, self.capture_stream, self.reactor.seconds(),
+                                wire_data[offset:])
+
+        self._write(query_id, wire_data)
+
+    def _write(self, query_id, wire_data):
+        """
+        Write a query to the transport once its ID has been allocated
+        and it has been added to L{pending}.  Subclasses that need to
+        see every query that goes out, for example to retransmit it,
+        override this.
+
+        @param query_id: the ID written into the wire data
+        @type query_id: C{int}
+        @param wire_data: the data to write
+        @type wire_data: C{str}
+        """
+
         self.transport.write(wire_data)
 
+    def _matched(self, query_id, wire_data):
+        """
+        Called with a response once it has been matched to its query,
+        while the query is still in L{pending}.  Subclasses that learn
+        from the responses to their queries override this.
+
+        @param query_id: the ID of the query
+        @type query_id: C{int}
+        @param wire_data: the response
+        @type wire_data: C{str}
+        """
+
+    def _release_id(self, query_id):
+        """
+        Return a query ID to the pool and send the next query that
+        was waiting for one, if any.
+
+        @param query_id: the ID to release
+        @type query_id: C{int}
+        """
+
+        self.ids.release(query_id)
+
+        while self.waiting:
+            wire_data, query, query_response, delayed_call, decode = self.waiting.popleft()
+            if query_response.called:
+                continue
+
+            if delayed_call:
+                delayed_call.cancel()
+                timeout = delayed_call.getTime() - self.reactor.seconds()
+                if timeout <= 0:
+                    query_response.errback(dns.exception.Timeout())
+                    continue
+
+            else:
+                timeout = None
+
+            self._send_query(wire_data, query, query_response, timeout, decode)
+            return
+
+    def _take_waiting(self):
+        """
+        Remove every query that is waiting for a query ID so that it
+        can be sent somewhere else.
+
+        @return: a list of tuples of L{dns.message.Message},
+        L{twisted.internet.defer.Deferred}, the number of seconds
+        left before the query times out (or C{None} if it has no
+        timeout), and the decode mode.  Queries that have already run out of time are
+        failed instead of being returned.
+        @rtype: C{list}
+        """
+
+        waiting, self.waiting = self.waiting, collections.deque()
+        result = []
+
+        for wire_data, query, query_response, delayed_call, decode in waiting:
+            if query_response.called:
+                continue
+
+            if delayed_call:
+                delayed_call.cancel()
+                timeout = delayed_call.getTime() - self.reactor.seconds()
+                if timeout <= 0:
+                    query_response.errback(dns.exception.Timeout())
+                    continue
+
+            else:
+                timeout = None
+
+            result.append((query, query_response, timeout, decode))
+
+        return result
+
+    def _fail_all(self, reason):
+        """
+        Fail every query that is pending or waiting for a query ID,
+        for example because the underlying connection has been lost.
+
+        @param reason: the reason passed to each query's errback
+        @type reason: L{twisted.python.failure.Failure}
+        """
+
+        pending, self.pending = self.pending, {}
+        waiting, self.waiting = self.waiting, collections.deque()
+        sent_at, self.sent_at = self.sent_at, {}
+
+        for query_id, entry in pending.items():
+            self.ids.release(query_id)
+
+            delayed_call = entry.delayed_call
+            if delayed_call and delayed_call.active():
+                delayed_call.cancel()
+
+            if self.stats is not None and query_id in sent_at:
+                self.stats.failed()
+
+            entry.query_response.errback(reason)
+
+        for wire_data, query, query_response, delayed_call, decode in waiting:
+            if delayed_call and delayed_call.active():
+                delayed_call.cancel()
+
+            if not query_response.called:
+                query_response.errback(reason)
+
     def _timeout(self, query_id):
         """Callback used to implement request timeouts.
 
@@ -137,6 +646,344 @@ class GenericDnsClientProtocol(object):
         @type query_id: C{int}
         """
 
-        if self.pending.has_key(query_id):
-            query, query_response, delayed_call = self.pending.pop(query_id)
-            query_response.errback(failure.Failure(dns.exception.Timeout()))
+        entry = self.pending.pop(query_id, None)
+        if entry is not None:
+            if self.stats is not None and self.sent_at.pop(query_id, None) is not None:
+                self.stats.timed_out()
+
+            self._release_id(query_id)
+            entry.query_response.errback(dns.exception.Timeout())
+
+    def _timeout_waiting(self, query_response):
+        """Callback used to implement timeouts for queries that are
+        waiting for a query ID.
+
+        @param query_response: the deferred of the query that timed out.
+        @type query_response: L{twisted.internet.defer.Deferred}
+        """
+
+        if not query_response.called:
+            query_response.errback(dns.exception.Timeout())
+
+class GenericDnsClient(object):
+    """
+    The parts of L{txdnspython.udp.UdpDnsClient} and
+    L{txdnspython.tcp.TcpDnsClient} that sit in front of the
+    transport.  Subclasses implement C{_dispatch} to hand a query to
+    one of their protocols.
+    """
+
+    def __init__(self, reactor, cache = None, coalesce = False, timer = None,
+                 decode = txdnspython.decode.MESSAGE, stats = None, limit = None, capture = None):
+        """
+        Initialize.
+
+        @param reactor: reactor to use to schedule delayed calls (used to implement timeouts)
+        @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param cache: cache to answer queries from before sending
+        them, and to store responses in
+        @type cache: L{txdnspython.cache.DnsCache}
+        @param coalesce: whether a query that asks the same question
+        as a query that is already in flight waits for that query's
+        response instead of being sent
+        @type coalesce: C{bool}
+        @param timer: what to schedule query timeouts with instead of
+        the reactor
+        @type timer: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param decode: how to decode responses unless a query asks
+        otherwise, one of the modes in L{txdnspython.decode}
+        @type decode: C{str}
+        @param stats: what the client's protocols count their traffic
+        in, or C{None} to not count it
+        @type stats: L{txdnspython.stats.Stats}
+        @param limit: what limits the rate of queries sent over the
+        wire, the number in flight and the number waiting to be sent,
+        or C{None} to send every query at once
+        @type limit: L{txdnspython.limit.Limiter}
+        @param capture: what the client's protocols record their
+        traffic in, or C{None} to not record it
+        @type capture: L{txdnspython.capture.Capture}
+        """
+
+        self.reactor = reactor
+        self.timer = reactor if timer is None else timer
+
+        self.stats = stats
+        """L{txdnspython.stats.Stats} shared by the client's protocols, or C{None}"""
+
+        self.decode = decode
+        """How responses are decoded unless a query asks otherwise"""
+
+        self.cache = cache
+        """
+        L{txdnspython.cache.DnsCache} that responses are looked up in
+        and stored in, or C{None} to send every query over the wire.
+        """
+
+        self.coalesce = coalesce
+        """Whether identical questions share one query on the wire"""
+
+        self.in_flight = {}
+        """
+        L{dict} of the questions that have been sent and not yet
+        answered when L{coalesce} is on.  The keys are built by
+        L{coalesce_key} and the values are lists of the queries that
+        are waiting for the same answer, as tuples of
+        L{dns.message.Message}, L{twisted.internet.defer.Deferred}
+        and L{twisted.internet.base.DelayedCall} (or C{None}).
+        """
+
+        self.coalesced = 0
+        """Number of queries that were answered by another query's response"""
+
+        self.limit = limit
+        """L{txdnspython.limit.Limiter} that queries go through before they are sent, or C{None}"""
+
+        self.capture = capture
+        """L{txdnspython.capture.Capture} shared by the client's protocols, or C{None}"""
+
+    def send_query(self, query, timeout = None, decode = None):
+        """Send a query to the nameserver.
+
+        @param query: the query
+        @type query: dns.message.Message object
+        @param timeout: The number of seconds to wait before the query times out.
+        If None, the default, wait forever.
+        @type timeout: float
+        @param decode: how to decode the response, one of the modes in
+        L{txdnspython.decode}.  If None, the default, the client's
+        mode is used.  The cache and query coalescing only handle
+        responses that are decoded to L{dns.message.Message}.
+        @type decode: str
+        @rtype: twisted.internet.defer.Deferred object
+        """
+
+        if decode is None:
+            decode = self.decode
+
+        if decode != txdnspython.decode.MESSAGE:
+            query_response = defer.Deferred()
+            self._submit(query, query_response, timeout, decode)
+            return query_response
+
+        cache = self.cache
+        if cache is not None:
+            response = cache.get(query)
+            if response is not None:
+                return defer.succeed(response)
+
+        if self.coalesce:
+            key = coalesce_key(query)
+            if key is not None:
+                waiters = self.in_flight.get(key)
+                if waiters is not None:
+                    return self._join(waiters, query, timeout)
+
+        else:
+            key = None
+
+        query_response = defer.Deferred()
+        self._submit(query, query_response, timeout, decode)
+
+        if cache is not None:
+            query_response.addCallback(cache.put, query)
+
+        if key is not None and not query_response.called:
+            self.in_flight[key] = []
+            query_response.addBoth(self._cbCoalesced, key)
+
+        return query_response
+
+    def send_query_callbacks(self, query, on_response, on_error, timeout = None, decode = None):
+        """Send a query to the nameserver and hand the result to plain
+        callables instead of a deferred.
+
+        This is the cheaper way to send a query when many are in
+        flight: no L{twisted.internet.defer.Deferred} is created, the
+        query is kept in a small L{QueryCallbacks} record and a
+        timeout is handed over as a L{dns.exception.Timeout} without
+        creating a L{twisted.python.failure.Failure}.  Responses are
+        neither looked up in nor stored in the cache, and identical
+        questions are not coalesced.
+
+        Exactly one of the callables is called, possibly before this
+        method returns.  Exceptions they raise are logged.
+
+        @param query: the query
+        @type query: dns.message.Message object
+        @param on_response: called with the response
+        @type on_response: callable
+        @param on_error: called with the exception the query failed with
+        @type on_error: callable
+        @param timeout: The number of seconds to wait before the query times out.
+        If None, the default, wait forever.
+        @type timeout: float
+        @param decode: how to decode the response, see L{send_query}
+        @type decode: str
+        """
+
+        if decode is None:
+            decode = self.decode
+
+        self._submit(query, QueryCallbacks(on_response, on_error), timeout, decode)
+
+    def send_queries(self, queries, concurrency = 100, timeout = None, decode = None, callback = None):
+        """Send many queries to the nameserver, keeping at most
+        C{concurrency} of them in flight.
+
+        @param queries: the queries, pulled from the iterable as there
+        is room for them
+        @type queries: iterable of dns.message.Message objects
+        @param concurrency: The most queries to have in flight at once.
+        @type concurrency: int
+        @param timeout: The number of seconds to wait before each query times out.
+        If None, the default, wait forever.
+        @type timeout: float
+        @param decode: how to decode the responses, see L{send_query}
+        @type decode: str
+        @param callback: Called with each query and its response (or
+        failure) as the query finishes.  If None, the default, the
+        results are taken with L{txdnspython.batch.QueryBatch.get}.
+        @type callback: callable
+        @rtype: L{txdnspython.batch.QueryBatch}
+        """
+
+        return txdnspython.batch.QueryBatch(self, queries, concurrency, timeout, decode, callback)
+
+    def _join(self, waiters, query, timeout):
+        """
+        Wait for the response to a query that is already in flight.
+        The waiting query gets its own timeout.
+        """
+
+        query_response = defer.Deferred()
+
+        if timeout:
+            delayed_call = self.timer.callLater(timeout, self._timeout_waiter, query_response)
+
+        else:
+            delayed_call = None
+
+        waiters.append((query, query_response, delayed_call))
+        self.coalesced += 1
+        return query_response
+
+    def _timeout_waiter(self, query_response):
+        if not query_response.called:
+            query_response.errback(dns.exception.Timeout())
+
+    def _cbCoalesced(self, result, key):
+        """
+        Hand the result of a query to every query that joined it.
+        Each successful waiter gets its own shallow copy of the
+        response with the ID of its own query.
+
+        A timeout of the query in flight is that caller's deadline,
+        not an answer to the others, so the query is sent again for
+        the first waiter with time left and the rest join it.
+        """
+
+        waiters = self.in_flight.pop(key)
+
+        if isinstance(result, failure.Failure) and result.check(dns.exception.Timeout):
+            waiters = [waiter for waiter in waiters if not waiter[1].called]
+            if waiters:
+                self._resend(key, waiters)
+                return result
+
+        for query, query_response, delayed_call in waiters:
+            if query_response.called:
+                continue
+
+            if delayed_call and delayed_call.active():
+                delayed_call.cancel()
+
+            if isinstance(result, failure.Failure):
+                query_response.errback(result)
+
+            else:
+                response = copy.copy(result)
+                response.id = query.id
+                query_response.callback(response)
+
+        return result
+
+    def _resend(self, key, waiters):
+        """
+        Send the query of the first of C{waiters} with the time it
+        has left, and let the others wait for its response.
+        """
+
+        query, query_response, delayed_call = waiters[0]
+
+        if delayed_call:
+            delayed_call.cancel()
+            timeout = delayed_call.getTime() - self.reactor.seconds()
+
+        else:
+            timeout = None
+
+        self.in_flight[key] = waiters[1:]
+
+        resent = defer.Deferred()
+        if self.cache is not None:
+            resent.addCallback(self.cache.put, query)
+
+        resent.addBoth(self._cbCoalesced, key)
+        resent.addCallbacks(query_response.callback, query_response.errback)
+        self._submit(query, resent, timeout, txdnspython.decode.MESSAGE)
+
+    def _submit(self, query, query_response, timeout, decode):
+        """
+        Send a query over the wire, through L{limit} if there is one.
+        """
+
+        if self.limit is None:
+            self._dispatch(query, query_response, timeout, decode)
+
+        else:
+            self.limit.submit(self._dispatch, query, query_response, timeout, decode, self.timer)
+
+    def _cancel_limited(self):
+        """
+        Fail the queries that are waiting in L{limit} to be sent by
+        this client, once it has been closed.
+        """
+
+        if self.limit is not None:
+            self.limit.cancel(failure.Failure(error.ConnectionDone()), self._dispatch)
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        """
+        Send a query over one of the client's protocols.
+
+        @param query: the query
+        @type query: L{dns.message.Message}
+        @param query_response: what to hand the result to
+        @type query_response: L{twisted.internet.defer.Deferred} or
+        L{QueryCallbacks}
+        @param timeout: the number of seconds to wait or C{None}
+        @type timeout: C{float}
+        @param decode: how to decode the response
+        @type decode: C{str}
+        """
+
+        raise NotImplementedError
+
+def coalesce_key(query):
+    """
+    Build a key that is the same for queries that would get the same
+    response.
+
+    @param query: the query
+    @type query: L{dns.message.Message}
+    @return: the key or C{None} if the query should always be sent
+    on its own
+    """
+
+    if len(query.question) != 1 or query.keyring is not None:
+        return None
+
+    rrset = query.question[0]
+    return (rrset.name, rrset.rdtype, rrset.rdclass, query.opcode(), query.flags,
+            query.edns, query.ednsflags, query.payload, tuple(query.options))
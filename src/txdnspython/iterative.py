@@ -0,0 +1,567 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Resolving names from the root servers down, instead of asking a
+recursive server to do it.
+"""
+
+import collections
+import random
+
+from twisted.internet import defer
+from twisted.python import failure
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+
+import txdnspython.fallback
+
+class ResolutionFailed(dns.exception.DNSException):
+    """A name could not be resolved: no server gave a usable response, or there were too many referrals."""
+
+class DelegationCache(object):
+    """
+    A cache of zone cuts and the addresses of name servers, learnt
+    from referrals, so that resolving a name can start at the server
+    of the closest zone that encloses it instead of at the roots.
+
+    Entries are kept for their TTL (capped at C{max_ttl}) and dropped
+    when they are found to have expired.  When there are more than
+    C{max_entries} of either kind the least recently used are
+    dropped.
+    """
+
+    def __init__(self, reactor, max_entries = 10000, max_ttl = 86400):
+        """
+        Initialize.
+
+        @param reactor: reactor whose clock is used to expire entries
+        @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param max_entries: the most zones, and the most name server
+        names, to keep
+        @type max_entries: C{int}
+        @param max_ttl: the longest time in seconds to keep an entry
+        @type max_ttl: C{int}
+        """
+
+        self.reactor = reactor
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+
+        self.zones = collections.OrderedDict()
+        """
+        L{collections.OrderedDict} of the known zone cuts, least
+        recently used first.  The keys are the names of the zones and
+        the values are tuples of the time the entry expires and a
+        list of the names of the zone's name servers.
+        """
+
+        self.addresses = collections.OrderedDict()
+        """
+        L{collections.OrderedDict} of the IPv4 addresses of name
+        servers, least recently used first.  The keys are the names
+        of the servers and the values are tuples of the time the
+        entry expires and a list of addresses.
+        """
+
+        self.hits = 0
+        """Number of lookups that found a zone below the root"""
+
+        self.misses = 0
+        """Number of lookups that had to start at the root"""
+
+    def __len__(self):
+        return len(self.zones)
+
+    def put_delegation(self, ns):
+        """
+        Store the name servers of a zone.
+
+        @param ns: the NS RRset of the zone
+        @type ns: L{dns.rrset.RRset}
+        """
+
+        self._put(self.zones, ns.name, ns.ttl, [rdata.target for rdata in ns])
+
+    def put_addresses(self, rrset):
+        """
+        Store the addresses of a name server.
+
+        @param rrset: the A RRset of the name server
+        @type rrset: L{dns.rrset.RRset}
+        """
+
+        self._put(self.addresses, rrset.name, rrset.ttl, [rdata.address for rdata in rrset])
+
+    def closest(self, name):
+        """
+        Find the closest known zone that encloses a name.
+
+        @param name: the name
+        @type name: L{dns.name.Name}
+        @return: a tuple of the zone's name and the names of its name
+        servers, or C{None} if no zone below the root is known
+        @rtype: C{tuple}
+        """
+
+        while len(name) > 1:
+            nameservers = self._get(self.zones, name)
+            if nameservers is not None:
+                self.hits += 1
+                return name, nameservers
+
+            name = name.parent()
+
+        self.misses += 1
+        return None
+
+    def get_addresses(self, name):
+        """
+        @param name: the name of a name server
+        @type name: L{dns.name.Name}
+        @return: its addresses, or C{None} if they are not known
+        @rtype: C{list} of C{str}
+        """
+
+        return self._get(self.addresses, name)
+
+    def _put(self, entries, name, ttl, value):
+        entries.pop(name, None)
+        entries[name] = (self.reactor.seconds() + min(ttl, self.max_ttl), value)
+
+        while len(entries) > self.max_entries:
+            entries.popitem(last = False)
+
+    def _get(self, entries, name):
+        entry = entries.pop(name, None)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if self.reactor.seconds() >= expires:
+            return None
+
+        entries[name] = entry
+        return value
+
+    def clear(self):
+        """Drop every entry."""
+
+        self.zones.clear()
+        self.addresses.clear()
+
+class IterativeResolver(object):
+    """
+    Resolve names by starting at the root servers (or at the closest
+    zone in the L{DelegationCache}) and following referrals down to a
+    server that is authoritative for the name.
+
+    At each step the question is sent to C{parallel} of the zone's
+    name server addresses at once, and the first usable response is
+    taken.  When a server times out, fails or gives a response that is
+    neither an answer nor a referral further down, the question is
+    sent to one of the addresses that have not been tried yet.
+    Referrals are stored in the delegation cache together with their
+    glue, and the addresses of name servers without glue are resolved
+    from the roots in the same way.  CNAME chains are followed, and
+    their records are put in front of the answer.
+
+    Each server address gets its own client, created by
+    C{client_factory}, which by default is a
+    L{txdnspython.fallback.FallbackDnsClient} so that truncated
+    responses are retried over TCP.  When there are more than
+    C{max_clients}, the least recently used client that has no query
+    in flight is closed.  Only IPv4 addresses are used.
+    """
+
+    def __init__(self, reactor, roots, port = 53, parallel = 2, timeout = 2.0, max_referrals = 30,
+                 max_cnames = 8, max_depth = 4, delegations = None, cache = None, client_factory = None,
+                 timer = None, max_clients = 100):
+        """
+        Initialize.
+
+        @param reactor: reactor to send queries with
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorUDP},
+        L{twisted.internet.interfaces.IReactorTCP} and
+        L{twisted.internet.interfaces.IReactorTime}
+        @param roots: the IPv4 addresses of the root servers
+        @type roots: C{list} of C{str}
+        @param port: the port every server is queried on
+        @type port: C{int}
+        @param parallel: how many of a zone's servers are queried at
+        once
+        @type parallel: C{int}
+        @param timeout: seconds to wait for each server
+        @type timeout: C{float}
+        @param max_referrals: the most referrals to follow for one name
+        @type max_referrals: C{int}
+        @param max_cnames: the most CNAME records to follow for one name
+        @type max_cnames: C{int}
+        @param max_depth: how deeply resolving the address of a name
+        server may in turn need the address of another name server
+        @type max_depth: C{int}
+        @param delegations: the delegation cache to use, or C{None}
+        for a new one
+        @type delegations: L{DelegationCache}
+        @param cache: cache to answer questions from before resolving
+        them, and to store the final responses in
+        @type cache: L{txdnspython.cache.DnsCache}
+        @param client_factory: called with the reactor, an address and
+        the port to create the client for a server
+        @type client_factory: callable
+        @param timer: what to schedule query timeouts with instead of
+        the reactor
+        @type timer: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
+        @param max_clients: the most server clients to keep open
+        while they are idle
+        @type max_clients: C{int}
+        """
+
+        self.reactor = reactor
+        self.timer = reactor if timer is None else timer
+        self.roots = list(roots)
+        self.port = port
+        self.parallel = parallel
+        self.timeout = timeout
+        self.max_referrals = max_referrals
+        self.max_cnames = max_cnames
+        self.max_depth = max_depth
+
+        if delegations is None:
+            delegations = DelegationCache(reactor)
+
+        self.delegations = delegations
+        """L{DelegationCache} of the zone cuts learnt so far"""
+
+        self.cache = cache
+
+        if client_factory is None:
+            client_factory = self._fallback_client
+
+        self.client_factory = client_factory
+
+        self.max_clients = max_clients
+
+        self.clients = collections.OrderedDict()
+        """
+        L{collections.OrderedDict} of the open clients, indexed by
+        server address, least recently used first
+        """
+
+        self.in_flight = collections.Counter()
+        """
+        L{collections.Counter} of the queries in flight, by server
+        address.  Clients with queries in flight are not closed.
+        """
+
+        self.queries = 0
+        """Number of queries sent to servers"""
+
+        self.referrals = 0
+        """Number of referrals followed"""
+
+    def _fallback_client(self, reactor, address, port):
+        return txdnspython.fallback.FallbackDnsClient(reactor, address, port, timer = self.timer)
+
+    def resolve(self, qname, rdtype = dns.rdatatype.A, rdclass = dns.rdataclass.IN):
+        """
+        Resolve a name.
+
+        @param qname: the name
+        @type qname: L{dns.name.Name} or C{str}
+        @param rdtype: the type of records to look up
+        @type rdtype: C{int} or C{str}
+        @param rdclass: the class of records to look up
+        @type rdclass: C{int} or C{str}
+        @return: a deferred that fires with the response of the
+        authoritative server, with the records of any CNAME chain put
+        in front of its answer section, or fails with
+        L{ResolutionFailed}
+        @rtype: L{twisted.internet.defer.Deferred}
+        """
+
+        if not isinstance(qname, dns.name.Name):
+            qname = dns.name.from_text(qname)
+
+        if not isinstance(rdtype, int):
+            rdtype = dns.rdatatype.from_text(rdtype)
+
+        if not isinstance(rdclass, int):
+            rdclass = dns.rdataclass.from_text(rdclass)
+
+        return self._resolve(qname, rdtype, rdclass, 0)
+
+    @defer.inlineCallbacks
+    def _resolve(self, qname, rdtype, rdclass, depth):
+        chain = []
+
+        for cnames in range(self.max_cnames + 1):
+            response = yield self._resolve_name(qname, rdtype, rdclass, depth)
+
+            target = _cname_target(response, qname, rdtype)
+            if target is None:
+                response.answer[:0] = chain
+                defer.returnValue(response)
+
+            chain.extend(response.answer)
+            qname = target
+
+        raise ResolutionFailed('too many CNAME records')
+
+    @defer.inlineCallbacks
+    def _resolve_name(self, qname, rdtype, rdclass, depth):
+        query = dns.message.make_query(qname, rdtype, rdclass)
+        query.flags &= ~dns.flags.RD
+
+        if self.cache is not None:
+            response = self.cache.get(query)
+            if response is not None:
+                defer.returnValue(response)
+
+        closest = self.delegations.closest(qname)
+        if closest is None:
+            zone, nameservers = dns.name.root, None
+
+        else:
+            zone, nameservers = closest
+
+        for referrals in range(self.max_referrals + 1):
+            if nameservers is None:
+                addresses = list(self.roots)
+
+            else:
+                addresses = yield self._addresses(zone, nameservers, depth)
+
+            response = yield self._query(query, zone, addresses)
+
+            ns = _referral(response, zone, qname)
+            if ns is None:
+                if self.cache is not None:
+                    self.cache.put(response, query)
+
+                defer.returnValue(response)
+
+            self.referrals += 1
+            self.delegations.put_delegation(ns)
+
+            names = set(rdata.target for rdata in ns)
+            for rrset in response.additional:
+                # only trust glue from the zone that sent it
+                if rrset.rdtype == dns.rdatatype.A and rrset.name in names and rrset.name.is_subdomain(zone):
+                    self.delegations.put_addresses(rrset)
+
+            zone, nameservers = ns.name, [rdata.target for rdata in ns]
+
+        raise ResolutionFailed('too many referrals for {}'.format(qname))
+
+    @defer.inlineCallbacks
+    def _addresses(self, zone, nameservers, depth):
+        """
+        Find the addresses of a zone's name servers.  The cached ones
+        are used if there are any; otherwise the names are resolved
+        one by one until one of them has addresses.
+        """
+
+        addresses = []
+        unknown = []
+        for name in nameservers:
+            known = self.delegations.get_addresses(name)
+            if known is None:
+                unknown.append(name)
+
+            else:
+                addresses.extend(known)
+
+        if addresses:
+            defer.returnValue(addresses)
+
+        if depth >= self.max_depth:
+            raise ResolutionFailed('name servers of {} are nested too deeply'.format(zone))
+
+        for name in unknown:
+            # a server inside the zone it serves needs glue, and there was none
+            if name.is_subdomain(zone):
+                continue
+
+            try:
+                response = yield self._resolve(name, dns.rdatatype.A, dns.rdataclass.IN, depth + 1)
+
+            except ResolutionFailed:
+                continue
+
+            for rrset in response.answer:
+                if rrset.rdtype == dns.rdatatype.A:
+                    self.delegations.put_addresses(rrset)
+                    addresses.extend(rdata.address for rdata in rrset)
+
+            if addresses:
+                defer.returnValue(addresses)
+
+        raise ResolutionFailed('no addresses found for the name servers of {}'.format(zone))
+
+    def _query(self, query, zone, addresses):
+        """
+        Send a query to the servers of a zone, C{parallel} at a time,
+        until one gives a usable response.
+        """
+
+        addresses = list(addresses)
+        random.shuffle(addresses)
+
+        result = defer.Deferred()
+        state = {'outstanding': 0}
+
+        def send():
+            while addresses and state['outstanding'] < self.parallel:
+                address = addresses.pop()
+                state['outstanding'] += 1
+                self.queries += 1
+                self.in_flight[address] += 1
+                d = self._client(address).send_query(query, self.timeout)
+                d.addBoth(self._finished, address)
+                d.addCallbacks(answered, failed)
+
+            if not state['outstanding'] and not result.called:
+                result.errback(failure.Failure(
+                    ResolutionFailed('no usable response from the name servers of {}'.format(zone))))
+
+        def answered(response):
+            state['outstanding'] -= 1
+            if result.called:
+                return
+
+            if _usable(response, zone, query.question[0].name):
+                result.callback(response)
+
+            else:
+                send()
+
+        def failed(reason):
+            state['outstanding'] -= 1
+            if not result.called:
+                send()
+
+        send()
+        return result
+
+    def _client(self, address):
+        client = self.clients.pop(address, None)
+        if client is None:
+            client = self.client_factory(self.reactor, address, self.port)
+
+        self.clients[address] = client
+        self._evict()
+        return client
+
+    def _finished(self, result, address):
+        self.in_flight[address] -= 1
+        if not self.in_flight[address]:
+            del self.in_flight[address]
+            self._evict()
+
+        return result
+
+    def _evict(self):
+        """
+        Close the least recently used idle clients while there are
+        more than L{max_clients}.
+        """
+
+        excess = len(self.clients) - self.max_clients
+        if excess <= 0:
+            return
+
+        idle = [address for address in self.clients if address not in self.in_flight][:excess]
+        for address in idle:
+            self.clients.pop(address).close()
+
+    def close(self):
+        """Close the clients of every server."""
+
+        for client in self.clients.values():
+            client.close()
+
+        self.clients.clear()
+
+def _referral(response, zone, qname):
+    """
+    The NS RRset of a response that refers the question to a zone
+    below C{zone} that encloses C{qname}, or C{None}.
+    """
+
+    if response.answer or response.flags & dns.flags.AA or response.rcode() != dns.rcode.NOERROR:
+        return None
+
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.NS and rrset.name != zone and rrset.name.is_subdomain(zone) and \
+           qname.is_subdomain(rrset.name):
+            return rrset
+
+    return None
+
+def _usable(response, zone, qname):
+    """Whether a response is an answer or a referral further down."""
+
+    rcode = response.rcode()
+    if rcode == dns.rcode.NXDOMAIN:
+        return True
+
+    if rcode != dns.rcode.NOERROR:
+        return False
+
+    if response.answer or response.flags & dns.flags.AA:
+        return True
+
+    return _referral(response, zone, qname) is not None
+
+def _cname_target(response, qname, rdtype):
+    """
+    The name to follow if the answer of a response ends in a CNAME
+    record instead of the records asked for, or C{None}.
+    """
+
+    if rdtype in (dns.rdatatype.CNAME, dns.rdatatype.ANY):
+        return None
+
+    rrsets = dict(((rrset.name, rrset.rdtype), rrset) for rrset in response.answer)
+    name = qname
+    for step in range(len(rrsets) + 1):
+        if (name, rdtype) in rrsets:
+            return None
+
+        cname = rrsets.get((name, dns.rdatatype.CNAME))
+        if cname is None:
+            break
+
+        name = cname[0].target
+
+    if name == qname:
+        return None
+
+    return name
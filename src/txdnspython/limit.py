@@ -0,0 +1,315 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Admission control for the queries a client sends to a server: a
+token bucket that limits the rate, a cap on the queries in flight and
+a bounded queue for the queries that have to wait.
+"""
+
+import collections
+
+from twisted.internet import defer
+from twisted.python import failure
+
+import dns.exception
+
+REJECT = 'reject'
+"""Overflow policy: fail a query that cannot be sent at once with L{QueueFull}"""
+
+WAIT = 'wait'
+"""
+Overflow policy: queue a query that cannot be sent at once, and fail
+it with L{QueueFull} if the queue is full
+"""
+
+DROP_OLDEST = 'drop-oldest'
+"""
+Overflow policy: queue a query that cannot be sent at once, and if
+the queue is full fail the query that has been waiting longest with
+L{QueueFull} to make room
+"""
+
+class QueueFull(dns.exception.DNSException):
+    """A query was turned away because the server's limits were reached."""
+
+class Limiter(object):
+    """
+    Hold back the queries sent to a server so that no more than
+    C{rate} a second (with bursts of up to C{burst}) and no more than
+    C{max_in_flight} at once are sent.  Queries that cannot be sent
+    at once are handled according to C{overflow}.
+
+    Pass a limiter to a client as its C{limit} to apply it to every
+    query that the client sends over the wire.  Queries answered from
+    the client's cache or joined to a query in flight are not
+    counted.  Share a limiter between clients to apply one set of
+    limits to all of them.
+
+    The depth of the queue and the number of queries in flight can be
+    read at any time, so that callers can shed load before queries
+    start being turned away; L{full} tells whether the next query
+    would be.
+    """
+
+    def __init__(self, reactor, rate = None, burst = None, max_in_flight = None, max_queued = 1000, overflow = WAIT):
+        """
+        @param reactor: what to schedule with
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
+        @param rate: queries a second, or C{None} not to limit the rate
+        @type rate: C{float}
+        @param burst: how many queries may be sent at once after a
+        quiet spell.  If C{None}, the default, one second's worth of
+        C{rate}.
+        @type burst: C{int}
+        @param max_in_flight: the most queries that may be waiting for
+        a response, or C{None} for no limit
+        @type max_in_flight: C{int}
+        @param max_queued: the most queries that may wait to be sent
+        @type max_queued: C{int}
+        @param overflow: L{REJECT}, L{WAIT} or L{DROP_OLDEST}
+        @type overflow: C{str}
+        """
+
+        if overflow not in (REJECT, WAIT, DROP_OLDEST):
+            raise ValueError('unknown overflow policy {!r}'.format(overflow))
+
+        self.reactor = reactor
+        self.rate = rate
+
+        if burst is None and rate is not None:
+            burst = max(rate, 1)
+
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.overflow = overflow
+
+        self.tokens = burst
+        """Queries that may be sent before the rate limit kicks in"""
+
+        self.refilled = reactor.seconds()
+
+        self.in_flight = 0
+        """Number of queries sent and not yet finished"""
+
+        self.queued = collections.OrderedDict()
+        """
+        L{collections.OrderedDict} of the queries waiting to be sent,
+        oldest first.  The values are tuples of the function to send
+        the query with, L{dns.message.Message},
+        L{twisted.internet.defer.Deferred},
+        L{twisted.internet.base.DelayedCall} (or C{None} if there is
+        no timeout associated with the query), and the decode mode.
+        """
+
+        self.rejected = 0
+        """Number of queries failed because the queue was full, or with L{REJECT} because they could not be sent"""
+
+        self.dropped = 0
+        """Number of queued queries failed to make room with L{DROP_OLDEST}"""
+
+        self._next_key = 0
+        self._wakeup = None
+        self._sending = False
+
+    def __len__(self):
+        return len(self.queued)
+
+    def full(self):
+        """
+        Whether the next query would be turned away or would push out
+        a queued one.
+
+        @rtype: C{bool}
+        """
+
+        if self.overflow == REJECT:
+            return not self._may_send()
+
+        return len(self.queued) >= self.max_queued
+
+    def submit(self, dispatch, query, query_response, timeout, decode, timer = None):
+        """
+        Send a query with C{dispatch} when the limits allow.
+
+        @param dispatch: called with the query, the deferred, the
+        number of seconds left before the query times out (or
+        C{None}) and the decode mode to send the query
+        @type dispatch: callable
+        @param timer: what to schedule the timeout of the query with
+        while it is queued, usually the timer of the client that
+        sends it.  If C{None}, the reactor.
+        @type timer: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
+        """
+
+        if not self.queued and self._may_send():
+            self._send(dispatch, query, query_response, timeout, decode)
+            return
+
+        if self.overflow == REJECT:
+            self.rejected += 1
+            query_response.errback(failure.Failure(QueueFull('too many queries for the server')))
+            return
+
+        if len(self.queued) >= self.max_queued:
+            if self.overflow == WAIT or not self.queued:
+                self.rejected += 1
+                query_response.errback(failure.Failure(QueueFull('queue for the server is full')))
+                return
+
+            key, entry = self.queued.popitem(last = False)
+            if entry[3] is not None and entry[3].active():
+                entry[3].cancel()
+
+            self.dropped += 1
+            entry[2].errback(failure.Failure(QueueFull('dropped from the queue for the server')))
+
+        key = self._next_key
+        self._next_key += 1
+
+        if timeout:
+            if timer is None:
+                timer = self.reactor
+
+            delayed_call = timer.callLater(timeout, self._timeout, key)
+
+        else:
+            delayed_call = None
+
+        self.queued[key] = (dispatch, query, query_response, delayed_call, decode)
+        self._schedule()
+
+    def _may_send(self):
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return False
+
+        if self.rate is None:
+            return True
+
+        self._refill()
+        return self.tokens >= 1
+
+    def _refill(self):
+        now = self.reactor.seconds()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def _send(self, dispatch, query, query_response, timeout, decode):
+        if self.rate is not None:
+            self.tokens -= 1
+
+        self.in_flight += 1
+
+        # The query is counted until it leaves the wire, whatever the
+        # callbacks the caller has already added to query_response do
+        # with the result.
+        on_wire = defer.Deferred()
+        on_wire.addBoth(self._finished)
+        on_wire.addCallbacks(query_response.callback, query_response.errback)
+        dispatch(query, on_wire, timeout, decode)
+
+    def _finished(self, result):
+        self.in_flight -= 1
+
+        # a query that fails as it is sent finishes while the loop in
+        # _send_queued is running, which carries on by itself
+        if self.queued and not self._sending:
+            self._send_queued()
+
+        return result
+
+    def _send_queued(self):
+        """Send as many queued queries as the limits allow."""
+
+        self._sending = True
+        try:
+            while self.queued and self._may_send():
+                key, (dispatch, query, query_response, delayed_call, decode) = self.queued.popitem(last = False)
+
+                if delayed_call is None:
+                    timeout = None
+
+                else:
+                    timeout = delayed_call.getTime() - self.reactor.seconds()
+                    delayed_call.cancel()
+
+                self._send(dispatch, query, query_response, timeout, decode)
+
+        finally:
+            self._sending = False
+
+        self._schedule()
+
+    def _schedule(self):
+        """
+        Wake up when the next token is due if queries are waiting for
+        one, rather than for a query in flight to finish.
+        """
+
+        if not self.queued or self.rate is None or self._wakeup is not None:
+            return
+
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return
+
+        self._wakeup = self.reactor.callLater(max((1 - self.tokens) / self.rate, 0), self._woken)
+
+    def _woken(self):
+        self._wakeup = None
+        self._send_queued()
+
+    def _timeout(self, key):
+        entry = self.queued.pop(key, None)
+        if entry is not None:
+            entry[2].errback(dns.exception.Timeout())
+
+    def cancel(self, reason, dispatch = None):
+        """
+        Fail queued queries, for example because the client that was
+        to send them has been closed.
+
+        @param reason: the reason passed to each query's errback
+        @type reason: L{twisted.python.failure.Failure}
+        @param dispatch: If not C{None}, only fail the queries that
+        were to be sent with this function.
+        @type dispatch: callable
+        """
+
+        cancelled = []
+        for key, entry in list(self.queued.items()):
+            if dispatch is None or entry[0] == dispatch:
+                del self.queued[key]
+                cancelled.append(entry)
+
+        if not self.queued and self._wakeup is not None:
+            if self._wakeup.active():
+                self._wakeup.cancel()
+
+            self._wakeup = None
+
+        for dispatch, query, query_response, delayed_call, decode in cancelled:
+            if delayed_call is not None and delayed_call.active():
+                delayed_call.cancel()
+
+            query_response.errback(reason)
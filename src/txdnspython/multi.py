@@ -0,0 +1,376 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import collections
+
+import dns.exception
+
+import txdnspython.decode
+import txdnspython.generic
+import txdnspython.limit
+import txdnspython.udp
+
+class Server(object):
+    """
+    One of the servers of a L{MultiServerDnsClient} and what is known
+    about how it has been answering.
+    """
+
+    def __init__(self, client, samples):
+        self.client = client
+        """The client queries to this server are sent with"""
+
+        self.srtt = None
+        """Smoothed round trip time in seconds, or C{None} before the first response"""
+
+        self.rttvar = None
+        """Smoothed variation of the round trip time in seconds"""
+
+        self.failures = 0.0
+        """Moving average of the failed queries, from 0.0 to 1.0"""
+
+        self.latencies = collections.deque(maxlen = samples)
+        """The most recent round trip times, for the hedging threshold"""
+
+        self.demoted_until = None
+        """When a demoted server may be probed again, or C{None} if it is not demoted"""
+
+        self.demotions = 0
+        """Number of times in a row the server has been demoted"""
+
+        self.probing = False
+        """Whether a probe query to a demoted server is in flight"""
+
+        self.queries = 0
+        self.responses = 0
+        self.errors = 0
+
+    def score(self):
+        """
+        Lower is better.  Servers that have not answered yet score
+        zero so that every server gets tried.
+        """
+
+        if self.srtt is None:
+            return 0.0
+
+        return self.srtt / max(1.0 - self.failures, 0.01)
+
+    def percentile(self, fraction):
+        """
+        @return: the round trip time that C{fraction} of the recent
+        responses came in under
+        """
+
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+class _Attempt(object):
+    """
+    A query that may have been sent to more than one server.
+    """
+
+    __slots__ = ('query', 'query_response', 'deadline', 'decode', 'tried', 'outstanding', 'hedge_call',
+                 'hedge_server')
+
+    def __init__(self, query, query_response, deadline, decode):
+        self.query = query
+        self.query_response = query_response
+        self.deadline = deadline
+        self.decode = decode
+        self.tried = []
+        self.outstanding = 0
+        self.hedge_call = None
+        self.hedge_server = None
+
+class MultiServerDnsClient(txdnspython.generic.GenericDnsClient):
+    """
+    A client that spreads queries over several servers.
+
+    Every query goes to the server with the best score, which is its
+    smoothed round trip time scaled up by how often it has been
+    failing.  With C{hedge} set, a query that has not been answered
+    by the time the chosen server answers that fraction of its
+    queries is also sent to the next best server and the first
+    response wins.  A server whose failure average reaches
+    C{failure_threshold} is demoted and left out until
+    C{probe_interval} has passed; then the next query is also sent
+    to it as a probe, and a response puts it back in rotation.
+    """
+
+    def __init__(self, reactor, servers, one_rr_per_rrset = False, hedge = None, min_samples = 10,
+                 samples = 100, failure_threshold = 0.5, probe_interval = 5.0, max_probe_interval = 300.0,
+                 client_factory = None, cache = None, coalesce = False, timer = None,
+                 decode = txdnspython.decode.MESSAGE):
+        """
+        Initialize the client object.
+
+        @param reactor: reactor to use to schedule delayed calls (used to implement timeouts)
+        @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param servers: the servers to send queries to, as addresses
+        or as tuples of address and port
+        @type servers: C{list}
+        @param one_rr_per_rrset: passed to L{dns.message.from_wire}
+        @type one_rr_per_rrset: bool
+        @param hedge: The fraction of a server's responses that should
+        come in before a query is hedged, for example 0.95.  If None,
+        the default, queries are never hedged.
+        @type hedge: float
+        @param min_samples: how many responses a server must have
+        given before its queries are hedged
+        @type min_samples: int
+        @param samples: how many recent round trip times to keep for
+        each server
+        @type samples: int
+        @param failure_threshold: the failure average, from 0.0 to
+        1.0, at which a server is demoted
+        @type failure_threshold: float
+        @param probe_interval: seconds before a demoted server is
+        probed, doubled each time the probe fails
+        @type probe_interval: float
+        @param max_probe_interval: the longest a demoted server waits
+        for a probe
+        @type max_probe_interval: float
+        @param client_factory: Called with the reactor, address, port,
+        C{one_rr_per_rrset} and timer to create the client for each
+        server.  If None, the default, L{txdnspython.udp.UdpDnsClient}
+        is used.
+        @type client_factory: callable
+
+        The other arguments are the same as for
+        L{txdnspython.generic.GenericDnsClient}.
+
+        @raise ValueError: if C{servers} is empty
+        """
+
+        servers = list(servers)
+        if not servers:
+            raise ValueError('at least one server is needed')
+
+        txdnspython.generic.GenericDnsClient.__init__(self, reactor, cache, coalesce, timer, decode)
+
+        if client_factory is None:
+            client_factory = _udp_client
+
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.max_probe_interval = max_probe_interval
+
+        self.servers = []
+        """The L{Server}s, in the order they were given"""
+
+        for server in servers:
+            if isinstance(server, tuple):
+                address, port = server
+
+            else:
+                address, port = server, 53
+
+            client = client_factory(reactor, address, port, one_rr_per_rrset, self.timer)
+            self.servers.append(Server(client, samples))
+
+        self.hedged = 0
+        """Number of queries that were also sent to a second server"""
+
+        self.hedges_won = 0
+        """Number of hedged queries that the second server answered first"""
+
+        self.probes = 0
+        """Number of queries sent to demoted servers"""
+
+    def _select(self, exclude = ()):
+        """
+        @return: the server with the best score that is not demoted and
+        not in C{exclude}, or the demoted server that is due to be
+        probed first if there is no other
+        """
+
+        best = None
+        fallback = None
+
+        for server in self.servers:
+            if server in exclude:
+                continue
+
+            if server.demoted_until is not None:
+                if fallback is None or server.demoted_until < fallback.demoted_until:
+                    fallback = server
+
+            elif best is None or server.score() < best.score():
+                best = server
+
+        if best is None:
+            return fallback
+
+        return best
+
+    def _due_probe(self, now, exclude):
+        for server in self.servers:
+            if (server.demoted_until is not None and not server.probing and
+                server.demoted_until <= now and server not in exclude):
+                return server
+
+        return None
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        now = self.reactor.seconds()
+
+        if timeout is None:
+            deadline = None
+
+        else:
+            deadline = now + timeout
+
+        attempt = _Attempt(query, query_response, deadline, decode)
+
+        server = self._select()
+        self._send(attempt, server, now)
+
+        probe = self._due_probe(now, attempt.tried)
+        if probe is not None:
+            probe.probing = True
+            self.probes += 1
+            self._send(attempt, probe, now)
+
+        if self.hedge is not None and not query_response.called:
+            self._schedule_hedge(attempt, server, now)
+
+    def _schedule_hedge(self, attempt, server, now):
+        if len(server.latencies) < self.min_samples:
+            return
+
+        delay = server.percentile(self.hedge)
+        if attempt.deadline is not None and now + delay >= attempt.deadline:
+            return
+
+        attempt.hedge_call = self.timer.callLater(delay, self._hedge, attempt)
+
+    def _hedge(self, attempt):
+        attempt.hedge_call = None
+
+        if attempt.query_response.called:
+            return
+
+        server = self._select(attempt.tried)
+        if server is None:
+            return
+
+        self.hedged += 1
+        attempt.hedge_server = server
+        self._send(attempt, server, self.reactor.seconds())
+
+    def _send(self, attempt, server, now):
+        if attempt.deadline is None:
+            timeout = None
+
+        else:
+            timeout = attempt.deadline - now
+
+        attempt.tried.append(server)
+        attempt.outstanding += 1
+        server.queries += 1
+
+        d = server.client.send_query(attempt.query, timeout, attempt.decode)
+        d.addCallbacks(self._cbResponse, self._ebResponse,
+                       callbackArgs = (attempt, server, now), errbackArgs = (attempt, server, now))
+
+    def _cbResponse(self, response, attempt, server, sent):
+        attempt.outstanding -= 1
+        self._record_success(server, self.reactor.seconds() - sent)
+
+        if attempt.query_response.called:
+            return
+
+        if attempt.hedge_call is not None:
+            attempt.hedge_call.cancel()
+            attempt.hedge_call = None
+
+        if server is attempt.hedge_server:
+            self.hedges_won += 1
+
+        attempt.query_response.callback(response)
+
+    def _ebResponse(self, reason, attempt, server, sent):
+        attempt.outstanding -= 1
+
+        # a query that the server's client held back never reached it
+        if not reason.check(txdnspython.limit.QueueFull):
+            self._record_failure(server)
+
+        if attempt.query_response.called or attempt.outstanding:
+            return
+
+        if attempt.hedge_call is not None:
+            attempt.hedge_call.cancel()
+            attempt.hedge_call = None
+
+            if not reason.check(dns.exception.Timeout):
+                self._hedge(attempt)
+                if attempt.outstanding:
+                    return
+
+        attempt.query_response.errback(reason)
+
+    def _record_success(self, server, rtt):
+        """
+        Fold a round trip time into the server's averages the way RFC
+        6298 smooths TCP round trip times, and put a demoted server
+        back in rotation.
+        """
+
+        server.responses += 1
+        server.latencies.append(rtt)
+        server.failures *= 0.875
+
+        if server.srtt is None:
+            server.srtt = rtt
+            server.rttvar = rtt / 2
+
+        else:
+            server.rttvar = 0.75 * server.rttvar + 0.25 * abs(server.srtt - rtt)
+            server.srtt = 0.875 * server.srtt + 0.125 * rtt
+
+        if server.demoted_until is not None:
+            server.demoted_until = None
+            server.demotions = 0
+            server.failures = 0.0
+
+        server.probing = False
+
+    def _record_failure(self, server):
+        server.errors += 1
+        server.failures = 0.875 * server.failures + 0.125
+
+        if server.probing or (server.demoted_until is None and server.failures >= self.failure_threshold):
+            interval = min(self.probe_interval * 2 ** server.demotions, self.max_probe_interval)
+            server.demoted_until = self.reactor.seconds() + interval
+            server.demotions += 1
+
+        server.probing = False
+
+    def close(self):
+        for server in self.servers:
+            server.client.close()
+
+def _udp_client(reactor, address, port, one_rr_per_rrset, timer):
+    return txdnspython.udp.UdpDnsClient(reactor, address, port, one_rr_per_rrset, timer = timer)
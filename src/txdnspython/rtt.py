@@ -0,0 +1,85 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Working out how long the UDP client waits for a response before it
+sends a query again, from the round trip times it measures.
+"""
+
+class RoundTripTime(object):
+    """
+    The round trip time to one server and the retransmission timeout
+    that follows from it, worked out from samples as RFC 6298 does
+    for TCP: the timeout is the smoothed round trip time plus four
+    times its variation, kept between C{min_rto} and C{max_rto}, and
+    it doubles every time a query has to be sent again until the next
+    sample.
+
+    A L{txdnspython.udp.UdpDnsClient} shares one between all its
+    sockets, so that every sample counts towards the same estimate.
+    """
+
+    def __init__(self, initial_rto = 1.0, min_rto = 0.2, max_rto = 10.0):
+        """
+        @param initial_rto: seconds to wait before the first sample
+        @type initial_rto: C{float}
+        @param min_rto: the shortest timeout
+        @type min_rto: C{float}
+        @param max_rto: the longest timeout
+        @type max_rto: C{float}
+        """
+
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+        self.rto = initial_rto
+        """Seconds to wait for a response before a query is sent again"""
+
+        self.srtt = None
+        """Smoothed round trip time in seconds, or C{None} before the first sample"""
+
+        self.rttvar = None
+        """Smoothed variation of the round trip time in seconds"""
+
+    def sample(self, rtt):
+        """
+        Take the round trip time of a query that was answered the
+        first time it was sent.
+
+        @param rtt: the round trip time in seconds
+        @type rtt: C{float}
+        """
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+    def back_off(self):
+        """Double the timeout after a query had to be sent again."""
+
+        self.rto = min(self.rto * 2, self.max_rto)
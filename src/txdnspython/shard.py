@@ -0,0 +1,434 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import marshal
+import os
+import struct
+import sys
+
+from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python import failure
+from twisted.python import log
+
+import dns.exception
+
+import txdnspython.decode
+import txdnspython.generic
+
+_request = struct.Struct('!III')
+"""Frame length, request ID and timeout in milliseconds of a query sent to a worker"""
+
+_response = struct.Struct('!IIB')
+"""Frame length, request ID and status of a result sent back by a worker"""
+
+_NO_TIMEOUT = 0xffffffff
+
+_package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"""The directory txdnspython is imported from, for the workers to import it from too"""
+
+_RESPONSE = 0
+"""The payload is the response wire data"""
+
+_RESULT = 1
+"""The payload is what the handler returned, marshalled"""
+
+_TIMEOUT = 2
+"""The query timed out and there is no payload"""
+
+_ERROR = 3
+"""The query failed and the payload describes why"""
+
+class WorkerError(dns.exception.DNSException):
+    """A query failed in a worker process, or the worker went away."""
+
+def answers(query, response):
+    """
+    A handler for L{ShardedDnsClient} that boils a response down to
+    its rcode and the text of its answer section, as a tuple of the
+    rcode and a list of tuples of owner name, TTL, type and the
+    record data.
+    """
+
+    return (response.rcode(),
+            [(rrset.name.to_text(), rrset.ttl, rrset.rdtype, [rdata.to_text() for rdata in rrset])
+             for rrset in response.answer])
+
+class _FrameReader(object):
+    """
+    Splits a stream into frames that start with a four byte length.
+    Each complete frame is passed to C{frameReceived} with the data
+    it is in and where it starts and ends, the length being the four
+    bytes before the start.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        """
+        L{list} of the pieces of a frame, starting with its length,
+        whose remainder has not been received yet.  The pieces are
+        only joined once the frame is complete, so a large frame that
+        arrives over many reads is copied once.
+        """
+
+        self.received = 0
+        """The number of bytes of the frame that are in L{chunks}"""
+
+        self.waiting_for = None
+        """The size of the frame in L{chunks} with its length, once it is known"""
+
+    def dataReceived(self, data):
+        chunks = self.chunks
+        frame_received = self.frameReceived
+        unpack_from = _frame_length.unpack_from
+        offset = 0
+        end = len(data)
+
+        if chunks:
+            # complete the frame that was cut off by an earlier read,
+            # taking only as much of the new data as it needs
+            if self.waiting_for is None:
+                offset = min(4 - self.received, end)
+                chunks.append(data[:offset])
+                self.received += offset
+                if self.received < 4:
+                    return
+
+                prefix = b''.join(chunks)
+                chunks[:] = [prefix]
+                self.waiting_for = 4 + unpack_from(prefix)[0]
+
+            needed = offset + self.waiting_for - self.received
+            if end < needed:
+                chunks.append(data[offset:])
+                self.received += end - offset
+                return
+
+            chunks.append(data[offset:needed])
+            frame = b''.join(chunks)
+            del chunks[:]
+            self.received = 0
+            self.waiting_for = None
+            offset = needed
+
+            frame_received(frame, 4, len(frame))
+
+        # walk the complete frames in the rest of the data with an
+        # offset, so that nothing is copied
+        while end - offset >= 4:
+            (length,) = unpack_from(data, offset)
+            if end - offset - 4 < length:
+                self.waiting_for = 4 + length
+                break
+
+            frame_received(data, offset + 4, offset + 4 + length)
+            offset += 4 + length
+
+        if offset < end:
+            chunks.append(data[offset:])
+            self.received = end - offset
+
+_frame_length = struct.Struct('!I')
+
+class ShardedDnsClient(txdnspython.generic.GenericDnsClient):
+    """
+    A client that spreads queries over worker processes, each running
+    its own reactor and client, so that more than one core can send
+    queries and handle responses.
+
+    Queries and results travel over the workers' standard input and
+    output as length prefixed frames holding the wire data, so the
+    front end does no more than copy bytes.  What a worker sends back
+    depends on C{handler}:
+
+     - Without a handler the worker only matches responses to queries
+       and handles timeouts, and returns the wire data.  The front end
+       then decodes it as the query asked for (see
+       L{txdnspython.decode}); asking for L{txdnspython.decode.RAW},
+       L{txdnspython.decode.HEADER} or L{txdnspython.decode.LAZY}
+       keeps the parsing out of the front end.
+     - With a handler the worker parses each response and calls the
+       handler with the query and the response.  Whatever the handler
+       returns is passed back with L{marshal}, so it has to be built
+       from basic types, and the query's Deferred fires with it.  This
+       moves the parsing, which is what limits a single process, into
+       the workers.
+
+    Worker processes that exit are started again, and the queries
+    that were in flight in them fail with L{WorkerError}.  TSIG signed
+    queries are not supported.
+    """
+
+    def __init__(self, reactor, address, port = 53, workers = None, transport = 'udp', handler = None,
+                 sockets = 1, one_rr_per_rrset = False, cache = None, coalesce = False,
+                 decode = txdnspython.decode.MESSAGE, executable = None, limit = None):
+        """
+        Initialize the client object and start the workers.
+
+        @param reactor: the reactor to start the workers with
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorProcess} and
+        L{twisted.internet.interfaces.IReactorTime}
+        @param address: the name server
+        @type address: C{str}
+        @param port: the port of the name server
+        @type port: C{int}
+        @param workers: The number of worker processes.  If None, the
+        default, one per CPU.
+        @type workers: C{int}
+        @param transport: C{'udp'}, C{'tcp'} or C{'fallback'} to use
+        L{txdnspython.udp.UdpDnsClient},
+        L{txdnspython.tcp.TcpDnsClient} or
+        L{txdnspython.fallback.FallbackDnsClient} in the workers
+        @type transport: C{str}
+        @param handler: the dotted name of a function the workers call
+        with each query and response, for example
+        C{'txdnspython.shard.answers'}.  If None, the default, the
+        workers return the wire data of the responses.  The results
+        of a handler are not responses, so it cannot be combined with
+        C{cache} or C{coalesce}.
+        @type handler: C{str}
+        @param sockets: UDP sockets or TCP connections per worker
+        @type sockets: C{int}
+        @param executable: the Python interpreter to run the workers
+        with.  If None, the default, the one running the front end.
+        @type executable: C{str}
+
+        The other arguments are the same as for
+        L{txdnspython.generic.GenericDnsClient}.
+        """
+
+        txdnspython.generic.GenericDnsClient.__init__(self, reactor, cache, coalesce, None, decode, None, limit)
+
+        if workers is None:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+
+        if transport not in ('udp', 'tcp', 'fallback'):
+            raise ValueError('transport must be udp, tcp or fallback')
+
+        if handler is not None and (cache is not None or coalesce):
+            raise ValueError('a handler cannot be combined with a cache or coalescing')
+
+        self.one_rr_per_rrset = one_rr_per_rrset
+        self.handler = handler
+        self.executable = executable or sys.executable
+
+        self.settings = json.dumps({'address': address, 'port': port, 'transport': transport, 'handler': handler,
+                                    'sockets': sockets, 'one_rr_per_rrset': one_rr_per_rrset})
+        """The settings the workers are started with"""
+
+        self.workers = []
+        """The L{_WorkerProcess} of each worker"""
+
+        self.closed = False
+
+        self.min_restart_delay = 0.5
+        """
+        Seconds to wait before starting a worker again when it exited
+        soon after it was started.  The wait doubles each time this
+        happens in a row, up to L{max_restart_delay}.
+        """
+
+        self.max_restart_delay = 30.0
+
+        self.restarts = 0
+        """Number of times a worker was started again after it exited"""
+
+        self._next_request = 0
+        self._next_worker = 0
+        self._ended = []
+
+        self._restart_delay = self.min_restart_delay
+        self._restarting = []
+
+        for i in range(workers):
+            self._spawn()
+
+    def _spawn(self):
+        worker = _WorkerProcess(self, self.reactor.seconds())
+
+        # make sure the worker imports the same txdnspython
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join([_package] + [path for path in
+                                                                  [environment.get('PYTHONPATH')] if path])
+
+        self.reactor.spawnProcess(worker, self.executable, [self.executable, '-m', 'txdnspython._shardworker',
+                                                             self.settings], env = environment)
+        self.workers.append(worker)
+
+    def _select_worker(self):
+        workers = self.workers
+        count = len(workers)
+        start = self._next_worker = (self._next_worker + 1) % count
+        best = None
+        for index in range(start, start + count):
+            worker = workers[index % count]
+            if best is None or len(worker.pending) < len(best.pending):
+                best = worker
+                if not worker.pending:
+                    break
+
+        return best
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        if self.closed:
+            query_response.errback(failure.Failure(error.ConnectionDone()))
+            return
+
+        if not self.workers:
+            query_response.errback(failure.Failure(WorkerError('no worker process is running')))
+            return
+
+        if query.keyring is not None:
+            query_response.errback(failure.Failure(ValueError('TSIG signed queries cannot be sharded')))
+            return
+
+        if timeout is not None and timeout <= 0:
+            query_response.errback(dns.exception.Timeout())
+            return
+
+        request_id = self._next_request
+        self._next_request = (request_id + 1) & 0xffffffff
+
+        wire_data = query.to_wire()
+        if timeout is None:
+            milliseconds = _NO_TIMEOUT
+
+        else:
+            milliseconds = min(int(timeout * 1000), _NO_TIMEOUT - 1)
+
+        worker = self._select_worker()
+        worker.pending[request_id] = (query, query_response, decode)
+        worker.transport.write(_request.pack(8 + len(wire_data), request_id, milliseconds) + wire_data)
+
+    def _result(self, worker, data, start, end):
+        (length, request_id, status) = _response.unpack_from(data, start - 4)
+        entry = worker.pending.pop(request_id, None)
+        if entry is None:
+            return
+
+        query, query_response, decode = entry
+        payload = data[start + 5:end]
+
+        if status == _RESPONSE:
+            try:
+                response = txdnspython.decode.decode(payload, query, decode, self.one_rr_per_rrset)
+
+            except Exception:
+                query_response.errback(failure.Failure())
+
+            else:
+                query_response.callback(response)
+
+        elif status == _RESULT:
+            query_response.callback(marshal.loads(payload))
+
+        elif status == _TIMEOUT:
+            query_response.errback(dns.exception.Timeout())
+
+        else:
+            query_response.errback(failure.Failure(WorkerError(payload.decode('utf-8', 'replace'))))
+
+    def _worker_ended(self, worker, reason):
+        self.workers.remove(worker)
+
+        pending, worker.pending = worker.pending, {}
+        for query, query_response, decode in pending.values():
+            query_response.errback(failure.Failure(WorkerError('worker process exited')))
+
+        if not self.closed:
+            log.msg('DNS worker process exited, starting another: {}'.format(reason.getErrorMessage()))
+
+            # start a worker that ran for a while again at once, but
+            # back off from one that keeps exiting as it starts
+            if self.reactor.seconds() - worker.started >= self.max_restart_delay:
+                self._restart_delay = self.min_restart_delay
+                delay = 0
+
+            else:
+                delay = self._restart_delay
+                self._restart_delay = min(delay * 2, self.max_restart_delay)
+
+            self._restarting.append(self.reactor.callLater(delay, self._restart))
+
+        elif not self.workers:
+            ended, self._ended = self._ended, []
+            for d in ended:
+                d.callback(None)
+
+    def _restart(self):
+        self._restarting = [delayed_call for delayed_call in self._restarting if delayed_call.active()]
+        self.restarts += 1
+        self._spawn()
+
+    def close(self):
+        """
+        Stop the workers.  Queries that have not been answered fail.
+
+        @return: a deferred that fires once every worker has exited
+        @rtype: L{twisted.internet.defer.Deferred}
+        """
+
+        self.closed = True
+        self._cancel_limited()
+
+        restarting, self._restarting = self._restarting, []
+        for delayed_call in restarting:
+            if delayed_call.active():
+                delayed_call.cancel()
+
+        if not self.workers:
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+        self._ended.append(d)
+        for worker in self.workers:
+            worker.transport.closeStdin()
+
+        return d
+
+class _WorkerProcess(_FrameReader, ProcessProtocol):
+    def __init__(self, client, started):
+        _FrameReader.__init__(self)
+        self.client = client
+        self.started = started
+
+        self.pending = {}
+        """
+        L{dict} of the queries sent to the worker, indexed by request
+        ID.  The values are tuples of L{dns.message.Message},
+        L{twisted.internet.defer.Deferred} and the decode mode.
+        """
+
+    def outReceived(self, data):
+        self.dataReceived(data)
+
+    def frameReceived(self, data, start, end):
+        self.client._result(self, data, start, end)
+
+    def errReceived(self, data):
+        log.msg('DNS worker process: {}'.format(data.decode('utf-8', 'replace').rstrip()))
+
+    def processEnded(self, reason):
+        self.client._worker_ended(self, reason)
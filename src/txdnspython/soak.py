@@ -0,0 +1,460 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Drive clients for a long time against a faulty stand-in server and
+watch for state that builds up.
+
+Entries left behind in a protocol's C{pending} table after its
+connection has been lost, or queued queries that outlive their
+timeouts, only show once a client has been running for hours.  A
+L{Soak} keeps a fixed number of queries in flight through each
+client while the server drops, delays, truncates and disconnects,
+and samples the size of every table the clients keep, the number of
+delayed calls in the reactor and the resident memory of the process
+at regular intervals.  At the end it checks that none of them kept
+growing after a warm-up period (see L{grows}) and that the tables are
+empty once every query has finished.
+
+Run it like this:
+
+    python -m txdnspython.soak --duration 3600 --output samples.json
+
+and see --help for the knobs.  The exit status is 1 if anything grew
+or was left behind.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+
+from twisted.internet import defer
+
+import dns.message
+
+import txdnspython.fallback
+import txdnspython.limit
+import txdnspython.tcp
+import txdnspython.template
+import txdnspython.testing
+import txdnspython.udp
+
+DRAINED_TABLES = ('pending', 'waiting', 'sent_at', 'retransmits', 'advertised', 'queued', 'coalescing',
+                  'limit_queued')
+"""Tables that must be empty once every query has finished"""
+
+def rss_kb():
+    """
+    The resident memory of the process in kilobytes.  Where
+    C{/proc} is not available this is the peak instead.
+
+    @rtype: C{int}
+    """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+    except (IOError, OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak //= 1024
+
+        return peak
+
+def table_sizes(client, prefix = ''):
+    """
+    Measure the tables a client and its protocols keep.
+
+    @param client: the client
+    @type client: L{txdnspython.generic.GenericDnsClient}
+    @param prefix: put in front of every name
+    @type prefix: C{str}
+    @return: the number of entries in each table, summed over the
+    client's protocols
+    @rtype: L{collections.OrderedDict}
+    """
+
+    sizes = collections.OrderedDict()
+
+    def add(name, table):
+        sizes[prefix + name] = sizes.get(prefix + name, 0) + len(table)
+
+    protocols = list(getattr(client, 'protocols', [])) + list(getattr(client, 'connections', []))
+    for protocol in protocols:
+        add('pending', protocol.pending)
+        add('waiting', protocol.waiting)
+        add('sent_at', protocol.sent_at)
+        for name in ('retransmits', 'advertised'):
+            table = getattr(protocol, name, None)
+            if table is not None:
+                add(name, table)
+
+    if hasattr(client, 'queued'):
+        add('queued', client.queued)
+
+    if hasattr(client, '_idle_calls'):
+        add('idle_calls', client._idle_calls)
+
+    add('coalescing', client.in_flight)
+
+    if client.limit is not None:
+        add('limit_queued', client.limit)
+
+    fallback = getattr(client, 'tcp', None)
+    if fallback is not None:
+        sizes.update(table_sizes(fallback, prefix + 'tcp.'))
+
+    return sizes
+
+def grows(values, warmup = 1.0 / 3, tolerance = 0.1, slack = 0):
+    """
+    Decide whether a gauge keeps growing.  The samples taken during
+    warm-up are left out and the rest are split in two halves; the
+    gauge grows if the highest value in the second half is above the
+    highest value in the first by more than C{tolerance} of it plus
+    C{slack}.  A gauge that levels off, however high, does not grow.
+
+    @param values: the samples, oldest first
+    @type values: C{list}
+    @param warmup: the fraction of the samples to leave out
+    @type warmup: C{float}
+    @param tolerance: how much higher the second half may go, as a
+    fraction of the first
+    @type tolerance: C{float}
+    @param slack: how much higher the second half may go on top of
+    C{tolerance}
+    @type slack: C{float}
+    @rtype: C{bool}
+    """
+
+    values = values[int(len(values) * warmup):]
+    if len(values) < 4:
+        return False
+
+    half = len(values) // 2
+    return max(values[half:]) > max(values[:half]) * (1 + tolerance) + slack
+
+class Soak(object):
+    """
+    Keep queries in flight through a set of clients for a while and
+    sample what they hold on to.
+    """
+
+    def __init__(self, reactor, clients, duration, interval = 10.0, concurrency = 50, timeout = 2.0, names = 1000,
+                 seed = None):
+        """
+        Initialize.
+
+        @param reactor: the reactor the clients run on
+        @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param clients: the clients to drive, indexed by the name
+        their gauges are reported under
+        @type clients: C{dict}
+        @param duration: seconds to send queries for
+        @type duration: C{float}
+        @param interval: seconds between samples
+        @type interval: C{float}
+        @param concurrency: queries to keep in flight through each client
+        @type concurrency: C{int}
+        @param timeout: seconds before each query times out
+        @type timeout: C{float}
+        @param names: how many different names to ask for, so that
+        some questions are in flight more than once at a time
+        @type names: C{int}
+        @param seed: seed for the choice of questions
+        @type seed: hashable
+        """
+
+        self.reactor = reactor
+        self.clients = clients
+        self.duration = duration
+        self.interval = interval
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        self.random = random.Random(seed)
+        self.queries = [txdnspython.template.render(dns.message.make_query('host{}.example.'.format(i), rdtype))
+                        for i in range(names) for rdtype in ('A', 'AAAA')]
+
+        self.samples = []
+        """
+        L{list} of the samples, each a L{dict} of the time, C{rss_kb},
+        C{delayed_calls} and the size of every table of every client
+        as C{<client>.<table>}
+        """
+
+        self.drained = None
+        """
+        The sample taken after the last query finished and before the
+        clients were closed
+        """
+
+        self.sent = collections.Counter()
+        """L{collections.Counter} of the queries sent through each client"""
+
+        self.errors = collections.Counter()
+        """L{collections.Counter} of the failed queries by exception class name"""
+
+        self.running = False
+        self._outstanding = 0
+        self._use_callbacks = itertools.cycle((False, True))
+        self._sample_call = None
+        self._done = None
+
+    def sample(self):
+        """
+        Take a sample and add it to L{samples}.
+
+        @rtype: C{dict}
+        """
+
+        sample = collections.OrderedDict()
+        sample['time'] = self.reactor.seconds()
+        sample['rss_kb'] = rss_kb()
+        sample['delayed_calls'] = len(self.reactor.getDelayedCalls())
+
+        for name in sorted(self.clients):
+            for table, size in table_sizes(self.clients[name]).items():
+                sample[name + '.' + table] = size
+
+        self.samples.append(sample)
+        return sample
+
+    def run(self):
+        """
+        Start sending queries.
+
+        @return: a L{twisted.internet.defer.Deferred} that fires with
+        this object once the queries have been sent for C{duration}
+        seconds, every query has finished and the clients have been
+        closed
+        """
+
+        self.running = True
+        self._done = defer.Deferred()
+        self._start = self.reactor.seconds()
+        self.sample()
+        self._sample_call = self.reactor.callLater(self.interval, self._sample)
+
+        for name in sorted(self.clients):
+            for i in range(self.concurrency):
+                self._send(name)
+
+        self.reactor.callLater(self.duration, self._stop)
+        return self._done
+
+    def _sample(self):
+        self.sample()
+        self._sample_call = self.reactor.callLater(self.interval, self._sample)
+
+    def _send(self, name):
+        query = self.random.choice(self.queries)
+        client = self.clients[name]
+        self.sent[name] += 1
+        self._outstanding += 1
+
+        if next(self._use_callbacks):
+            client.send_query_callbacks(query, lambda response: self._finished(name),
+                                        lambda reason: self._failed(name, reason), self.timeout)
+
+        else:
+            query_response = client.send_query(query, self.timeout)
+            query_response.addCallbacks(lambda response: self._finished(name),
+                                        lambda reason: self._failed(name, reason.value))
+
+    def _failed(self, name, reason):
+        self.errors[type(reason).__name__] += 1
+        self._finished(name)
+
+    def _finished(self, name):
+        self._outstanding -= 1
+
+        if self.running:
+            # send the next query from the reactor, as a query that
+            # fails at once would otherwise recurse
+            self.reactor.callLater(0, self._send, name)
+
+        elif not self._outstanding:
+            self.reactor.callLater(0, self._close)
+
+    def _stop(self):
+        self.running = False
+        if not self._outstanding:
+            self._close()
+
+    def _close(self):
+        if self._sample_call is not None and self._sample_call.active():
+            self._sample_call.cancel()
+
+        self.drained = self.sample()
+        for client in self.clients.values():
+            client.close()
+
+        self._done.callback(self)
+
+    def failures(self, warmup = 1.0 / 3, table_slack = 10, calls_slack = 10, rss_tolerance = 0.1,
+                 rss_slack = 4096):
+        """
+        Check the samples for gauges that kept growing and tables
+        that were not empty once every query had finished.
+
+        @return: a description of each problem
+        @rtype: C{list} of C{str}
+        """
+
+        problems = []
+        if not self.samples:
+            return problems
+
+        for gauge in self.samples[0]:
+            if gauge == 'time':
+                continue
+
+            values = [sample[gauge] for sample in self.samples if gauge in sample]
+
+            if gauge == 'rss_kb':
+                tolerance, slack = rss_tolerance, rss_slack
+
+            elif gauge == 'delayed_calls':
+                tolerance, slack = 0.1, calls_slack
+
+            else:
+                tolerance, slack = 0.1, table_slack
+
+            if grows(values, warmup, tolerance, slack):
+                problems.append('{} kept growing: {} to {}'.format(gauge, values[int(len(values) * warmup)],
+                                                                    values[-1]))
+
+        if self.drained is not None:
+            for gauge, size in self.drained.items():
+                if gauge.rsplit('.', 1)[-1] in DRAINED_TABLES and size:
+                    problems.append('{} still held {} entries after every query had finished'.format(gauge, size))
+
+        return problems
+
+def make_clients(reactor, port, options):
+    clients = {}
+
+    if 'udp' in options.transports:
+        clients['udp'] = txdnspython.udp.UdpDnsClient(reactor, '127.0.0.1', port, sockets = 2, retries = 1,
+                                                      initial_rto = options.timeout / 4, edns_payload = 1232,
+                                                      coalesce = True)
+
+    if 'tcp' in options.transports:
+        clients['tcp'] = txdnspython.tcp.TcpDnsClient(reactor, '127.0.0.1', port, connections = 2,
+                                                      max_in_flight = max(1, options.concurrency // 4),
+                                                      idle_timeout = options.timeout)
+
+    if 'fallback' in options.transports:
+        limit = txdnspython.limit.Limiter(reactor, max_in_flight = max(1, options.concurrency // 2))
+        clients['fallback'] = txdnspython.fallback.FallbackDnsClient(reactor, '127.0.0.1', port, limit = limit)
+
+    return clients
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description = 'Soak the clients against a faulty local server and check for '
+                                     'state that builds up.')
+    parser.add_argument('--duration', default = 600.0, type = float,
+                        help = 'seconds to send queries for (default: 600)')
+    parser.add_argument('--interval', default = 10.0, type = float, help = 'seconds between samples (default: 10)')
+    parser.add_argument('--transports', default = 'udp,tcp,fallback', type = lambda value: value.split(','),
+                        help = 'comma separated clients to drive (default: udp,tcp,fallback)')
+    parser.add_argument('--concurrency', default = 50, type = int,
+                        help = 'queries in flight through each client (default: 50)')
+    parser.add_argument('--timeout', default = 1.0, type = float,
+                        help = 'seconds before a query times out (default: 1)')
+    parser.add_argument('--latency', default = 0.01, type = float,
+                        help = 'mean seconds the server waits before answering (default: 0.01)')
+    parser.add_argument('--slow', default = 0.01, type = float,
+                        help = 'fraction of responses sent after the query has timed out (default: 0.01)')
+    parser.add_argument('--loss', default = 0.05, type = float,
+                        help = 'fraction of UDP queries the server drops (default: 0.05)')
+    parser.add_argument('--truncate', default = 0.05, type = float,
+                        help = 'fraction of UDP responses the server truncates (default: 0.05)')
+    parser.add_argument('--disconnect', default = 0.01, type = float,
+                        help = 'fraction of TCP queries the server closes the connection on (default: 0.01)')
+    parser.add_argument('--seed', default = 0, type = int, help = 'seed for the faults and questions (default: 0)')
+    parser.add_argument('--output', help = 'file to write the samples to as JSON')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    from twisted.internet import reactor
+
+    options = parse_args(argv)
+
+    delays = random.Random(options.seed)
+
+    def latency():
+        if options.slow and delays.random() < options.slow:
+            return options.timeout * 1.5
+
+        return delays.uniform(0, 2 * options.latency)
+
+    server = txdnspython.testing.StandInServer(reactor, latency = latency, loss = options.loss,
+                                               truncate = options.truncate, disconnect = options.disconnect,
+                                               seed = options.seed)
+    port = server.listen()
+
+    soak = Soak(reactor, make_clients(reactor, port, options), options.duration, options.interval,
+                options.concurrency, options.timeout, seed = options.seed)
+    outcome = {}
+
+    def finished(result):
+        outcome['result'] = result
+        server.stop().addBoth(lambda ignored: reactor.stop())
+
+    reactor.callWhenRunning(lambda: soak.run().addBoth(finished))
+    reactor.run()
+
+    if not isinstance(outcome.get('result'), Soak):
+        print(outcome.get('result'), file = sys.stderr)
+        return 1
+
+    first, last = soak.samples[0], soak.samples[-1]
+    print('{} queries, {} samples, errors: {}'.format(sum(soak.sent.values()), len(soak.samples),
+                                                       ', '.join('{} {}'.format(kind, count)
+                                                                 for kind, count in sorted(soak.errors.items()))),
+          file = sys.stderr)
+    print('rss {} kB to {} kB, delayed calls {} to {}'.format(first['rss_kb'], last['rss_kb'],
+                                                               first['delayed_calls'], last['delayed_calls']),
+          file = sys.stderr)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'options': vars(options), 'samples': soak.samples}, output, indent = 2)
+
+    problems = soak.failures()
+    for problem in problems:
+        print('FAIL: ' + problem, file = sys.stderr)
+
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import bisect
+
+def _default_buckets():
+    """
+    Upper bounds of the latency buckets: powers of two from one
+    millisecond to about 33 seconds.
+    """
+
+    return [0.001 * 2 ** i for i in range(16)]
+
+class Stats(object):
+    """
+    Counters and a latency histogram for the queries sent by one or
+    more protocols.
+
+    Pass an instance as the C{stats} argument of a client (or a
+    protocol) to turn instrumentation on; the same instance can be
+    shared by several clients.  With no C{stats} the protocols only
+    pay for checking that it is C{None}.
+
+    Anything with the same methods can be used in place of this
+    class, for example to forward the numbers to a monitoring system
+    as they come in.
+    """
+
+    def __init__(self, buckets = None):
+        """
+        Initialize.
+
+        @param buckets: the upper bounds, in seconds and in increasing
+        order, of the buckets response latencies are counted in.  The
+        default is powers of two from one millisecond to about 33
+        seconds.  Latencies above the last bound go in an overflow
+        bucket.
+        @type buckets: C{list} of C{float}
+        """
+
+        if buckets is None:
+            buckets = _default_buckets()
+
+        self.buckets = list(buckets)
+        """Upper bounds of the latency buckets"""
+
+        self.pending = 0
+        """Number of queries on the wire that have not been answered"""
+
+        self.reset()
+
+    def reset(self):
+        """Set every counter back to zero.  L{pending} is kept."""
+
+        self.histogram = [0] * (len(self.buckets) + 1)
+        """Number of responses in each latency bucket, the overflow bucket last"""
+
+        self.latency_total = 0.0
+        """Sum of the latencies of every response, in seconds"""
+
+        self.queries = 0
+        """Number of queries written to the wire, not counting retransmissions"""
+
+        self.responses = 0
+        """Number of responses matched to a query"""
+
+        self.timeouts = 0
+        """Number of queries that timed out after being sent"""
+
+        self.failures = 0
+        """Number of queries failed because their connection went away"""
+
+        self.unmatched = 0
+        """Number of responses that did not match a query in flight"""
+
+        self.truncated = 0
+        """Number of responses handed to a protocol's truncation handler"""
+
+        self.retransmissions = 0
+        """Number of queries written to the wire again"""
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        self.max_pending = self.pending
+        """The highest L{pending} has been since the last reset"""
+
+    def sent(self, size):
+        """A query of C{size} bytes was written to the wire."""
+
+        self.queries += 1
+        self.bytes_sent += size
+        self.pending += 1
+        if self.pending > self.max_pending:
+            self.max_pending = self.pending
+
+    def retransmitted(self, size):
+        """A query of C{size} bytes was written to the wire again."""
+
+        self.retransmissions += 1
+        self.bytes_sent += size
+
+    def received(self, size):
+        """A message of C{size} bytes was read from the wire."""
+
+        self.bytes_received += size
+
+    def answered(self, latency):
+        """A response arrived C{latency} seconds after its query was sent."""
+
+        self.responses += 1
+        self.pending -= 1
+        self.latency_total += latency
+        self.histogram[bisect.bisect_left(self.buckets, latency)] += 1
+
+    def timed_out(self):
+        """A query that was sent timed out."""
+
+        self.timeouts += 1
+        self.pending -= 1
+
+    def failed(self):
+        """A query that was sent failed without a response."""
+
+        self.failures += 1
+        self.pending -= 1
+
+    def unmatched_response(self):
+        """A response arrived that did not match any query."""
+
+        self.unmatched += 1
+
+    def truncated_response(self):
+        """A truncated response was handed to a truncation handler."""
+
+        self.truncated += 1
+
+    def percentile(self, fraction):
+        """
+        Estimate a latency percentile from the histogram.
+
+        @param fraction: the fraction of responses, for example 0.99
+        @type fraction: C{float}
+        @return: the upper bound of the bucket the percentile falls
+        in, C{None} if there have been no responses, or infinity if
+        it falls in the overflow bucket
+        @rtype: C{float}
+        """
+
+        if not self.responses:
+            return None
+
+        wanted = fraction * self.responses
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= wanted and count:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+
+                break
+
+        return float('inf')
+
+    def snapshot(self, reset = False):
+        """
+        Copy the current numbers into a L{dict} of plain values that
+        can be logged or exported.
+
+        @param reset: whether to reset the counters once they have
+        been copied, so that each snapshot covers the time since the
+        one before it
+        @type reset: C{bool}
+        @rtype: C{dict}
+        """
+
+        if self.responses:
+            mean = self.latency_total / self.responses
+
+        else:
+            mean = None
+
+        snapshot = {
+            'queries': self.queries,
+            'responses': self.responses,
+            'timeouts': self.timeouts,
+            'failures': self.failures,
+            'unmatched': self.unmatched,
+            'truncated': self.truncated,
+            'retransmissions': self.retransmissions,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'latency_mean': mean,
+            'latency_p50': self.percentile(0.5),
+            'latency_p90': self.percentile(0.9),
+            'latency_p99': self.percentile(0.99),
+            'histogram': list(zip(self.buckets + [float('inf')], self.histogram)),
+        }
+
+        if reset:
+            self.reset()
+
+        return snapshot
@@ -19,11 +19,11 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import struct
 import collections
-import time
+import itertools
 
 from twisted.internet import defer
+from twisted.internet import error
 from twisted.internet.protocol import Protocol
 from twisted.internet.protocol import ClientFactory
 from twisted.python import failure
@@ -32,68 +32,88 @@ from twisted.python import log
 import dns.exception
 import dns.message
 
+import txdnspython.decode
+import txdnspython.framing
 import txdnspython.generic
+import txdnspython.xfr
 
-class TcpDnsClientProtocol(txdnspython.generic.GenericDnsClientProtocol, Protocol):
-    def __init__(self, reactor, one_rr_per_rrset, ready):
-        txdnspython.generic.GenericDnsClientProtocol.__init__(self, reactor, one_rr_per_rrset)
+class TcpDnsClientProtocol(txdnspython.generic.GenericDnsClientProtocol, txdnspython.framing.MessageFraming,
+                           Protocol):
+    id_offset = 2
+
+    def __init__(self, reactor, one_rr_per_rrset, ready, exhausted_policy = txdnspython.generic.QUEUE,
+                 timer = None, stats = None):
+        txdnspython.generic.GenericDnsClientProtocol.__init__(self, reactor, one_rr_per_rrset, exhausted_policy, timer,
+                                                              stats)
+        txdnspython.framing.MessageFraming.__init__(self)
         self.ready = ready
-        self.buffer = ''
-        self.waiting_for = None
+
+        self.client = None
+        """
+        The L{TcpDnsClient} whose pool this connection belongs to, or
+        C{None}.  The client is told when queries finish and when the
+        connection is lost.
+        """
 
     def connectionMade(self):
         self.ready.callback(self)
 
     def connectionLost(self, reason):
-        for id, (query, query_response, delayed_call) in self.pending.items():
-
-            if delayed_call and delayed_call.active():
-                delayed_call.cancel()
-
-            query_response.errback(reason)
+        client, self.client = self.client, None
 
-        self.pending.clear()
+        if client is not None:
+            client._connection_lost(self, reason, self._take_waiting())
 
-    def dataReceived(self, data):
-        self.buffer += data
-        while True:
-            if self.waiting_for is None and len(self.buffer) < 2:
-                return
+        self._fail_all(reason)
 
-            if self.waiting_for is None and len(self.buffer) >= 2:
-                (self.waiting_for,) = struct.unpack('!H', self.buffer[:2])
-                self.buffer = self.buffer[2:]
+    def _release_id(self, query_id):
+        txdnspython.generic.GenericDnsClientProtocol._release_id(self, query_id)
 
-            if self.waiting_for > len(self.buffer):
-                return
+        if self.client is not None:
+            self.client._connection_available(self)
 
-            wire_data = self.buffer[:self.waiting_for]
-            self.buffer = self.buffer[self.waiting_for:]
-            self.waiting_for = None
-
-            self._process_response(wire_data)
-
-    def send_query(self, query, query_response, timeout = None):
-        wire_data = query.to_wire()
-        self._send_query(struct.pack('!H', len(wire_data)) + wire_data,
+    def send_query(self, query, query_response, timeout = None, decode = txdnspython.decode.MESSAGE):
+        self._send_query(txdnspython.framing.frame(query.to_wire()),
                          query,
                          query_response,
-                         timeout)
+                         timeout,
+                         decode)
 
 class TcpDnsClientFactory(ClientFactory):
-    def __init__(self, reactor, one_rr_per_rrset):
+    def __init__(self, reactor, one_rr_per_rrset, exhausted_policy = txdnspython.generic.QUEUE, timer = None,
+                 stats = None):
         self.reactor = reactor
         self.one_rr_per_rrset = one_rr_per_rrset
+        self.exhausted_policy = exhausted_policy
+        self.timer = timer
+        self.stats = stats
         self.ready = defer.Deferred()
 
     def buildProtocol(self, addr):
-        return TcpDnsClientProtocol(self.reactor, self.one_rr_per_rrset, self.ready)
+        return TcpDnsClientProtocol(self.reactor, self.one_rr_per_rrset, self.ready, self.exhausted_policy, self.timer,
+                                    self.stats)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.ready.errback(reason)
 
-class TcpDnsClient(object):
-    def __init__(self, reactor, address, port = 53, one_rr_per_rrset = False, source = '', source_port = 0):
+class TcpDnsClient(txdnspython.generic.GenericDnsClient):
+    def __init__(self, reactor, address, port = 53, one_rr_per_rrset = False, source = '', source_port = 0,
+                 exhausted_policy = txdnspython.generic.QUEUE, connections = 1, max_in_flight = None,
+                 idle_timeout = None, cache = None, coalesce = False, timer = None,
+                 decode = txdnspython.decode.MESSAGE, stats = None, limit = None, capture = None):
         """
         Initialize the client object.
-        
+
+        The client keeps a pool of up to C{connections} TCP
+        connections to the name server.  Queries are pipelined over
+        the connection with the fewest queries in flight.  A new
+        connection is opened when every open connection is busy and
+        the pool is not full.  Queries that cannot be sent right away
+        are queued and sent as soon as a connection has room for
+        them, including on the connection that replaces one that was
+        lost.  Queries that were in flight on a lost connection fail
+        with the reason the connection was lost.
+
         @param reactor: Twisted reactor - used to open TCP connections and schedule timeouts
         @type reactor: object that implements
         L{twisted.internet.interfaces.IReactorTCP} (used to open TCP
@@ -111,73 +131,353 @@ class TcpDnsClient(object):
         @type source: string
 
         @param source_port: The port from which to send the message.
-        The default is 0.
+        The default is 0.  A non-zero port can only be used by one
+        connection at a time.
         @type source_port: int
 
         @param one_rr_per_rrset: Put each RR into its own RRset
         @type one_rr_per_rrset: bool
+
+        @param exhausted_policy: what to do with new queries when all
+        65,536 query IDs are in use on the connection, either
+        L{txdnspython.generic.QUEUE} or L{txdnspython.generic.FAIL}
+        @type exhausted_policy: str
+
+        @param connections: The maximum number of connections to keep
+        open to the name server.  The default is 1.
+        @type connections: int
+
+        @param max_in_flight: The maximum number of queries that may
+        be in flight on a single connection.  If C{None}, the
+        default, there is no limit.
+        @type max_in_flight: int
+
+        @param idle_timeout: The number of seconds a connection may
+        sit without queries in flight before it is closed.  If
+        C{None}, the default, idle connections are kept open.
+        @type idle_timeout: float
+
+        @param cache: cache to answer queries from before sending
+        them, and to store responses in
+        @type cache: L{txdnspython.cache.DnsCache}
+
+        @param coalesce: If C{True}, a query that asks the same
+        question as a query that is already in flight is not sent,
+        but gets a copy of the response to that query.  Each query
+        still times out on its own: if the query in flight times out,
+        it is sent again for the queries that joined it and still have
+        time left.  If it fails otherwise, every query that joined it
+        fails the same way.
+        @type coalesce: bool
+
+        @param timer: what to schedule query timeouts with instead of
+        the reactor, for example a L{txdnspython.timer.TimerWheel}
+        shared with other clients
+        @type timer: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
+
+        @param decode: how to decode responses unless a query asks
+        otherwise, one of the modes in L{txdnspython.decode}
+        @type decode: str
+
+        @param stats: what to count the queries, responses and
+        response latencies of every connection in
+        @type stats: L{txdnspython.stats.Stats}
+
+        @param limit: what to hold queries back with, to limit their
+        rate, how many are in flight and how many wait to be sent.
+        If C{None}, the default, queries are sent at once.
+        @type limit: L{txdnspython.limit.Limiter}
+
+        @param capture: what to record the queries sent and the
+        responses received over every connection in, to replay them
+        later.  If C{None}, the default, nothing is recorded.
+        @type capture: L{txdnspython.capture.Capture}
         """
 
-        self.reactor = reactor
+        txdnspython.generic.GenericDnsClient.__init__(self, reactor, cache, coalesce, timer, decode, stats, limit,
+                                                      capture)
+        self.address = address
+        self.port = port
+        self.bind_address = (source, source_port)
+        self.one_rr_per_rrset = one_rr_per_rrset
+        self.exhausted_policy = exhausted_policy
+        self.max_connections = connections
+        self.max_in_flight = max_in_flight
+        self.idle_timeout = idle_timeout
+
         self.queued = collections.OrderedDict()
-        self.factory = TcpDnsClientFactory(self.reactor, one_rr_per_rrset)
+        """
+        L{collections.OrderedDict} of queries waiting for a
+        connection with room for them, in the order they were made.
+        The keys are taken from an internal counter and the values
+        are tuples of L{dns.message.Message},
+        L{twisted.internet.defer.Deferred},
+        L{twisted.internet.base.DelayedCall} (or C{None} if there is
+        no timeout associated with the query), and the decode mode.
+        """
+
+        self.connections = []
+        """The connected L{TcpDnsClientProtocol} instances"""
+
+        self.connecting = []
+        """The L{twisted.internet.interfaces.IConnector} of each connection attempt in progress"""
+
         self.protocol = None
-        self.factory.ready.addCallback(self._cbConnected)
+        """One of the connected L{TcpDnsClientProtocol} instances, or C{None}"""
 
-        connector = self.reactor.connectTCP(address, port, self.factory, bindAddress=(source, source_port))
+        self.closed = False
 
-    def _cbConnected(self, result):
-        self.protocol = result
+        self._queue_keys = itertools.count()
+        self._idle_calls = {}
 
-        # now send all of the queued messages that were waiting for the
-        # protocol to connect
-        for query, query_response, delayed_call in self.queued.values():
-            if delayed_call:
+        self._connect()
+
+    def _connect(self):
+        factory = TcpDnsClientFactory(self.reactor, self.one_rr_per_rrset, self.exhausted_policy, self.timer,
+                                      self.stats)
+        connector = self.reactor.connectTCP(self.address, self.port, factory, bindAddress = self.bind_address)
+        self.connecting.append(connector)
+        factory.ready.addCallbacks(self._cbConnected, self._ebConnected,
+                                   callbackArgs = (connector,), errbackArgs = (connector,))
+
+    def _grow(self):
+        """Open another connection if the pool has room for one and
+        no other connection attempt is in progress."""
+
+        if self.connecting or self.closed:
+            return
+
+        if len(self.connections) < self.max_connections:
+            self._connect()
+
+    def _cbConnected(self, protocol, connector):
+        self.connecting.remove(connector)
+
+        if self.closed:
+            protocol.transport.loseConnection()
+            return
+
+        protocol.client = self
+
+        if self.capture is not None:
+            protocol.capture = self.capture
+            protocol.capture_stream = self.capture.stream()
+        self.connections.append(protocol)
+        self.protocol = self.connections[0]
+
+        self._send_queued()
+        self._check_idle(protocol)
+
+    def _ebConnected(self, reason, connector):
+        self.connecting.remove(connector)
+
+        if self.closed or self.connections:
+            return
+
+        # nothing to send the queued queries over, so give up on them
+        # rather than have them wait for a connection that may never
+        # come - the next query will try to connect again
+        queued = list(self.queued.values())
+        self.queued.clear()
+
+        for query, query_response, delayed_call, decode in queued:
+            if delayed_call and delayed_call.active():
                 delayed_call.cancel()
-                timeout = delayed_call.getTime() - time.time()
-                self.protocol.send_query(query, query_response, timeout)
+
+            query_response.errback(reason)
+
+    def _connection_lost(self, protocol, reason, waiting):
+        """
+        Called by a connection in the pool when it has been lost.
+        Queries that were waiting for a query ID on that connection
+        (and so were never sent) are sent again over another
+        connection.
+
+        @param waiting: tuples of L{dns.message.Message},
+        L{twisted.internet.defer.Deferred}, the time left before the
+        query times out and the decode mode
+        @type waiting: C{list}
+        """
+
+        idle_call = self._idle_calls.pop(protocol, None)
+        if idle_call and idle_call.active():
+            idle_call.cancel()
+
+        if protocol in self.connections:
+            self.connections.remove(protocol)
+            self.protocol = self.connections[0] if self.connections else None
+
+        for query, query_response, timeout, decode in waiting:
+            if self.closed:
+                query_response.errback(reason)
 
             else:
-                self.protocol.send_query(query, query_response, None)
+                self._dispatch(query, query_response, timeout, decode)
 
-        self.queued.clear()
+        if self.queued:
+            self._grow()
 
-    def send_query(self, query, timeout = None):
-        """Send a query to the nameserver.
+    def _connection_available(self, protocol):
+        """
+        Called by a connection in the pool whenever one of its
+        queries has finished.
+        """
+
+        if self.queued:
+            self._send_queued()
+
+        self._check_idle(protocol)
+
+    def _check_idle(self, protocol):
+        if self.idle_timeout is None or protocol.load() or protocol in self._idle_calls:
+            return
+
+        self._idle_calls[protocol] = self.reactor.callLater(self.idle_timeout, self._close_idle, protocol)
 
-        @param query: the query
-        @type query: dns.message.Message object
-        @param timeout: The number of seconds to wait before the query times out.
-        If None, the default, wait forever.
-        @type timeout: float
-        @rtype: twisted.internet.defer.Deferred object
+    def _close_idle(self, protocol):
+        del self._idle_calls[protocol]
+
+        if protocol.load() or protocol not in self.connections:
+            return
+
+        self.connections.remove(protocol)
+        self.protocol = self.connections[0] if self.connections else None
+        protocol.client = None
+        protocol.transport.loseConnection()
+
+    def _select_connection(self):
         """
+        Find the connection with the fewest queries in flight that
+        still has room for another query.
+
+        @rtype: L{TcpDnsClientProtocol} or C{None}
+        """
+
+        best = None
+        best_load = self.max_in_flight
 
-        query_response = defer.Deferred()
+        for protocol in self.connections:
+            load = protocol.load()
+            if best_load is None or load < best_load:
+                best = protocol
+                best_load = load
+
+        return best
+
+    def _send(self, protocol, query, query_response, timeout, decode):
+        idle_call = self._idle_calls.pop(protocol, None)
+        if idle_call and idle_call.active():
+            idle_call.cancel()
+
+        protocol.send_query(query, query_response, timeout, decode)
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        if self.closed:
+            query_response.errback(failure.Failure(error.ConnectionDone()))
+            return
+
+        protocol = self._select_connection()
+
+        if protocol is None:
+            key = next(self._queue_keys)
 
-        if self.protocol is None:
             if timeout:
-                delayed_call = self.reactor.callLater(timeout, self._timeout, query.id)
+                delayed_call = self.timer.callLater(timeout, self._timeout, key)
 
             else:
                 delayed_call = None
 
-            self.queued[query.id] = (query, query_response, delayed_call)
+            self.queued[key] = (query, query_response, delayed_call, decode)
+            self._grow()
 
         else:
-            self.protocol.send_query(query, query_response, timeout)
+            if protocol.load():
+                self._grow()
 
-        return query_response
+            self._send(protocol, query, query_response, timeout, decode)
 
-    def _timeout(self, query_id):
-        if self.queued and self.queued.has_key(query_id):
-            query, query_response, delayed_call = self.queued[query_id]
-            del self.queued[query_id]
-            query_response.errback(failure.Failure(dns.exception.Timeout()))
+    def _send_queued(self):
+        """Send as many queued queries as the open connections have room for."""
 
-        elif self.protocol:
-            self.protocol._timeout(query_id)
+        while self.queued:
+            protocol = self._select_connection()
+            if protocol is None:
+                break
+
+            key, (query, query_response, delayed_call, decode) = self.queued.popitem(last = False)
+
+            if delayed_call:
+                delayed_call.cancel()
+                timeout = delayed_call.getTime() - self.reactor.seconds()
+                if timeout <= 0:
+                    query_response.errback(dns.exception.Timeout())
+                    continue
+
+            else:
+                timeout = None
+
+            self._send(protocol, query, query_response, timeout, decode)
+
+        if self.queued:
+            self._grow()
+
+    def _timeout(self, key):
+        entry = self.queued.pop(key, None)
+        if entry is not None:
+            query, query_response, delayed_call, decode = entry
+            query_response.errback(dns.exception.Timeout())
+
+    def zone_transfer(self, zone, consumer, rdtype = 'AXFR', serial = 0, deliver = txdnspython.xfr.MESSAGES,
+                      timeout = None, keyring = None, keyname = None, keyalgorithm = None):
+        """
+        Transfer a zone from the name server over a connection of its
+        own, handing the responses to C{consumer} as they are read.
+        See L{txdnspython.xfr.ZoneTransfer} for the arguments.
+
+        @return: a deferred that fires with the
+        L{txdnspython.xfr.ZoneTransfer} once the transfer has finished
+        @rtype: L{twisted.internet.defer.Deferred}
+        """
+
+        source, source_port = self.bind_address
+        transfer = txdnspython.xfr.ZoneTransfer(self.reactor, self.address, zone, consumer, rdtype, serial, self.port,
+                                                source, source_port, deliver, timeout, keyring, keyname,
+                                                keyalgorithm)
+        return transfer.start()
 
     def close(self):
-        self.protocol.transport.loseConnection()
+        """
+        Close every connection in the pool.  Queries that have not
+        been answered yet fail.  It is safe to call this before any
+        connection has been made.
+        """
+
+        if self.closed:
+            return
+
+        self.closed = True
+        self._cancel_limited()
+
+        for connector in list(self.connecting):
+            connector.disconnect()
+
+        for idle_call in self._idle_calls.values():
+            if idle_call.active():
+                idle_call.cancel()
+
+        self._idle_calls.clear()
+
+        queued = list(self.queued.values())
+        self.queued.clear()
+
+        for query, query_response, delayed_call, decode in queued:
+            if delayed_call and delayed_call.active():
+                delayed_call.cancel()
+
+            query_response.errback(failure.Failure(error.ConnectionDone()))
+
+        for protocol in list(self.connections):
+            protocol.transport.loseConnection()
+
         self.protocol = None
@@ -0,0 +1,125 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import collections
+
+import dns.message
+import dns.rdataclass
+
+class QueryTemplate(dns.message.Message):
+    """
+    A query whose wire format has been rendered once and is reused
+    every time it is sent.  The protocols write their own query ID
+    into a copy of the wire data, so one template can be sent any
+    number of times, and at the same time, to any number of clients.
+    Responses are matched and decoded against the template like
+    against any other query.
+
+    A template must not be changed once it has been rendered; build a
+    new one with L{render} instead.
+    """
+
+    wire = None
+    """The rendered query"""
+
+    def to_wire(self, origin = None, max_size = 0, **kw):
+        if origin is None and not max_size and not kw:
+            return self.wire
+
+        return dns.message.Message.to_wire(self, origin, max_size, **kw)
+
+def render(query):
+    """
+    Turn a query into a L{QueryTemplate}.  The query itself is left
+    alone.
+
+    @param query: the query
+    @type query: L{dns.message.Message}
+    @rtype: L{QueryTemplate}
+    @raise ValueError: if the query is TSIG signed, since a signature
+    covers the time it was made and cannot be reused
+    """
+
+    if query.keyring is not None:
+        raise ValueError('TSIG signed queries cannot be rendered into templates')
+
+    template = QueryTemplate.__new__(QueryTemplate)
+    template.__dict__.update(query.__dict__)
+    template.question = list(query.question)
+    template.wire = dns.message.Message.to_wire(query)
+    return template
+
+class QueryTemplateCache(object):
+    """
+    A bounded cache of L{QueryTemplate}s, built on demand from the
+    arguments of L{dns.message.make_query} and evicting the least
+    recently used template when it is full.
+    """
+
+    def __init__(self, max_entries = 1024):
+        """
+        Initialize.
+
+        @param max_entries: the most templates to keep
+        @type max_entries: C{int}
+        """
+
+        self.max_entries = max_entries
+
+        self.entries = collections.OrderedDict()
+        """L{collections.OrderedDict} of the templates, least recently used first"""
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, qname, rdtype, rdclass = dns.rdataclass.IN, use_edns = None, want_dnssec = False,
+            payload = None):
+        """
+        Return the template for a question, rendering it if it is not
+        in the cache.  The arguments are those of
+        L{dns.message.make_query}.
+
+        @rtype: L{QueryTemplate}
+        """
+
+        key = (qname, rdtype, rdclass, use_edns, want_dnssec, payload)
+        entries = self.entries
+
+        template = entries.pop(key, None)
+        if template is not None:
+            self.hits += 1
+            entries[key] = template
+            return template
+
+        self.misses += 1
+        template = render(dns.message.make_query(qname, rdtype, rdclass, use_edns, want_dnssec, payload = payload))
+        entries[key] = template
+
+        if len(entries) > self.max_entries:
+            entries.popitem(last = False)
+
+        return template
+
+    def clear(self):
+        self.entries.clear()
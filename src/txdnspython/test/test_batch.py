@@ -0,0 +1,102 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.python import failure
+
+import txdnspython.udp
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.message
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = txdnspython.udp.UdpDnsClient(MyFakeUdpReactor(self.clock), '8.8.8.8')
+        self.protocol = self.client.protocol
+        self.pulled = 0
+
+    def queries(self, count):
+        for i in range(count):
+            self.pulled += 1
+            yield dns.message.make_query('www{}.example.com.'.format(i), 'A')
+
+    def respond(self):
+        packet, address = self.protocol.transport.written.pop(0)
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        self.protocol.datagramReceived(response.to_wire(), address)
+
+    def test_callback(self):
+        results = []
+        batch = self.client.send_queries(self.queries(10), concurrency = 3, timeout = 5.0,
+                                         callback = lambda query, result: results.append((query, result)))
+        self.assertEqual(3, len(self.protocol.pending))
+        self.assertEqual(3, self.pulled)
+
+        for i in range(4):
+            self.respond()
+        self.assertEqual(4, len(results))
+        self.assertEqual(3, len(self.protocol.pending))
+
+        self.clock.advance(5.0)
+        self.assertEqual(10, self.pulled)
+        self.assertEqual(3, batch.failed)
+
+        while self.protocol.transport.written:
+            self.respond()
+        self.assertEqual(10, len(results))
+        for query, result in results:
+            if not isinstance(result, failure.Failure):
+                self.assertTrue(query.is_response(result))
+        self.assertEqual(7, batch.succeeded)
+        self.assertTrue(batch.done.called)
+
+    def test_stream(self):
+        batch = self.client.send_queries(self.queries(5), concurrency = 2)
+        self.respond()
+        self.respond()
+
+        # results that have not been taken keep further queries back
+        self.assertEqual(2, len(batch.results))
+        self.assertEqual(0, len(self.protocol.pending))
+        self.assertEqual(2, self.pulled)
+
+        taken = []
+        batch.get().addCallback(taken.append)
+        self.assertEqual(1, len(self.protocol.pending))
+
+        waiting = batch.get()
+        waiting.addCallback(taken.append)
+        waiting = batch.get()
+        waiting.addCallback(taken.append)
+        self.assertFalse(waiting.called)
+        self.assertEqual(2, len(self.protocol.pending))
+
+        while self.protocol.transport.written:
+            self.respond()
+
+        self.assertEqual(3, len(taken))
+        for i in range(3):
+            batch.get().addCallback(taken.append)
+        self.assertTrue(batch.done.called)
+        self.assertEqual(None, taken[-1])
+        self.assertEqual(5, len([result for result in taken if result is not None]))
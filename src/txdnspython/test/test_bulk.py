@@ -0,0 +1,101 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import json
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.python import failure
+
+import txdnspython.bulk
+import txdnspython.generic
+
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+class AnsweringClient(txdnspython.generic.GenericDnsClient):
+    """Answers A queries after a second and lets every other query time out."""
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        question = query.question[0]
+        if question.rdtype == dns.rdatatype.A:
+            response = dns.message.make_response(query)
+            response.answer.append(dns.rrset.from_text(question.name, 300, 'IN', 'A', '192.0.2.1'))
+            self.reactor.callLater(1.0, query_response.callback, response)
+
+        else:
+            self.reactor.callLater(timeout, query_response.errback, failure.Failure(dns.exception.Timeout()))
+
+class Output(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(json.loads(data))
+
+    def flush(self):
+        pass
+
+class BulkTest(unittest.TestCase):
+    def test_read_names(self):
+        files = [io.StringIO(u'www.example.com.\n\n# comment\nexample.com. mx\n'), io.StringIO(u'example.net.\n')]
+        self.assertEqual([(u'www.example.com.', 'A'), (u'example.com.', u'MX'), (u'example.net.', 'A')],
+                         list(txdnspython.bulk.read_names(files, 'A')))
+
+    def test_record(self):
+        query = dns.message.make_query('www.example.com.', 'A')
+        response = dns.message.make_response(query)
+        response.set_rcode(dns.rcode.NXDOMAIN)
+        self.assertEqual({'name': 'www.example.com.', 'type': 'A', 'ms': 12.5, 'rcode': 'NXDOMAIN', 'answers': []},
+                         txdnspython.bulk.record('www.example.com.', 'A', response, 0.0125))
+
+        entry = txdnspython.bulk.record('www.example.com.', 'A', failure.Failure(dns.exception.Timeout()), 5.0)
+        self.assertEqual('timeout', entry['error'])
+
+    def test_run(self):
+        clock = task.Clock()
+        output = Output()
+        names = iter([('a.example.', 'A'), ('b.example.', 'AAAA'), ('c..example.', 'A'), ('d.example.', 'A')])
+        bulk = txdnspython.bulk.BulkResolver(clock, AnsweringClient(clock), names, output, concurrency = 2,
+                                             timeout = 5.0)
+        done = bulk.run()
+
+        clock.advance(1.0)
+        self.assertEqual([['a.example.', 300, 'A', '192.0.2.1']], output.lines[0]['answers'])
+        self.assertEqual('invalid', output.lines[1]['error'])
+        clock.pump([1.0] * 5)
+        self.assertIdentical(bulk, self.successResultOf(done))
+
+        self.assertEqual(['a.example.', 'c..example.', 'd.example.', 'b.example.'],
+                         [line['name'] for line in output.lines])
+        self.assertEqual({}, bulk._sent_at)
+
+        summary = bulk.summary()
+        self.assertEqual(3, summary['queries'])
+        self.assertEqual(2, summary['responses'])
+        self.assertEqual({'NOERROR': 2}, summary['rcodes'])
+        self.assertEqual({'timeout': 1}, summary['errors'])
+        self.assertEqual(1, summary['invalid'])
+        self.assertEqual(5.0, summary['seconds'])
@@ -0,0 +1,115 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+import txdnspython.cache
+import txdnspython.udp
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rrset
+
+def make_response(query, ttl = 300):
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(query.question[0].name, ttl, 'IN', 'A', '192.0.2.1'))
+    return response
+
+def make_negative_response(query, ttl = 3600, minimum = 60):
+    response = dns.message.make_response(query)
+    response.set_rcode(dns.rcode.NXDOMAIN)
+    response.authority.append(dns.rrset.from_text('example.com.', ttl, 'IN', 'SOA',
+                                                  'ns.example.com. hostmaster.example.com. 1 7200 900 1209600 {}'.format(minimum)))
+    return response
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = txdnspython.cache.DnsCache(self.clock, max_entries = 2)
+
+    def test_hit(self):
+        query = dns.message.make_query('www.example.com.', 'A')
+        self.cache.put(make_response(query), query)
+        self.clock.advance(100)
+
+        again = dns.message.make_query('www.example.com.', 'A')
+        response = self.cache.get(again)
+        self.assertTrue(again.is_response(response))
+        self.assertEqual(200, response.answer[0].ttl)
+        self.assertEqual(1, self.cache.hits)
+
+        self.clock.advance(200)
+        self.assertEqual(None, self.cache.get(again))
+        self.assertEqual(1, self.cache.misses)
+        self.assertEqual(0, len(self.cache))
+
+    def test_negative(self):
+        query = dns.message.make_query('nx.example.com.', 'A')
+        self.cache.put(make_negative_response(query), query)
+        self.clock.advance(59)
+        response = self.cache.get(query)
+        self.assertEqual(dns.rcode.NXDOMAIN, response.rcode())
+        self.assertEqual(3541, response.authority[0].ttl)
+        self.clock.advance(1)
+        self.assertEqual(None, self.cache.get(query))
+
+    def test_not_cached(self):
+        query = dns.message.make_query('www.example.com.', 'A')
+        response = make_response(query)
+        response.flags |= dns.flags.TC
+        self.cache.put(response, query)
+
+        response = dns.message.make_response(query)
+        response.set_rcode(dns.rcode.SERVFAIL)
+        self.cache.put(response, query)
+
+        self.assertEqual(0, len(self.cache))
+
+    def test_flags_in_key(self):
+        query = dns.message.make_query('www.example.com.', 'A')
+        self.cache.put(make_response(query), query)
+        query = dns.message.make_query('www.example.com.', 'A')
+        query.flags &= ~dns.flags.RD
+        self.assertEqual(None, self.cache.get(query))
+
+    def test_lru(self):
+        queries = [dns.message.make_query('{}.example.com.'.format(name), 'A') for name in 'abc']
+        self.cache.put(make_response(queries[0]), queries[0])
+        self.cache.put(make_response(queries[1]), queries[1])
+        self.cache.get(queries[0])
+        self.cache.put(make_response(queries[2]), queries[2])
+        self.assertEqual(1, self.cache.evictions)
+        self.assertNotEqual(None, self.cache.get(queries[0]))
+        self.assertEqual(None, self.cache.get(queries[1]))
+
+    def test_client(self):
+        reactor = MyFakeUdpReactor(self.clock)
+        client = txdnspython.udp.UdpDnsClient(reactor, '8.8.8.8', cache = self.cache)
+        client.send_query(dns.message.make_query('www.example.com.', 'A'))
+        packet, address = client.protocol.transport.written[0]
+        client.protocol.datagramReceived(make_response(dns.message.from_wire(packet)).to_wire(), address)
+
+        query_response = client.send_query(dns.message.make_query('www.example.com.', 'A'))
+        self.assertTrue(query_response.called)
+        self.assertEqual(1, len(client.protocol.transport.written))
@@ -0,0 +1,188 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import struct
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+import txdnspython.capture
+import txdnspython.generic
+import txdnspython.testing
+import txdnspython.udp
+
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.exception
+import dns.message
+import dns.rcode
+
+def wire(name, query_id, response = False):
+    message = dns.message.make_query(name, 'A')
+    if response:
+        message = dns.message.make_response(message)
+
+    message.id = query_id
+    return message.to_wire()
+
+class ReplayClient(txdnspython.generic.GenericDnsClient):
+    """Answers every query at once, except those for timeout.example."""
+
+    def __init__(self, reactor):
+        txdnspython.generic.GenericDnsClient.__init__(self, reactor)
+        self.sent = []
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        self.sent.append((self.reactor.seconds(), query.to_wire()))
+        if str(query.question[0].name) == 'timeout.example.':
+            query_response.errback(dns.exception.Timeout())
+
+        else:
+            query_response.callback(dns.message.make_response(query))
+
+class CaptureTest(unittest.TestCase):
+    def test_read(self):
+        output = io.BytesIO()
+        capture = txdnspython.capture.Capture(output)
+        capture.record(txdnspython.capture.QUERY, 3, 1.5, b'query')
+        capture.record(txdnspython.capture.RESPONSE, 3, 2.25, b'response')
+        self.assertEqual(2, capture.records)
+
+        data = output.getvalue()
+        self.assertEqual([(txdnspython.capture.QUERY, 3, 1.5, b'query'),
+                          (txdnspython.capture.RESPONSE, 3, 2.25, b'response')],
+                         list(txdnspython.capture.read(io.BytesIO(data))))
+
+        # a record that was cut short ends the capture
+        self.assertEqual(1, len(list(txdnspython.capture.read(io.BytesIO(data[:-3])))))
+        self.assertRaises(ValueError, list, txdnspython.capture.read(io.BytesIO(b'not a capture')))
+
+    def test_append(self):
+        path = self.mktemp()
+        for when in (1.0, 2.0):
+            capture = txdnspython.capture.Capture(path)
+            capture.record(txdnspython.capture.QUERY, 0, when, b'query')
+            capture.close()
+
+        with open(path, 'rb') as input:
+            self.assertEqual([1.0, 2.0], [when for kind, stream, when, data in txdnspython.capture.read(input)])
+
+    def test_client(self):
+        clock = task.Clock()
+        output = io.BytesIO()
+        client = txdnspython.udp.UdpDnsClient(MyFakeUdpReactor(clock), '8.8.8.8',
+                                              capture = txdnspython.capture.Capture(output))
+        query_response = client.send_query(dns.message.make_query('www.example.com.', 'A'))
+
+        clock.advance(0.5)
+        packet, address = client.protocol.transport.written[0]
+        response = dns.message.make_response(dns.message.from_wire(packet)).to_wire()
+        client.protocol.datagramReceived(response, address)
+        self.successResultOf(query_response)
+
+        records = list(txdnspython.capture.read(io.BytesIO(output.getvalue())))
+        self.assertEqual([(txdnspython.capture.QUERY, 0, 0.0, packet), (txdnspython.capture.RESPONSE, 0, 0.5, response)],
+                         records)
+
+    def test_streams(self):
+        output = io.BytesIO()
+        client = txdnspython.udp.UdpDnsClient(MyFakeUdpReactor(task.Clock()), '8.8.8.8', sockets = 2,
+                                              capture = txdnspython.capture.Capture(output))
+        first, second = client.protocols
+        first.ids.free = first.ids.free[1234:1235]
+        second.ids.free = second.ids.free[1234:1235]
+        client.send_query(dns.message.make_query('a.example.', 'A'))
+        client.send_query(dns.message.make_query('b.example.', 'A'))
+
+        sent = [stream for kind, stream, when, data in txdnspython.capture.read(io.BytesIO(output.getvalue()))]
+        self.assertEqual([0, 1], sorted(sent))
+
+        # the socket that sent last answers first, with the same query ID
+        for stream in reversed(sent):
+            protocol = first if first.capture_stream == stream else second
+            packet, address = protocol.transport.written[0]
+            response = dns.message.make_response(dns.message.from_wire(packet)).to_wire()
+            protocol.datagramReceived(response, address)
+
+        records = list(txdnspython.capture.read(io.BytesIO(output.getvalue())))
+        self.assertEqual(sent + sent[::-1], [stream for kind, stream, when, data in records])
+
+        exchanges = txdnspython.capture.exchanges(records)
+        for when, query_wire, response_wire in exchanges:
+            self.assertEqual(query_wire[:2], response_wire[:2])
+            self.assertTrue(dns.message.from_wire(query_wire).is_response(dns.message.from_wire(response_wire)))
+
+    def test_exchanges(self):
+        records = [(txdnspython.capture.QUERY, 0, 1.0, wire('a.example.', 1)),
+                   (txdnspython.capture.QUERY, 0, 2.0, wire('b.example.', 2)),
+                   (txdnspython.capture.RESPONSE, 0, 3.0, wire('x.example.', 3, True)),
+                   (txdnspython.capture.RESPONSE, 0, 4.0, wire('a.example.', 1, True)),
+                   (txdnspython.capture.QUERY, 0, 5.0, wire('c.example.', 1)),
+                   (txdnspython.capture.RESPONSE, 1, 5.5, wire('d.example.', 1, True)),
+                   (txdnspython.capture.RESPONSE, 0, 6.0, wire('c.example.', 1, True))]
+        self.assertEqual([(1.0, records[0][3], records[3][3]),
+                          (2.0, records[1][3], None),
+                          (5.0, records[4][3], records[6][3])],
+                         txdnspython.capture.exchanges(records))
+
+class ReplayTest(unittest.TestCase):
+    def test_answer(self):
+        first = wire('a.example.', 1, True)
+        second = wire('a.example.', 2, True)
+        answer = txdnspython.capture.ReplayAnswer([(1.0, wire('a.example.', 1), first),
+                                                   (2.0, wire('a.example.', 2), second),
+                                                   (3.0, wire('b.example.', 3), None)])
+        query = dns.message.make_query('A.example.', 'A')
+        self.assertEqual([first, second, first], [answer(query) for i in range(3)])
+        self.assertEqual(None, answer(dns.message.make_query('b.example.', 'A')))
+        self.assertEqual(dns.rcode.REFUSED, answer(dns.message.make_query('c.example.', 'A')).rcode())
+
+    def test_server(self):
+        recorded = wire('a.example.', 1, True)
+        answer = txdnspython.capture.ReplayAnswer([(1.0, wire('a.example.', 1), recorded)])
+        server = txdnspython.testing.StandInServer(task.Clock(), answer = answer)
+        response = server.respond(wire('a.example.', 4321), False)
+        self.assertEqual(struct.pack('!H', 4321) + recorded[2:], response)
+
+    def test_replay(self):
+        clock = task.Clock()
+        clock.advance(50.0)
+        client = ReplayClient(clock)
+        exchanges = [(100.0, wire('a.example.', 1), None),
+                     (101.0, wire('timeout.example.', 2), None),
+                     (101.0, b'\x00\x03junk', None),
+                     (103.0, wire('b.example.', 4), None)]
+        replay = txdnspython.capture.Replay(clock, client, exchanges, speed = 2.0)
+        done = replay.run()
+
+        clock.advance(0.5)
+        self.assertEqual(2, len(client.sent))
+        self.assertNoResult(done)
+        clock.advance(1.0)
+        self.assertIdentical(replay, self.successResultOf(done))
+
+        self.assertEqual([50.0, 50.5, 51.5], [when for when, data in client.sent])
+        self.assertEqual([exchanges[0][1], exchanges[1][1], exchanges[3][1]], [data for when, data in client.sent])
+        self.assertEqual(3, replay.sent)
+        self.assertEqual(2, replay.responses)
+        self.assertEqual({'Timeout': 1}, dict(replay.errors))
+        self.assertEqual(1, replay.skipped)
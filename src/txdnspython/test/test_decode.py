@@ -0,0 +1,87 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import struct
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+import txdnspython.cache
+import txdnspython.decode
+import txdnspython.udp
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rrset
+
+class DecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.query = dns.message.make_query('www.example.com.', 'A')
+        response = dns.message.make_response(self.query)
+        response.answer.append(dns.rrset.from_text('www.example.com.', 300, 'IN', 'A', '192.0.2.1'))
+        response.id = 4321
+        self.wire_data = response.to_wire()
+
+    def test_raw(self):
+        response = txdnspython.decode.decode(self.wire_data, self.query, txdnspython.decode.RAW)
+        self.assertEqual(struct.pack('!H', self.query.id) + self.wire_data[2:], response)
+
+    def test_header(self):
+        response = txdnspython.decode.decode(self.wire_data, self.query, txdnspython.decode.HEADER)
+        self.assertEqual(self.query.id, response.id)
+        self.assertEqual(dns.rcode.NOERROR, response.rcode())
+        self.assertEqual(1, response.ancount)
+        self.assertEqual([(self.query.question[0].name, self.query.question[0].rdtype, self.query.question[0].rdclass)],
+                         response.questions)
+
+    def test_header_bad_response(self):
+        query = dns.message.make_query('www.example.com.', 'AAAA')
+        self.assertRaises(dns.query.BadResponse,
+                          txdnspython.decode.decode, self.wire_data, query, txdnspython.decode.HEADER)
+
+    def test_lazy(self):
+        response = txdnspython.decode.decode(self.wire_data, self.query, txdnspython.decode.LAZY)
+        self.assertEqual(None, response._message)
+        self.assertEqual(dns.rcode.NOERROR, response.rcode())
+        self.assertEqual(None, response._message)
+        self.assertEqual('192.0.2.1', response.answer[0][0].address)
+        self.assertEqual(self.query.id, response.message.id)
+        self.assertTrue(self.query.is_response(response.message))
+
+    def test_client(self):
+        clock = task.Clock()
+        cache = txdnspython.cache.DnsCache(clock)
+        client = txdnspython.udp.UdpDnsClient(MyFakeUdpReactor(clock), '8.8.8.8', cache = cache,
+                                              decode = txdnspython.decode.HEADER)
+        results = []
+        client.send_query(self.query).addCallback(results.append)
+        packet, address = client.protocol.transport.written[0]
+        client.protocol.datagramReceived(packet[:2] + self.wire_data[2:], address)
+        self.assertTrue(isinstance(results[0], txdnspython.decode.ResponseHeader))
+        self.assertEqual(0, len(cache))
+
+        client.send_query(self.query, decode = txdnspython.decode.MESSAGE).addCallback(results.append)
+        packet, address = client.protocol.transport.written[1]
+        client.protocol.datagramReceived(packet[:2] + self.wire_data[2:], address)
+        self.assertTrue(self.query.is_response(results[1]))
+        self.assertEqual(1, len(cache))
@@ -0,0 +1,101 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+import txdnspython.edns
+
+import dns.message
+
+class OptTest(unittest.TestCase):
+    def test_add_opt(self):
+        query = dns.message.make_query('www.example.com.', 'A')
+        wire_data = txdnspython.edns.add_opt(query.to_wire(), 1232)
+        self.assertEqual(dns.message.make_query('www.example.com.', 'A', use_edns = 0, payload = 1232).to_wire()[2:],
+                         wire_data[2:])
+
+        parsed = dns.message.from_wire(wire_data)
+        self.assertEqual(0, parsed.edns)
+        self.assertEqual(1232, parsed.payload)
+        self.assertTrue(query.is_response(dns.message.make_response(parsed)))
+
+    def test_advertised(self):
+        query = dns.message.make_query('www.example.com.', 'A')
+        self.assertEqual(None, txdnspython.edns.advertised(query.to_wire()))
+        self.assertEqual(4096, txdnspython.edns.advertised(txdnspython.edns.add_opt(query.to_wire(), 4096)))
+
+        query = dns.message.make_query('www.example.com.', 'A', use_edns = 0, payload = 1400)
+        self.assertEqual(1400, txdnspython.edns.advertised(query.to_wire()))
+
+    def test_set_advertised(self):
+        wire_data = txdnspython.edns.add_opt(dns.message.make_query('www.example.com.', 'A').to_wire(), 4096)
+        wire_data = txdnspython.edns.set_advertised(wire_data, 512)
+        self.assertEqual(512, txdnspython.edns.advertised(wire_data))
+        self.assertEqual(512, dns.message.from_wire(wire_data).payload)
+
+class PayloadSizeTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.size = txdnspython.edns.PayloadSize(self.clock, 4096, threshold = 2, reprobe = 60.0)
+
+    def test_sizes(self):
+        self.assertEqual([4096, 1232, 512], self.size.sizes)
+        self.assertEqual([1232, 512], txdnspython.edns.PayloadSize(self.clock).sizes)
+        self.assertEqual([512], txdnspython.edns.PayloadSize(self.clock, 512).sizes)
+
+    def test_step_down(self):
+        self.size.timed_out(4096)
+        self.assertEqual(4096, self.size.current())
+        self.size.timed_out(4096)
+        self.assertEqual(1232, self.size.current())
+        self.assertEqual(1, self.size.step_downs)
+
+        # timeouts of queries sent before the step do not count again
+        self.size.timed_out(4096)
+        self.size.timed_out(4096)
+        self.assertEqual(1232, self.size.current())
+
+        self.size.timed_out(1232)
+        self.size.timed_out(1232)
+        self.assertEqual(512, self.size.current())
+
+        self.size.timed_out(512)
+        self.size.timed_out(512)
+        self.assertEqual(512, self.size.current())
+
+    def test_large_response_clears_failures(self):
+        self.size.timed_out(4096)
+        self.size.answered(4096, 300)
+        self.assertEqual(1, self.size.failures)
+        self.size.answered(4096, 2000)
+        self.assertEqual(0, self.size.failures)
+        self.size.timed_out(4096)
+        self.assertEqual(4096, self.size.current())
+
+    def test_reprobe(self):
+        self.size.timed_out(4096)
+        self.size.timed_out(4096)
+        self.clock.advance(59.0)
+        self.assertEqual(1232, self.size.current())
+        self.clock.advance(1.0)
+        self.assertEqual(4096, self.size.current())
+        self.assertEqual(0, self.size.failures)
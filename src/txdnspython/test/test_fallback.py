@@ -0,0 +1,151 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import struct
+
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+from twisted.internet import error
+from twisted.python import failure
+
+import txdnspython.fallback
+
+from txdnspython.test.test_udp import MyFakeDatagramTransport
+
+import dns.exception
+import dns.flags
+import dns.message
+
+class MyFakeReactor(proto_helpers.MemoryReactorClock):
+    def listenUDP(self, port, protocol, interface = ''):
+        transport = MyFakeDatagramTransport()
+        protocol.makeConnection(transport)
+        return transport
+
+class FallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = MyFakeReactor()
+        self.client = txdnspython.fallback.FallbackDnsClient(self.reactor, '127.0.0.1')
+        self.udp = self.client.protocol
+
+    def answer_udp(self, truncated):
+        packet, address = self.udp.transport.written.pop(0)
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        if truncated:
+            response.flags |= dns.flags.TC
+        self.udp.datagramReceived(response.to_wire(), address)
+
+    def connect(self):
+        host, port, factory, timeout, bindAddress = self.reactor.tcpClients[0]
+        proto = factory.buildProtocol((host, port))
+        proto.makeConnection(proto_helpers.StringTransport())
+        return proto
+
+    def answer_tcp(self, proto):
+        data = proto.transport.value()
+        proto.transport.clear()
+        (length,) = struct.unpack('!H', data[:2])
+        response = dns.message.make_response(dns.message.from_wire(data[2:2 + length]))
+        wire_data = response.to_wire()
+        proto.dataReceived(struct.pack('!H', len(wire_data)) + wire_data)
+
+    def test_not_truncated(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        query_response = self.client.send_query(query)
+        self.answer_udp(False)
+        self.assertTrue(query_response.called)
+        self.assertEqual(None, self.client.tcp)
+        self.assertEqual(0, self.client.truncated)
+
+    def test_truncated(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        query_response = self.client.send_query(query)
+        results = []
+        query_response.addCallback(results.append)
+        self.answer_udp(True)
+        self.assertFalse(query_response.called)
+        self.assertEqual(1, self.client.truncated)
+        self.assertEqual(1, self.client.fallbacks)
+        self.assertEqual(1, len(self.reactor.tcpClients))
+
+        proto = self.connect()
+        self.answer_tcp(proto)
+        self.assertEqual(1, len(results))
+        self.assertTrue(query.is_response(results[0]))
+        self.assertFalse(results[0].flags & dns.flags.TC)
+        self.assertEqual(65536, len(self.udp.ids))
+
+    def test_truncated_callbacks(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        results = []
+        self.client.send_query_callbacks(query, results.append, results.append)
+        self.answer_udp(True)
+        self.assertEqual([], results)
+
+        proto = self.connect()
+        self.answer_tcp(proto)
+        self.assertEqual(1, len(results))
+        self.assertTrue(query.is_response(results[0]))
+
+    def test_failure_counted_before_caller_errback(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        reasons = []
+        query_response.addErrback(reasons.append)
+        self.answer_udp(True)
+
+        proto = self.connect()
+        proto.connectionLost(failure.Failure(error.ConnectionLost()))
+        self.assertEqual(1, len(reasons))
+        self.assertEqual(1, self.client.fallback_failures)
+
+    def test_caller_error_not_counted(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        query_response.addCallback(lambda response: 1 / 0)
+        self.answer_udp(True)
+        self.answer_tcp(self.connect())
+        self.failureResultOf(query_response, ZeroDivisionError)
+        self.assertEqual(0, self.client.fallback_failures)
+
+    def test_tcp_client_reused(self):
+        for name in ('www.google.com.', 'mail.google.com.'):
+            self.client.send_query(dns.message.make_query(name, 'A'))
+            self.answer_udp(True)
+        self.assertEqual(2, self.client.fallbacks)
+        self.assertEqual(1, len(self.reactor.tcpClients))
+
+    def test_timeout_carried_over(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 5.0)
+        self.reactor.advance(3.0)
+        self.answer_udp(True)
+        self.connect()
+        self.reactor.advance(1.9)
+        self.assertFalse(query_response.called)
+        self.reactor.advance(0.1)
+        self.assertEqual(1, self.client.fallback_failures)
+        return self.assertFailure(query_response, dns.exception.Timeout)
+
+    def test_close(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        self.answer_udp(True)
+        self.client.close()
+        self.assertEqual(None, self.client.tcp)
+        self.assertEqual(1, self.client.fallback_failures)
+        return self.assertFailure(query_response, error.ConnectionDone)
@@ -0,0 +1,353 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Tests that every front end, Twisted and asyncio, UDP and TCP, must
+pass in the same way.  Each front end provides a driver that sends
+queries, reads what was written to the wire, delivers responses and
+moves its clock.
+"""
+
+import struct
+
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+from twisted.internet import task
+from twisted.python import failure
+
+import txdnspython.decode
+import txdnspython.tcp
+import txdnspython.udp
+
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.exception
+import dns.message
+
+try:
+    import asyncio
+
+except ImportError:
+    asyncio = None
+
+else:
+    import txdnspython.aio
+
+if asyncio is None:
+    _skip_asyncio = 'asyncio needs Python 3'
+
+else:
+    _skip_asyncio = None
+
+def _frame(wire_data):
+    return struct.pack('!H', len(wire_data)) + wire_data
+
+def _unframe(data):
+    messages = []
+    while data:
+        (length,) = struct.unpack('!H', data[:2])
+        messages.append(data[2:2 + length])
+        data = data[2 + length:]
+    return messages
+
+class FrontEndTests(object):
+    """
+    The tests.  Subclasses set up C{self.client}, C{self.protocol}
+    and C{self.clock} and provide C{send}, C{outcome}, C{written} and
+    C{deliver}.
+    """
+
+    def respond(self, wire_data):
+        response = dns.message.make_response(dns.message.from_wire(wire_data))
+        self.deliver(response.to_wire())
+
+    def assertAnswered(self, pending, query):
+        outcome = self.outcome(pending)
+        self.assertNotEqual(None, outcome)
+        succeeded, result = outcome
+        self.assertTrue(succeeded, result)
+        self.assertTrue(query.is_response(result))
+        self.assertEqual(query.id, result.id)
+
+    def assertFailed(self, pending, exception_type):
+        outcome = self.outcome(pending)
+        self.assertNotEqual(None, outcome)
+        succeeded, result = outcome
+        self.assertFalse(succeeded)
+        self.assertTrue(isinstance(result, exception_type), result)
+
+    def test_response(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        pending = self.send(query)
+        self.assertEqual(None, self.outcome(pending))
+        self.respond(self.written()[0])
+        self.assertAnswered(pending, query)
+        self.assertEqual(65536, len(self.protocol.ids))
+
+    def test_query_id_rewritten(self):
+        first = dns.message.make_query('www.google.com.', 'A')
+        second = dns.message.make_query('www.google.com.', 'AAAA')
+        second.id = first.id
+        first_pending = self.send(first)
+        second_pending = self.send(second)
+        written = self.written()
+        self.assertNotEqual(written[0][:2], written[1][:2])
+
+        for wire_data in reversed(written):
+            self.respond(wire_data)
+
+        self.assertAnswered(first_pending, first)
+        self.assertAnswered(second_pending, second)
+
+    def test_timeout(self):
+        pending = self.send(dns.message.make_query('www.google.com.', 'A'), 2.0)
+        self.clock.advance(1.9)
+        self.assertEqual(None, self.outcome(pending))
+        self.clock.advance(0.1)
+        self.assertFailed(pending, dns.exception.Timeout)
+        self.assertEqual({}, self.protocol.pending)
+
+    def test_late_response(self):
+        pending = self.send(dns.message.make_query('www.google.com.', 'A'), 1.0)
+        self.clock.advance(1.0)
+        self.respond(self.written()[0])
+        self.assertFailed(pending, dns.exception.Timeout)
+
+    def test_unmatched_response(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        pending = self.send(query)
+        wire_data = self.written()[0]
+        (query_id,) = struct.unpack('!H', wire_data[:2])
+        self.respond(struct.pack('!H', query_id ^ 1) + wire_data[2:])
+        self.assertEqual(None, self.outcome(pending))
+        self.respond(wire_data)
+        self.assertAnswered(pending, query)
+
+    def test_decode_header(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        pending = self.send(query, decode = txdnspython.decode.HEADER)
+        self.respond(self.written()[0])
+        succeeded, header = self.outcome(pending)
+        self.assertTrue(isinstance(header, txdnspython.decode.ResponseHeader))
+        self.assertTrue(header.is_response_to(query))
+
+    def test_malformed_response(self):
+        pending = self.send(dns.message.make_query('www.google.com.', 'A'))
+        wire_data = self.written()[0]
+        response = dns.message.make_response(dns.message.from_wire(wire_data))
+        self.deliver(response.to_wire()[:14])
+        self.assertFailed(pending, dns.exception.DNSException)
+
+class TwistedDriver(object):
+    def send(self, query, timeout = None, decode = None):
+        results = []
+        self.client.send_query(query, timeout, decode).addBoth(results.append)
+        return results
+
+    def outcome(self, results):
+        if not results:
+            return None
+
+        result = results[0]
+        if isinstance(result, failure.Failure):
+            return False, result.value
+
+        return True, result
+
+class TwistedUdpTest(TwistedDriver, FrontEndTests, unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = txdnspython.udp.UdpDnsClient(MyFakeUdpReactor(self.clock), '127.0.0.1')
+        self.protocol = self.client.protocol
+
+    def written(self):
+        return [packet for packet, address in self.protocol.transport.written]
+
+    def deliver(self, wire_data):
+        self.protocol.datagramReceived(wire_data, ('127.0.0.1', 53))
+
+class TwistedTcpTest(TwistedDriver, FrontEndTests, unittest.TestCase):
+    def setUp(self):
+        self.clock = proto_helpers.MemoryReactorClock()
+        self.client = txdnspython.tcp.TcpDnsClient(self.clock, '127.0.0.1')
+        host, port, factory, timeout, bindAddress = self.clock.tcpClients[0]
+        self.protocol = factory.buildProtocol((host, port))
+        self.protocol.makeConnection(proto_helpers.StringTransport())
+
+    def written(self):
+        return _unframe(self.protocol.transport.value())
+
+    def deliver(self, wire_data):
+        self.protocol.dataReceived(_frame(wire_data))
+
+class FakeAsyncioTransport(object):
+    def __init__(self):
+        self.sent = []
+        self.data = b''
+        self.closed = False
+
+    def sendto(self, data, address = None):
+        self.sent.append(data)
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+class AsyncioDriver(object):
+    skip = _skip_asyncio
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.clock = task.Clock()
+        self.client = self.client_class('127.0.0.1', loop = self.loop, clock = self.clock)
+        self.protocol = self.client._protocol()
+        self.protocol.connection_made(FakeAsyncioTransport())
+        self.client._connection_made(self.protocol)
+
+    def send(self, query, timeout = None, decode = None):
+        return self.client.send_query(query, timeout, decode)
+
+    def outcome(self, future):
+        if not future.done():
+            return None
+
+        if future.exception() is not None:
+            return False, future.exception()
+
+        return True, future.result()
+
+class AsyncioUdpTest(AsyncioDriver, FrontEndTests, unittest.TestCase):
+    if asyncio is not None:
+        client_class = txdnspython.aio.AsyncioUdpDnsClient
+
+    def written(self):
+        return self.protocol.transport.sent
+
+    def deliver(self, wire_data):
+        self.protocol.datagram_received(wire_data, ('127.0.0.1', 53))
+
+class AsyncioTcpTest(AsyncioDriver, FrontEndTests, unittest.TestCase):
+    if asyncio is not None:
+        client_class = txdnspython.aio.AsyncioTcpDnsClient
+
+    def written(self):
+        return _unframe(self.protocol.transport.data)
+
+    def deliver(self, wire_data):
+        data = _frame(wire_data)
+        self.protocol.data_received(data[:3])
+        self.protocol.data_received(data[3:])
+
+    def test_connection_lost(self):
+        pending = self.send(dns.message.make_query('www.google.com.', 'A'))
+        self.protocol.connection_lost(OSError('reset'))
+        self.assertEqual(None, self.client.protocol)
+        self.assertFailed(pending, Exception)
+
+class _AsyncioServer(object):
+    """Answers every query it gets over UDP or TCP."""
+
+    def __init__(self):
+        self.transport = None
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        response = dns.message.make_response(dns.message.from_wire(data))
+        self.transport.sendto(response.to_wire(), address)
+
+    def data_received(self, data):
+        self.buffer += data
+        for wire_data in _unframe(self.buffer):
+            response = dns.message.make_response(dns.message.from_wire(wire_data))
+            self.transport.write(_frame(response.to_wire()))
+        self.buffer = b''
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        pass
+
+    def eof_received(self):
+        pass
+
+class AsyncioLoopTest(unittest.TestCase):
+    """The asyncio clients against a server on a real event loop."""
+
+    skip = _skip_asyncio
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_queries(self, client, count):
+        queries = [dns.message.make_query('host{}.example.'.format(i), 'A') for i in range(count)]
+        futures = [client.send_query(query, 5.0) for query in queries]
+        responses = self.loop.run_until_complete(asyncio.gather(*futures))
+        for query, response in zip(queries, responses):
+            self.assertTrue(query.is_response(response))
+
+    def test_udp(self):
+        transport, server = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(_AsyncioServer, local_addr = ('127.0.0.1', 0)))
+        self.addCleanup(transport.close)
+        port = transport.get_extra_info('sockname')[1]
+
+        client = txdnspython.aio.AsyncioUdpDnsClient('127.0.0.1', port, loop = self.loop)
+        self.run_queries(client, 50)
+        client.close()
+
+    def test_tcp(self):
+        server = self.loop.run_until_complete(
+            self.loop.create_server(_AsyncioServer, '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+
+        client = txdnspython.aio.AsyncioTcpDnsClient('127.0.0.1', port, loop = self.loop)
+        self.run_queries(client, 50)
+        client.close()
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+    def test_connect_failed(self):
+        server = self.loop.run_until_complete(
+            self.loop.create_server(_AsyncioServer, '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+        client = txdnspython.aio.AsyncioTcpDnsClient('127.0.0.1', port, loop = self.loop)
+        future = client.send_query(dns.message.make_query('www.google.com.', 'A'), 5.0)
+        self.assertRaises(OSError, self.loop.run_until_complete, future)
+        self.assertEqual(None, client.connecting)
+        self.assertEqual(0, len(client.queued))
+
+    def test_closed(self):
+        client = txdnspython.aio.AsyncioUdpDnsClient('127.0.0.1', loop = self.loop)
+        client.close()
+        future = client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        self.assertTrue(future.done())
+        self.assertRaises(Exception, future.result)
@@ -0,0 +1,117 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import error
+from twisted.internet import task
+
+import txdnspython.generic
+import txdnspython.udp
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+
+class QueryIdAllocatorTest(unittest.TestCase):
+    def test_allocate_all(self):
+        ids = txdnspython.generic.QueryIdAllocator()
+        allocated = set(ids.allocate() for i in range(65536))
+        self.assertEqual(65536, len(allocated))
+        self.assertEqual(None, ids.allocate())
+        ids.release(1234)
+        self.assertEqual(1234, ids.allocate())
+
+class CoalesceTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+        self.client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', coalesce = True)
+        self.transport = self.client.protocol.transport
+
+    def respond(self, rcode = dns.rcode.NOERROR):
+        packet, address = self.transport.written.pop(0)
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        response.set_rcode(rcode)
+        self.client.protocol.datagramReceived(response.to_wire(), address)
+
+    def test_coalesce(self):
+        queries = [dns.message.make_query('www.example.com.', 'A') for i in range(3)]
+        results = []
+        for query in queries:
+            self.client.send_query(query, 5.0).addCallback(lambda response, query = query: results.append((query, response)))
+
+        self.assertEqual(1, len(self.transport.written))
+        self.assertEqual(2, self.client.coalesced)
+
+        self.respond()
+        self.assertEqual(3, len(results))
+        for query, response in results:
+            self.assertTrue(query.is_response(response))
+        self.assertEqual({}, self.client.in_flight)
+
+        self.client.send_query(dns.message.make_query('www.example.com.', 'A'))
+        self.assertEqual(1, len(self.transport.written))
+
+    def test_different_questions(self):
+        self.client.send_query(dns.message.make_query('www.example.com.', 'A'))
+        self.client.send_query(dns.message.make_query('www.example.com.', 'AAAA'))
+        self.assertEqual(2, len(self.transport.written))
+
+    def test_own_timeout(self):
+        first = self.client.send_query(dns.message.make_query('www.example.com.', 'A'), 10.0)
+        second = self.client.send_query(dns.message.make_query('www.example.com.', 'A'), 2.0)
+        self.clock.advance(2.0)
+        self.assertFailure(second, dns.exception.Timeout)
+        self.assertFalse(first.called)
+
+        self.respond()
+        self.assertTrue(first.called)
+
+    def test_failure_reaches_waiters(self):
+        first = self.client.send_query(dns.message.make_query('www.example.com.', 'A'), 5.0)
+        second = self.client.send_query(dns.message.make_query('www.example.com.', 'A'), 5.0)
+        self.client.protocol.stopProtocol()
+        self.failureResultOf(first, error.ConnectionDone)
+        self.failureResultOf(second, error.ConnectionDone)
+
+    def test_resent_after_timeout(self):
+        first = self.client.send_query(dns.message.make_query('www.example.com.', 'A'), 2.0)
+        second = self.client.send_query(dns.message.make_query('www.example.com.', 'A'), 5.0)
+        third = self.client.send_query(dns.message.make_query('www.example.com.', 'A'), 8.0)
+        self.transport.written = []
+        self.clock.advance(2.0)
+        self.failureResultOf(first, dns.exception.Timeout)
+        self.assertNoResult(second)
+        self.assertEqual(1, len(self.transport.written))
+
+        # the query sent again only has the time the second caller had left
+        self.clock.advance(3.0)
+        self.failureResultOf(second, dns.exception.Timeout)
+        self.assertNoResult(third)
+        self.assertEqual(2, len(self.transport.written))
+
+        self.transport.written.pop(0)
+        self.respond()
+        self.assertTrue(self.successResultOf(third).flags & dns.flags.QR)
+        self.assertEqual({}, self.client.in_flight)
+        self.assertEqual([], self.clock.getDelayedCalls())
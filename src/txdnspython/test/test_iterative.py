@@ -0,0 +1,218 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
+
+import txdnspython.fallback
+import txdnspython.iterative
+import txdnspython.testing
+
+import dns.name
+import dns.rcode
+import dns.rrset
+import dns.zone
+
+ROOT = '''
+@ 3600 IN SOA a.root. hostmaster.root. 1 3600 600 86400 3600
+@ 3600 IN NS a.root.
+a.root. 3600 IN A 127.0.0.2
+com. 3600 IN NS ns.com.
+ns.com. 3600 IN A 127.0.0.3
+net. 3600 IN NS ns.net.
+ns.net. 3600 IN A 127.0.0.3
+'''
+
+COM = '''
+@ 3600 IN SOA ns.com. hostmaster.com. 1 3600 600 86400 3600
+@ 3600 IN NS ns.com.
+ns 3600 IN A 127.0.0.3
+example 3600 IN NS ns1.example.com.
+example 3600 IN NS ns2.example.com.
+ns1.example 3600 IN A 127.0.0.4
+ns2.example 3600 IN A 127.0.0.5
+'''
+
+NET = '''
+@ 3600 IN SOA ns.net. hostmaster.net. 1 3600 600 86400 3600
+@ 3600 IN NS ns.net.
+ns 3600 IN A 127.0.0.3
+example 3600 IN NS ns1.example.com.
+'''
+
+EXAMPLE_COM = '''
+@ 3600 IN SOA ns1 hostmaster 1 3600 600 86400 300
+@ 3600 IN NS ns1
+@ 3600 IN NS ns2
+ns1 3600 IN A 127.0.0.4
+ns2 3600 IN A 127.0.0.5
+www 300 IN A 192.0.2.1
+alias 300 IN CNAME www
+other 300 IN CNAME www.example.net.
+'''
+
+EXAMPLE_NET = '''
+@ 3600 IN SOA ns1.example.com. hostmaster 1 3600 600 86400 300
+@ 3600 IN NS ns1.example.com.
+www 300 IN A 192.0.2.2
+'''
+
+def zone(text, origin):
+    return dns.zone.from_text(text, origin, relativize = False)
+
+class DelegationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = txdnspython.iterative.DelegationCache(self.clock, max_entries = 2)
+
+    def ns(self, name, ttl = 300):
+        return dns.rrset.from_text(name, ttl, 'IN', 'NS', 'ns1.' + name)
+
+    def test_closest(self):
+        self.cache.put_delegation(self.ns('com.'))
+        self.cache.put_delegation(self.ns('example.com.'))
+        self.assertEqual((dns.name.from_text('example.com.'), [dns.name.from_text('ns1.example.com.')]),
+                         self.cache.closest(dns.name.from_text('www.example.com.')))
+        self.assertEqual(dns.name.from_text('com.'), self.cache.closest(dns.name.from_text('www.test.com.'))[0])
+        self.assertEqual(None, self.cache.closest(dns.name.from_text('www.example.org.')))
+        self.assertEqual(2, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_expiry(self):
+        self.cache.put_delegation(self.ns('com.', 3600))
+        self.cache.put_delegation(self.ns('example.com.', 60))
+        self.clock.advance(60)
+        self.assertEqual(dns.name.from_text('com.'), self.cache.closest(dns.name.from_text('www.example.com.'))[0])
+        self.assertEqual(1, len(self.cache))
+
+    def test_evict_least_recently_used(self):
+        self.cache.put_delegation(self.ns('com.'))
+        self.cache.put_delegation(self.ns('net.'))
+        self.cache.closest(dns.name.from_text('com.'))
+        self.cache.put_delegation(self.ns('org.'))
+        self.assertEqual(None, self.cache.closest(dns.name.from_text('net.')))
+        self.assertNotEqual(None, self.cache.closest(dns.name.from_text('com.')))
+
+    def test_addresses(self):
+        name = dns.name.from_text('ns1.example.com.')
+        self.assertEqual(None, self.cache.get_addresses(name))
+        self.cache.put_addresses(dns.rrset.from_text(name, 60, 'IN', 'A', '192.0.2.1', '192.0.2.2'))
+        self.assertEqual(['192.0.2.1', '192.0.2.2'], sorted(self.cache.get_addresses(name)))
+        self.clock.advance(60)
+        self.assertEqual(None, self.cache.get_addresses(name))
+
+class IterativeResolverTest(unittest.TestCase):
+    timeout = 30
+
+    def setUp(self):
+        self.servers = {}
+        port = 0
+        for address, zones in [('127.0.0.2', [zone(ROOT, '.')]),
+                               ('127.0.0.3', [zone(COM, 'com.'), zone(NET, 'net.')]),
+                               ('127.0.0.4', [zone(EXAMPLE_COM, 'example.com.'), zone(EXAMPLE_NET, 'example.net.')])]:
+            server = txdnspython.testing.StandInServer(reactor, answer = txdnspython.testing.ZoneAnswer(*zones))
+            port = server.listen(port, address)
+            self.servers[address] = server
+
+        self.resolver = txdnspython.iterative.IterativeResolver(reactor, ['127.0.0.2'], port, timeout = 1.0)
+
+    def tearDown(self):
+        self.resolver.close()
+        stopping = [server.stop() for server in self.servers.values()]
+
+        # the clients' sockets close on the next turn of the reactor
+        stopping.append(task.deferLater(reactor, 0, lambda: None))
+        return defer.gatherResults(stopping)
+
+    def addresses(self, response):
+        return [rdata.address for rrset in response.answer if rrset.rdtype == dns.rdatatype.A for rdata in rrset]
+
+    @defer.inlineCallbacks
+    def test_follow_referrals(self):
+        response = yield self.resolver.resolve('www.example.com.')
+        self.assertEqual(['192.0.2.1'], self.addresses(response))
+        self.assertEqual(2, self.resolver.referrals)
+        self.assertEqual(2, len(self.resolver.delegations))
+
+    @defer.inlineCallbacks
+    def test_start_at_closest_zone(self):
+        yield self.resolver.resolve('www.example.com.')
+        root_queries = self.servers['127.0.0.2'].queries
+        com_queries = self.servers['127.0.0.3'].queries
+
+        response = yield self.resolver.resolve('ns1.example.com.')
+        self.assertEqual(['127.0.0.4'], self.addresses(response))
+        self.assertEqual(root_queries, self.servers['127.0.0.2'].queries)
+        self.assertEqual(com_queries, self.servers['127.0.0.3'].queries)
+
+    @defer.inlineCallbacks
+    def test_nxdomain(self):
+        response = yield self.resolver.resolve('missing.example.com.')
+        self.assertEqual(dns.rcode.NXDOMAIN, response.rcode())
+        self.assertEqual(dns.rdatatype.SOA, response.authority[0].rdtype)
+
+    @defer.inlineCallbacks
+    def test_cname_in_zone(self):
+        response = yield self.resolver.resolve('alias.example.com.')
+        self.assertEqual([dns.rdatatype.CNAME, dns.rdatatype.A], [rrset.rdtype for rrset in response.answer])
+        self.assertEqual(['192.0.2.1'], self.addresses(response))
+
+    @defer.inlineCallbacks
+    def test_cname_to_glueless_zone(self):
+        response = yield self.resolver.resolve('other.example.com.')
+        self.assertEqual([dns.rdatatype.CNAME, dns.rdatatype.A], [rrset.rdtype for rrset in response.answer])
+        self.assertEqual(['192.0.2.2'], self.addresses(response))
+        self.assertEqual(dns.name.from_text('example.net.'),
+                         self.resolver.delegations.closest(dns.name.from_text('www.example.net.'))[0])
+
+    @defer.inlineCallbacks
+    def test_dead_server(self):
+        self.resolver.roots = ['127.0.0.9', '127.0.0.2']
+        self.resolver.parallel = 1
+        response = yield self.resolver.resolve('www.example.net.')
+        self.assertEqual(['192.0.2.2'], self.addresses(response))
+
+    def test_no_servers(self):
+        self.resolver.roots = ['127.0.0.9']
+        return self.assertFailure(self.resolver.resolve('www.example.com.'),
+                                  txdnspython.iterative.ResolutionFailed)
+
+    @defer.inlineCallbacks
+    def test_idle_clients_closed(self):
+        closed = []
+        created = []
+
+        def client_factory(reactor, address, port):
+            client = txdnspython.fallback.FallbackDnsClient(reactor, address, port)
+            client.close = lambda close = client.close: (closed.append(address), close())
+            created.append(address)
+            return client
+
+        self.resolver.client_factory = client_factory
+        self.resolver.max_clients = 1
+        self.resolver.parallel = 1
+        response = yield self.resolver.resolve('www.example.com.')
+        self.assertEqual(['192.0.2.1'], self.addresses(response))
+        self.assertEqual(['127.0.0.4'], list(self.resolver.clients))
+        self.assertEqual(sorted(created[:-1]), sorted(closed))
+        self.assertEqual({}, dict(self.resolver.in_flight))
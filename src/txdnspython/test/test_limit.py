@@ -0,0 +1,209 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import task
+
+import txdnspython.limit
+import txdnspython.timer
+import txdnspython.udp
+
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.exception
+import dns.message
+
+class LimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+
+    def dispatch(self, query, query_response, timeout, decode):
+        self.sent.append((query, query_response, timeout))
+
+    def submit(self, limiter, count, timeout = None):
+        results = []
+        for i in range(count):
+            query_response = defer.Deferred()
+            query_response.addErrback(lambda reason: reason.trap(txdnspython.limit.QueueFull,
+                                                                 dns.exception.Timeout).__name__)
+            query_response.addBoth(results.append)
+            limiter.submit(self.dispatch, i, query_response, timeout, 'message')
+
+        return results
+
+    def test_unlimited(self):
+        limiter = txdnspython.limit.Limiter(self.clock)
+        self.submit(limiter, 5)
+        self.assertEqual(5, len(self.sent))
+        self.assertEqual(5, limiter.in_flight)
+
+    def test_rate(self):
+        limiter = txdnspython.limit.Limiter(self.clock, rate = 10, burst = 2)
+        self.submit(limiter, 5)
+        self.assertEqual(2, len(self.sent))
+        self.assertEqual(3, len(limiter))
+
+        self.clock.advance(0.1)
+        self.assertEqual(3, len(self.sent))
+        self.clock.advance(0.2)
+        self.assertEqual(5, len(self.sent))
+        self.assertEqual([0, 1, 2, 3, 4], [query for query, query_response, timeout in self.sent])
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_max_in_flight(self):
+        limiter = txdnspython.limit.Limiter(self.clock, max_in_flight = 2)
+        results = self.submit(limiter, 3)
+        self.assertEqual(2, len(self.sent))
+        self.sent[0][1].callback('answer')
+        self.assertEqual(3, len(self.sent))
+        self.assertEqual(['answer'], results)
+        self.assertEqual(2, limiter.in_flight)
+
+    def test_queued_timeout(self):
+        limiter = txdnspython.limit.Limiter(self.clock, max_in_flight = 1)
+        results = self.submit(limiter, 3, timeout = 5.0)
+        self.clock.advance(2.0)
+        self.sent[0][1].callback('answer')
+        self.assertEqual(3.0, self.sent[1][2])
+
+        self.clock.advance(3.0)
+        self.assertEqual(['answer', 'Timeout'], results)
+        self.assertEqual(0, len(limiter))
+
+    def test_reject(self):
+        limiter = txdnspython.limit.Limiter(self.clock, max_in_flight = 1, overflow = txdnspython.limit.REJECT)
+        self.assertFalse(limiter.full())
+        results = self.submit(limiter, 2)
+        self.assertTrue(limiter.full())
+        self.assertEqual(['QueueFull'], results)
+        self.assertEqual(1, limiter.rejected)
+
+    def test_wait_full(self):
+        limiter = txdnspython.limit.Limiter(self.clock, max_in_flight = 1, max_queued = 2)
+        results = self.submit(limiter, 4)
+        self.assertTrue(limiter.full())
+        self.assertEqual(['QueueFull'], results)
+        self.assertEqual([1, 2], [entry[1] for entry in limiter.queued.values()])
+
+    def test_drop_oldest(self):
+        limiter = txdnspython.limit.Limiter(self.clock, max_in_flight = 1, max_queued = 2,
+                                            overflow = txdnspython.limit.DROP_OLDEST)
+        results = self.submit(limiter, 4, timeout = 5.0)
+        self.assertEqual(['QueueFull'], results)
+        self.assertEqual(1, limiter.dropped)
+        self.assertEqual([2, 3], [entry[1] for entry in limiter.queued.values()])
+        self.assertEqual(2, len(self.clock.getDelayedCalls()))
+
+    def test_failing_dispatch(self):
+        def dispatch(query, query_response, timeout, decode):
+            query_response.errback(error.ConnectionDone())
+
+        limiter = txdnspython.limit.Limiter(self.clock, max_in_flight = 1, max_queued = 2000)
+        results = []
+        for i in range(2000):
+            query_response = defer.Deferred()
+            query_response.addErrback(results.append)
+            limiter.submit(self.dispatch if i == 0 else dispatch, i, query_response, None, 'message')
+
+        self.assertEqual(1999, len(limiter))
+        self.sent[0][1].errback(error.ConnectionDone())
+        self.assertEqual(2000, len(results))
+        self.assertEqual(0, limiter.in_flight)
+
+class LimitedClientTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+        self.limiter = txdnspython.limit.Limiter(self.clock, max_in_flight = 1)
+        self.client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', limit = self.limiter)
+        self.written = self.client.protocol.transport.written
+
+    def test_held_back(self):
+        first = self.client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        second = self.client.send_query(dns.message.make_query('www.google.com.', 'AAAA'))
+        self.assertEqual(1, len(self.written))
+        self.assertEqual(1, len(self.limiter))
+
+        packet, address = self.written[0]
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        self.client.protocol.datagramReceived(response.to_wire(), address)
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+        self.assertEqual(2, len(self.written))
+
+    def test_close(self):
+        self.client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        queued = self.client.send_query(dns.message.make_query('www.google.com.', 'AAAA'))
+        self.client.close()
+        self.assertEqual(0, len(self.limiter))
+        self.failureResultOf(queued, error.ConnectionDone)
+
+    def test_callbacks_held_back(self):
+        results = []
+        for rdtype in ('A', 'AAAA'):
+            self.client.send_query_callbacks(dns.message.make_query('www.google.com.', rdtype), results.append,
+                                             results.append)
+        self.assertEqual(1, len(self.written))
+
+        packet, address = self.written[0]
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        self.client.protocol.datagramReceived(response.to_wire(), address)
+        self.assertEqual(1, len(results))
+        self.assertEqual(1, self.limiter.in_flight)
+        self.assertEqual(2, len(self.written))
+
+    def answer(self, index):
+        packet, address = self.written[index]
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        self.client.protocol.datagramReceived(response.to_wire(), address)
+
+    def test_slot_freed_when_callback_waits(self):
+        self.client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        second = self.client.send_query(dns.message.make_query('www.google.com.', 'AAAA'))
+        second.addCallback(lambda response: defer.Deferred())
+        self.client.send_query(dns.message.make_query('www.google.com.', 'MX'))
+
+        self.answer(0)
+        self.answer(1)
+        self.assertEqual(1, self.limiter.in_flight)
+        self.assertEqual(0, len(self.limiter))
+        self.assertEqual(3, len(self.written))
+
+    def test_queued_on_client_timer(self):
+        wheel = txdnspython.timer.TimerWheel(self.clock)
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', limit = self.limiter, timer = wheel)
+        results = []
+        for rdtype in ('A', 'AAAA', 'MX', 'TXT'):
+            query_response = client.send_query(dns.message.make_query('www.google.com.', rdtype), 5.0)
+            query_response.addErrback(lambda reason: results.append(reason.trap(dns.exception.Timeout)))
+
+        # the queued queries' timeouts are on the wheel, which has one
+        # call scheduled with the reactor
+        self.assertEqual(3, len(self.limiter))
+        self.assertEqual(4, len(wheel))
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+
+        self.clock.pump([wheel.resolution] * 52)
+        self.assertEqual(4, len(results))
+        self.assertEqual(0, len(self.limiter))
@@ -0,0 +1,160 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+
+import txdnspython.multi
+
+from txdnspython.test.test_fallback import MyFakeReactor
+
+import dns.exception
+import dns.message
+
+class MultiServerTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = MyFakeReactor()
+
+    def make_client(self, **kwargs):
+        client = txdnspython.multi.MultiServerDnsClient(self.reactor, ['127.0.0.1', ('127.0.0.2', 5353)], **kwargs)
+        self.first, self.second = [server.client.protocol for server in client.servers]
+        return client
+
+    def answer(self, proto):
+        packet, address = proto.transport.written.pop(0)
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        proto.datagramReceived(response.to_wire(), address)
+
+    def query(self, client, timeout = None):
+        return client.send_query(dns.message.make_query('www.google.com.', 'A'), timeout)
+
+    def test_servers(self):
+        client = self.make_client()
+        self.assertEqual(('127.0.0.1', 53), (self.first.address, self.first.port))
+        self.assertEqual(('127.0.0.2', 5353), (self.second.address, self.second.port))
+
+    def test_no_servers(self):
+        self.assertRaises(ValueError, txdnspython.multi.MultiServerDnsClient, self.reactor, [])
+
+    def test_fastest_server_preferred(self):
+        client = self.make_client()
+        self.query(client)
+        self.reactor.advance(0.1)
+        self.answer(self.first)
+        self.query(client)
+        self.reactor.advance(0.01)
+        self.answer(self.second)
+        self.assertAlmostEqual(0.1, client.servers[0].srtt)
+        self.assertAlmostEqual(0.01, client.servers[1].srtt)
+
+        for i in range(5):
+            self.query(client)
+        self.assertEqual(0, len(self.first.transport.written))
+        self.assertEqual(5, len(self.second.transport.written))
+
+    def test_hedge(self):
+        client = self.make_client(hedge = 0.9, min_samples = 2)
+        self.query(client)
+        self.reactor.advance(0.05)
+        self.answer(self.first)
+        for i in range(2):
+            self.query(client)
+            self.reactor.advance(0.01)
+            self.answer(self.second)
+
+        query_response = self.query(client)
+        self.assertEqual(1, len(self.second.transport.written))
+        self.reactor.advance(0.005)
+        self.assertEqual(0, len(self.first.transport.written))
+        self.reactor.advance(0.005)
+        self.assertEqual(1, client.hedged)
+        self.assertEqual(1, len(self.first.transport.written))
+
+        self.answer(self.first)
+        self.assertTrue(query_response.called)
+        self.assertEqual(1, client.hedges_won)
+        self.answer(self.second)
+        self.assertEqual(3, client.servers[1].responses)
+
+    def test_no_hedge_without_samples(self):
+        client = self.make_client(hedge = 0.9)
+        self.query(client)
+        self.reactor.advance(10)
+        self.assertEqual(0, client.hedged)
+
+    def test_failover_on_error(self):
+        client = self.make_client(hedge = 0.9, min_samples = 1)
+        self.query(client)
+        self.reactor.advance(0.01)
+        self.answer(self.first)
+        self.query(client)
+        self.reactor.advance(0.1)
+        self.answer(self.second)
+
+        query_response = self.query(client)
+        packet, address = self.first.transport.written.pop(0)
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        self.first.datagramReceived(response.to_wire()[:14], address)
+        self.assertEqual(1, client.servers[0].errors)
+        self.assertEqual(1, len(self.second.transport.written))
+        self.answer(self.second)
+        self.assertTrue(query_response.called)
+
+    def test_demote_and_probe(self):
+        client = self.make_client(failure_threshold = 0.2, probe_interval = 5.0)
+        server = client.servers[0]
+        self.query(client)
+        self.reactor.advance(0.01)
+        self.answer(self.first)
+        self.query(client)
+        self.reactor.advance(0.1)
+        self.answer(self.second)
+
+        for i in range(2):
+            query_response = self.query(client, 1.0)
+            self.reactor.advance(1.0)
+            self.assertFailure(query_response, dns.exception.Timeout)
+        self.assertNotEqual(None, server.demoted_until)
+
+        self.first.transport.written = []
+        self.query(client)
+        self.assertEqual(0, len(self.first.transport.written))
+
+        self.reactor.advance(5.0)
+        self.query(client)
+        self.assertEqual(1, client.probes)
+        self.assertEqual(1, len(self.first.transport.written))
+        self.answer(self.first)
+        self.assertEqual(None, server.demoted_until)
+        self.assertEqual(0.0, server.failures)
+
+    def test_failed_probe_backs_off(self):
+        client = self.make_client(failure_threshold = 0.1, probe_interval = 5.0)
+        server = client.servers[0]
+        self.first.transport.written = []
+        self.assertFailure(self.query(client, 1.0), dns.exception.Timeout)
+        self.reactor.advance(1.0)
+        self.assertEqual(6.0, server.demoted_until)
+
+        self.reactor.advance(5.0)
+        self.assertFailure(self.query(client, 1.0), dns.exception.Timeout)
+        self.reactor.advance(1.0)
+        self.assertEqual(1, client.probes)
+        self.assertEqual(17.0, server.demoted_until)
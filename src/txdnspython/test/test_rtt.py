@@ -0,0 +1,52 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+from twisted.trial import unittest
+
+import txdnspython.rtt
+
+class RoundTripTimeTest(unittest.TestCase):
+    def test_samples(self):
+        rtt = txdnspython.rtt.RoundTripTime(initial_rto = 1.0, min_rto = 0.2, max_rto = 4.0)
+        rtt.sample(0.1)
+        self.assertAlmostEqual(0.1, rtt.srtt)
+        self.assertAlmostEqual(0.05, rtt.rttvar)
+        self.assertAlmostEqual(0.3, rtt.rto)
+
+        rtt.sample(0.02)
+        self.assertAlmostEqual(0.09, rtt.srtt)
+        self.assertAlmostEqual(0.0575, rtt.rttvar)
+        self.assertAlmostEqual(0.32, rtt.rto)
+
+        # never below the minimum
+        for i in range(50):
+            rtt.sample(0.001)
+        self.assertEqual(0.2, rtt.rto)
+
+    def test_back_off(self):
+        rtt = txdnspython.rtt.RoundTripTime(initial_rto = 1.0, max_rto = 4.0)
+        rtt.back_off()
+        self.assertEqual(2.0, rtt.rto)
+        rtt.back_off()
+        rtt.back_off()
+        self.assertEqual(4.0, rtt.rto)
+        self.assertEqual(None, rtt.srtt)
@@ -0,0 +1,155 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import struct
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
+
+import txdnspython.cache
+import txdnspython.decode
+import txdnspython.shard
+import txdnspython.testing
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.rcode
+
+class FrameReaderTest(unittest.TestCase):
+    def test_split_frames(self):
+        frames = []
+        reader = txdnspython.shard._FrameReader()
+        reader.frameReceived = lambda data, start, end: frames.append(data[start:end])
+
+        stream = b''.join(struct.pack('!I', len(payload)) + payload for payload in (b'abc', b'', b'defgh'))
+        reader.dataReceived(stream[:2])
+        reader.dataReceived(stream[2:11])
+        self.assertEqual([b'abc', b''], frames)
+        reader.dataReceived(stream[11:])
+        self.assertEqual([b'abc', b'', b'defgh'], frames)
+        self.assertEqual([], reader.chunks)
+
+    def test_byte_at_a_time(self):
+        frames = []
+        reader = txdnspython.shard._FrameReader()
+        reader.frameReceived = lambda data, start, end: frames.append((data[start - 4:start], data[start:end]))
+
+        payloads = (b'abc', b'', b'x' * 300)
+        stream = b''.join(struct.pack('!I', len(payload)) + payload for payload in payloads)
+        for i in range(len(stream)):
+            reader.dataReceived(stream[i:i + 1])
+
+        self.assertEqual([(struct.pack('!I', len(payload)), payload) for payload in payloads], frames)
+        self.assertEqual([], reader.chunks)
+        self.assertEqual(None, reader.waiting_for)
+
+class ShardedDnsClientTest(unittest.TestCase):
+    timeout = 60
+
+    def setUp(self):
+        self.server = txdnspython.testing.StandInServer(reactor, address = '192.0.2.1')
+        self.port = self.server.listen()
+        self.clients = []
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for client in self.clients:
+            yield client.close()
+
+        yield self.server.stop()
+
+    def client(self, **kwargs):
+        client = txdnspython.shard.ShardedDnsClient(reactor, '127.0.0.1', self.port, **kwargs)
+        self.clients.append(client)
+        return client
+
+    @defer.inlineCallbacks
+    def test_responses(self):
+        client = self.client(workers = 2)
+        queries = [dns.message.make_query('www{}.example.com.'.format(i), 'A') for i in range(10)]
+        responses = yield defer.gatherResults([client.send_query(query, 10.0) for query in queries])
+        for query, response in zip(queries, responses):
+            self.assertTrue(query.is_response(response))
+            self.assertEqual('192.0.2.1', response.answer[0][0].address)
+
+        self.assertEqual(10, self.server.queries)
+
+    @defer.inlineCallbacks
+    def test_raw(self):
+        client = self.client(workers = 1, decode = txdnspython.decode.RAW)
+        query = dns.message.make_query('www.example.com.', 'A')
+        wire_data = yield client.send_query(query, 10.0)
+        self.assertEqual(query.id, struct.unpack('!H', wire_data[:2])[0])
+        self.assertTrue(query.is_response(dns.message.from_wire(wire_data)))
+
+    @defer.inlineCallbacks
+    def test_handler(self):
+        client = self.client(workers = 1, handler = 'txdnspython.shard.answers')
+        rcode, answer = yield client.send_query(dns.message.make_query('www.example.com.', 'A'), 10.0)
+        self.assertEqual(dns.rcode.NOERROR, rcode)
+        self.assertEqual([('www.example.com.', 300, 1, ['192.0.2.1'])], answer)
+
+    def test_handler_with_cache_or_coalesce(self):
+        for kwargs in ({'cache': txdnspython.cache.DnsCache(reactor)}, {'coalesce': True}):
+            self.assertRaises(ValueError, txdnspython.shard.ShardedDnsClient, reactor, '127.0.0.1', self.port,
+                              workers = 1, handler = 'txdnspython.shard.answers', **kwargs)
+
+    @defer.inlineCallbacks
+    def test_handler_error(self):
+        client = self.client(workers = 1, handler = 'txdnspython.shard.WorkerError')
+        d = client.send_query(dns.message.make_query('www.example.com.', 'A'), 10.0)
+        yield self.assertFailure(d, txdnspython.shard.WorkerError)
+
+    @defer.inlineCallbacks
+    def test_timeout(self):
+        self.server.loss = 1.0
+        client = self.client(workers = 1)
+        d = client.send_query(dns.message.make_query('www.example.com.', 'A'), 0.5)
+        yield self.assertFailure(d, dns.exception.Timeout)
+
+    @defer.inlineCallbacks
+    def test_restart(self):
+        self.server.loss = 1.0
+        client = self.client(workers = 1)
+        d = client.send_query(dns.message.make_query('www.example.com.', 'A'), 30.0)
+        worker = client.workers[0]
+        worker.transport.signalProcess('KILL')
+        yield self.assertFailure(d, txdnspython.shard.WorkerError)
+        self.assertEqual([], client.workers)
+
+        # a worker that exits soon after it started is started again
+        # after a short wait
+        yield task.deferLater(reactor, client.min_restart_delay * 2, lambda: None)
+        self.assertEqual(1, client.restarts)
+        self.assertNotIdentical(worker, client.workers[0])
+
+        self.server.loss = 0.0
+        response = yield client.send_query(dns.message.make_query('www.example.com.', 'A'), 10.0)
+        self.assertEqual('192.0.2.1', response.answer[0][0].address)
+
+    def test_tsig_refused(self):
+        client = self.client(workers = 1)
+        query = dns.message.make_query('www.example.com.', 'A')
+        query.use_tsig({dns.name.from_text('key.'): b'secret'}, dns.name.from_text('key.'))
+        return self.assertFailure(client.send_query(query), ValueError)
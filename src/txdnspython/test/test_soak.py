@@ -0,0 +1,87 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+import txdnspython.generic
+import txdnspython.soak
+import txdnspython.udp
+
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.message
+
+class SlowClient(txdnspython.generic.GenericDnsClient):
+    """Answers every query after half a second.  A leaky one never forgets a query."""
+
+    def __init__(self, reactor, leak = False):
+        txdnspython.generic.GenericDnsClient.__init__(self, reactor)
+        self.leak = leak
+        self.closed = False
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        if self.leak:
+            self.in_flight[len(self.in_flight)] = query
+
+        self.reactor.callLater(0.5, query_response.callback, dns.message.make_response(query))
+
+    def close(self):
+        self.closed = True
+
+class SoakTest(unittest.TestCase):
+    def test_grows(self):
+        self.assertFalse(txdnspython.soak.grows([100, 5, 7, 6, 8, 7, 6, 8, 7]))
+        self.assertTrue(txdnspython.soak.grows([1, 2, 3, 4, 5, 6, 7, 8, 9]))
+        self.assertFalse(txdnspython.soak.grows([1, 2, 3, 4, 5, 6, 7, 8, 9], slack = 10))
+        self.assertFalse(txdnspython.soak.grows([1, 2, 3]))
+
+    def test_table_sizes(self):
+        client = txdnspython.udp.UdpDnsClient(MyFakeUdpReactor(task.Clock()), '8.8.8.8', sockets = 2, retries = 1)
+        for i in range(3):
+            client.send_query(dns.message.make_query('www.example.com.', 'A'), 5.0)
+
+        sizes = txdnspython.soak.table_sizes(client)
+        self.assertEqual(3, sizes['pending'])
+        self.assertEqual(3, sizes['retransmits'])
+        self.assertEqual(0, sizes['waiting'])
+        self.assertEqual(0, sizes['coalescing'])
+
+    def test_soak(self):
+        clock = task.Clock()
+        clients = {'good': SlowClient(clock), 'leaky': SlowClient(clock, leak = True)}
+        soak = txdnspython.soak.Soak(clock, clients, 30.0, interval = 1.0, concurrency = 5)
+        done = soak.run()
+        clock.pump([0.5] * 62)
+        self.assertIdentical(soak, self.successResultOf(done))
+
+        # one at the start, one a second and one once drained
+        self.assertEqual(32, len(soak.samples))
+        self.assertEqual(0, soak.samples[20]['good.coalescing'])
+        self.assertTrue(soak.samples[20]['leaky.coalescing'] > soak.samples[10]['leaky.coalescing'])
+        self.assertEqual(300, soak.sent['good'])
+        self.assertTrue(clients['good'].closed)
+        self.assertEqual(0, soak.drained['good.coalescing'])
+
+        problems = soak.failures(rss_slack = float('inf'))
+        self.assertEqual(2, len(problems))
+        self.assertTrue(problems[0].startswith('leaky.coalescing kept growing'))
+        self.assertTrue(problems[1].startswith('leaky.coalescing still held 300 entries'))
@@ -0,0 +1,105 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+import txdnspython.stats
+import txdnspython.udp
+
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.exception
+import dns.message
+
+class StatsTest(unittest.TestCase):
+    def test_histogram(self):
+        stats = txdnspython.stats.Stats([0.01, 0.1, 1.0])
+        for latency in (0.005, 0.01, 0.05, 0.5, 5.0):
+            stats.sent(50)
+            stats.answered(latency)
+        self.assertEqual([2, 1, 1, 1], stats.histogram)
+        self.assertEqual(0.01, stats.percentile(0.4))
+        self.assertEqual(0.1, stats.percentile(0.5))
+        self.assertEqual(float('inf'), stats.percentile(0.99))
+
+    def test_pending(self):
+        stats = txdnspython.stats.Stats()
+        for i in range(3):
+            stats.sent(50)
+        stats.timed_out()
+        stats.failed()
+        self.assertEqual(1, stats.pending)
+        self.assertEqual(3, stats.max_pending)
+
+    def test_snapshot_reset(self):
+        stats = txdnspython.stats.Stats()
+        self.assertEqual(None, stats.snapshot()['latency_p50'])
+        stats.sent(50)
+        stats.sent(50)
+        stats.answered(0.003)
+        snapshot = stats.snapshot(reset = True)
+        self.assertEqual(2, snapshot['queries'])
+        self.assertEqual(100, snapshot['bytes_sent'])
+        self.assertEqual(0.004, snapshot['latency_p50'])
+        self.assertEqual(0.003, snapshot['latency_mean'])
+        self.assertEqual(0, stats.queries)
+        self.assertEqual(1, stats.pending)
+        self.assertEqual(1, stats.max_pending)
+
+class ProtocolStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+        self.stats = txdnspython.stats.Stats()
+        self.client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', stats = self.stats)
+        self.proto = self.client.protocol
+
+    def test_answered(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        self.client.send_query(query)
+        self.clock.advance(0.02)
+        packet, address = self.proto.transport.written[0]
+        wire_data = dns.message.make_response(dns.message.from_wire(packet)).to_wire()
+        self.proto.datagramReceived(wire_data, address)
+        self.proto.datagramReceived(wire_data, address)
+
+        snapshot = self.stats.snapshot()
+        self.assertEqual(1, snapshot['queries'])
+        self.assertEqual(1, snapshot['responses'])
+        self.assertEqual(1, snapshot['unmatched'])
+        self.assertEqual(len(packet), snapshot['bytes_sent'])
+        self.assertEqual(2 * len(wire_data), snapshot['bytes_received'])
+        self.assertEqual(0.032, snapshot['latency_p99'])
+        self.assertEqual(0, snapshot['pending'])
+        self.assertEqual({}, self.proto.sent_at)
+
+    def test_timeout(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 1.0)
+        self.clock.advance(1.0)
+        self.assertEqual(1, self.stats.timeouts)
+        self.assertEqual(0, self.stats.pending)
+        return self.assertFailure(query_response, dns.exception.Timeout)
+
+    def test_disabled(self):
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8')
+        client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        self.assertEqual({}, client.protocol.sent_at)
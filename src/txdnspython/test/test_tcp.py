@@ -26,6 +26,8 @@ from twisted.test import proto_helpers
 from twisted.internet import selectreactor
 from twisted.internet import defer
 from twisted.internet import task
+from twisted.internet import error
+from twisted.python import failure
 
 import txdnspython.tcp
 
@@ -48,7 +50,8 @@ class TcpTest(unittest.TestCase):
         self.proto.send_query(query, query_response, None)
         wire_data = query.to_wire()
         wire_data = struct.pack('!H', len(wire_data)) + wire_data
-        self.assertEqual(wire_data, self.transport.value())
+        self.assertEqual(wire_data[:2], self.transport.value()[:2])
+        self.assertEqual(wire_data[4:], self.transport.value()[4:])
 
     def test_timeout(self):
         query = dns.message.make_query('www.google.com.', 'A')
@@ -56,3 +59,153 @@ class TcpTest(unittest.TestCase):
         self.proto.send_query(query, query_response, 5.0)
         self.clock.advance(5.0)
         self.assertFailure(query_response, dns.exception.Timeout)
+
+    def test_reassembly(self):
+        queries = [dns.message.make_query('www{}.google.com.'.format(i), 'A') for i in range(3)]
+        results = []
+        for query in queries:
+            query_response = defer.Deferred()
+            query_response.addCallback(results.append)
+            self.proto.send_query(query, query_response, None)
+
+        data = self.transport.value()
+        stream = b''
+        while data:
+            (length,) = struct.unpack('!H', data[:2])
+            response = dns.message.make_response(dns.message.from_wire(data[2:2 + length])).to_wire()
+            stream += struct.pack('!H', len(response)) + response
+            data = data[2 + length:]
+
+        # split the stream so that one read ends in the middle of the
+        # length prefix and the next ends in the middle of a message
+        self.proto.dataReceived(stream[:1])
+        self.proto.dataReceived(stream[1:10])
+        self.assertEqual([], results)
+        self.proto.dataReceived(stream[10:-5])
+        self.assertEqual(2, len(results))
+        self.proto.dataReceived(stream[-5:])
+        self.assertEqual(3, len(results))
+        self.assertEqual([], self.proto.chunks)
+        for query, response in zip(queries, results):
+            self.assertTrue(query.is_response(response))
+
+    def test_empty_frames(self):
+        processed = []
+        self.proto._process_response = processed.append
+        response = dns.message.make_response(dns.message.make_query('www.google.com.', 'A')).to_wire()
+        frame = struct.pack('!H', len(response)) + response
+        empty = struct.pack('!H', 0)
+
+        self.proto.dataReceived(empty + frame + empty)
+        self.assertEqual([response], processed)
+
+        # a zero length that is split across reads
+        self.proto.dataReceived(empty[:1])
+        self.proto.dataReceived(empty[1:] + frame)
+        self.assertEqual([response, response], processed)
+        self.assertEqual([], self.proto.chunks)
+
+    def test_short_message(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        query_response = defer.Deferred()
+        self.proto.send_query(query, query_response, None)
+        data = self.transport.value()
+        response = dns.message.make_response(dns.message.from_wire(data[2:])).to_wire()
+
+        self.proto.dataReceived(struct.pack('!H', 4) + response[:4])
+        self.assertFalse(query_response.called)
+        self.assertFalse(self.transport.disconnecting)
+
+        self.proto.dataReceived(struct.pack('!H', len(response)) + response)
+        self.assertTrue(query.is_response(self.successResultOf(query_response)))
+
+    def test_connection_lost(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        query_response = defer.Deferred()
+        self.proto.send_query(query, query_response, 5.0)
+        self.proto.connectionLost(failure.Failure(error.ConnectionLost()))
+        self.assertEqual({}, self.proto.pending)
+        self.assertEqual(65536, len(self.proto.ids))
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertFailure(query_response, error.ConnectionLost)
+
+class TcpPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = proto_helpers.MemoryReactorClock()
+
+    def connect(self, index):
+        host, port, factory, timeout, bindAddress = self.reactor.tcpClients[index]
+        proto = factory.buildProtocol((host, port))
+        proto.makeConnection(proto_helpers.StringTransport())
+        return proto
+
+    def answer(self, proto):
+        data = proto.transport.value()
+        proto.transport.clear()
+        while data:
+            (length,) = struct.unpack('!H', data[:2])
+            response = dns.message.make_response(dns.message.from_wire(data[2:2 + length]))
+            wire_data = response.to_wire()
+            proto.dataReceived(struct.pack('!H', len(wire_data)) + wire_data)
+            data = data[2 + length:]
+
+    def test_close_before_connected(self):
+        client = txdnspython.tcp.TcpDnsClient(self.reactor, '127.0.0.1')
+        query_response = client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        client.close()
+        self.assertFailure(query_response, error.ConnectionDone)
+
+    def test_queued_until_connected(self):
+        client = txdnspython.tcp.TcpDnsClient(self.reactor, '127.0.0.1')
+        query_response = client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        proto = self.connect(0)
+        self.assertEqual(1, len(proto.pending))
+        self.answer(proto)
+        self.assertTrue(query_response.called)
+
+    def test_max_in_flight(self):
+        client = txdnspython.tcp.TcpDnsClient(self.reactor, '127.0.0.1', connections = 2, max_in_flight = 2)
+        first = self.connect(0)
+        for i in range(5):
+            client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        self.assertEqual(2, len(first.pending))
+        self.assertEqual(3, len(client.queued))
+        self.assertEqual(2, len(self.reactor.tcpClients))
+
+        second = self.connect(1)
+        self.assertEqual(2, len(second.pending))
+        self.assertEqual(1, len(client.queued))
+
+        self.answer(first)
+        self.assertEqual(1, len(first.pending))
+        self.assertEqual(0, len(client.queued))
+
+    def test_reconnect(self):
+        client = txdnspython.tcp.TcpDnsClient(self.reactor, '127.0.0.1', max_in_flight = 1)
+        first = self.connect(0)
+        in_flight = client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        queued = client.send_query(dns.message.make_query('www.google.com.', 'AAAA'), 5.0)
+        self.assertEqual(1, len(client.queued))
+
+        first.connectionLost(failure.Failure(error.ConnectionLost()))
+        self.assertFailure(in_flight, error.ConnectionLost)
+        self.assertEqual(None, client.protocol)
+        self.assertEqual(2, len(self.reactor.tcpClients))
+
+        self.reactor.advance(1.0)
+        second = self.connect(1)
+        self.assertEqual(1, len(second.pending))
+        self.answer(second)
+        self.assertTrue(queued.called)
+
+    def test_idle_timeout(self):
+        client = txdnspython.tcp.TcpDnsClient(self.reactor, '127.0.0.1', idle_timeout = 10.0)
+        proto = self.connect(0)
+        client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        self.reactor.advance(10.0)
+        self.assertFalse(proto.transport.disconnecting)
+
+        self.answer(proto)
+        self.reactor.advance(10.0)
+        self.assertTrue(proto.transport.disconnecting)
+        self.assertEqual([], client.connections)
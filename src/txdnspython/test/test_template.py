@@ -0,0 +1,83 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+import txdnspython.template
+import txdnspython.udp
+
+from txdnspython.test.test_udp import MyFakeUdpReactor
+
+import dns.message
+import dns.name
+
+class QueryTemplateTest(unittest.TestCase):
+    def test_render(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        template = txdnspython.template.render(query)
+        self.assertEqual(query.to_wire(), template.to_wire())
+        self.assertTrue(template.to_wire() is template.to_wire())
+        self.assertEqual(query.question, template.question)
+
+    def test_tsig_refused(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        query.use_tsig({dns.name.from_text('key.'): b'secret'}, 'key.')
+        self.assertRaises(ValueError, txdnspython.template.render, query)
+
+    def test_send(self):
+        clock = task.Clock()
+        client = txdnspython.udp.UdpDnsClient(MyFakeUdpReactor(clock), '8.8.8.8')
+        template = txdnspython.template.render(dns.message.make_query('www.google.com.', 'A'))
+
+        results = []
+        for i in range(3):
+            client.send_query(template).addCallback(results.append)
+
+        written = [packet for packet, address in client.protocol.transport.written]
+        self.assertEqual(3, len(set(packet[:2] for packet in written)))
+        self.assertEqual(set([template.wire[2:]]), set(packet[2:] for packet in written))
+
+        for packet in written:
+            response = dns.message.make_response(dns.message.from_wire(packet))
+            client.protocol.datagramReceived(response.to_wire(), ('8.8.8.8', 53))
+
+        self.assertEqual(3, len(results))
+        for response in results:
+            self.assertTrue(template.is_response(response))
+
+class QueryTemplateCacheTest(unittest.TestCase):
+    def test_cached(self):
+        cache = txdnspython.template.QueryTemplateCache()
+        first = cache.get('www.google.com.', 'A')
+        self.assertTrue(first is cache.get('www.google.com.', 'A'))
+        self.assertFalse(first is cache.get('www.google.com.', 'AAAA'))
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_bounded(self):
+        cache = txdnspython.template.QueryTemplateCache(max_entries = 2)
+        first = cache.get('a.example.', 'A')
+        cache.get('b.example.', 'A')
+        cache.get('a.example.', 'A')
+        cache.get('c.example.', 'A')
+        self.assertEqual(2, len(cache))
+        self.assertTrue(first is cache.get('a.example.', 'A'))
+        self.assertEqual(3, cache.misses)
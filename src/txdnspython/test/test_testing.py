@@ -0,0 +1,166 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import struct
+
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+
+import txdnspython.testing
+import txdnspython.udp
+
+from txdnspython.test.test_udp import MyFakeDatagramTransport
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.zone
+
+class StandInServerTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = proto_helpers.MemoryReactorClock()
+
+    def udp(self, server):
+        proto = txdnspython.testing._StandInUdp(server)
+        proto.makeConnection(MyFakeDatagramTransport())
+        return proto
+
+    def query(self, proto, name = 'www.example.com.'):
+        query = dns.message.make_query(name, 'A')
+        proto.datagramReceived(query.to_wire(), ('127.0.0.1', 5353))
+        return query
+
+    def test_answer(self):
+        server = txdnspython.testing.StandInServer(self.reactor, address = '192.0.2.1')
+        proto = self.udp(server)
+        query = self.query(proto)
+        packet, address = proto.transport.written[0]
+        response = dns.message.from_wire(packet)
+        self.assertTrue(query.is_response(response))
+        self.assertEqual('192.0.2.1', response.answer[0][0].address)
+        self.assertEqual(('127.0.0.1', 5353), address)
+
+    def test_latency(self):
+        server = txdnspython.testing.StandInServer(self.reactor, latency = 0.5)
+        proto = self.udp(server)
+        self.query(proto)
+        self.assertEqual([], proto.transport.written)
+        self.reactor.advance(0.5)
+        self.assertEqual(1, len(proto.transport.written))
+
+    def test_loss(self):
+        server = txdnspython.testing.StandInServer(self.reactor, loss = 1.0)
+        proto = self.udp(server)
+        self.query(proto)
+        self.assertEqual([], proto.transport.written)
+        self.assertEqual(1, server.dropped)
+
+    def test_truncate(self):
+        server = txdnspython.testing.StandInServer(self.reactor, truncate = 1.0)
+        proto = self.udp(server)
+        self.query(proto)
+        response = dns.message.from_wire(proto.transport.written[0][0])
+        self.assertTrue(response.flags & dns.flags.TC)
+        self.assertEqual([], response.answer)
+
+    def test_tcp_not_truncated(self):
+        server = txdnspython.testing.StandInServer(self.reactor, loss = 1.0, truncate = 1.0)
+        proto = txdnspython.testing._StandInTcpFactory(server).buildProtocol(None)
+        proto.makeConnection(proto_helpers.StringTransport())
+        wire_data = dns.message.make_query('www.example.com.', 'A').to_wire()
+        data = struct.pack('!H', len(wire_data)) + wire_data
+        proto.dataReceived(data[:5])
+        proto.dataReceived(data[5:] + data)
+
+        value = proto.transport.value()
+        (length,) = struct.unpack('!H', value[:2])
+        response = dns.message.from_wire(value[2:2 + length])
+        self.assertFalse(response.flags & dns.flags.TC)
+        self.assertEqual(1, len(response.answer))
+        self.assertEqual(2 * (2 + length), len(value))
+
+    def test_disconnect(self):
+        server = txdnspython.testing.StandInServer(self.reactor, disconnect = 1.0)
+        proto = txdnspython.testing._StandInTcpFactory(server).buildProtocol(None)
+        proto.makeConnection(proto_helpers.StringTransport())
+        wire_data = dns.message.make_query('www.example.com.', 'A').to_wire()
+        proto.dataReceived(struct.pack('!H', len(wire_data)) + wire_data)
+        self.assertEqual(b'', proto.transport.value())
+        self.assertTrue(proto.transport.disconnecting)
+        self.assertEqual(1, server.disconnected)
+
+    def test_custom_answer(self):
+        server = txdnspython.testing.StandInServer(self.reactor, answer = lambda query: None)
+        proto = self.udp(server)
+        self.query(proto)
+        self.assertEqual([], proto.transport.written)
+        self.assertEqual(1, server.queries)
+
+    def test_listen(self):
+        from twisted.internet import reactor
+
+        server = txdnspython.testing.StandInServer(reactor, address = '192.0.2.1')
+        port = server.listen()
+        self.addCleanup(server.stop)
+        client = txdnspython.udp.UdpDnsClient(reactor, '127.0.0.1', port)
+        self.addCleanup(client.close)
+
+        query_response = client.send_query(dns.message.make_query('www.example.com.', 'A'), 5.0)
+        query_response.addCallback(lambda response: self.assertEqual('192.0.2.1', response.answer[0][0].address))
+        return query_response
+
+class ZoneAnswerTest(unittest.TestCase):
+    def setUp(self):
+        zone = dns.zone.from_text('''
+@ 3600 IN SOA ns hostmaster 1 3600 600 86400 300
+@ 3600 IN NS ns
+ns 3600 IN A 192.0.2.53
+www 300 IN A 192.0.2.1
+sub 3600 IN NS ns.sub
+ns.sub 3600 IN A 192.0.2.54
+''', 'example.', relativize = False)
+        self.answer = txdnspython.testing.ZoneAnswer(zone)
+
+    def ask(self, name, rdtype = 'A'):
+        return self.answer(dns.message.make_query(name, rdtype))
+
+    def test_answer(self):
+        response = self.ask('www.example.')
+        self.assertTrue(response.flags & dns.flags.AA)
+        self.assertEqual('192.0.2.1', response.answer[0][0].address)
+
+    def test_referral(self):
+        response = self.ask('www.sub.example.')
+        self.assertFalse(response.flags & dns.flags.AA)
+        self.assertEqual([], response.answer)
+        self.assertEqual(dns.name.from_text('sub.example.'), response.authority[0].name)
+        self.assertEqual('192.0.2.54', response.additional[0][0].address)
+
+    def test_negative(self):
+        self.assertEqual(dns.rcode.NXDOMAIN, self.ask('missing.example.').rcode())
+        response = self.ask('www.example.', 'MX')
+        self.assertEqual(dns.rcode.NOERROR, response.rcode())
+        self.assertEqual(dns.rdatatype.SOA, response.authority[0].rdtype)
+
+    def test_refused(self):
+        self.assertEqual(dns.rcode.REFUSED, self.ask('www.example.com.').rcode())
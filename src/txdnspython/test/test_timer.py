@@ -0,0 +1,88 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.internet import task
+
+import txdnspython.timer
+import txdnspython.udp
+from txdnspython.test.test_udp import MyFakeDatagramTransport
+
+import dns.exception
+import dns.message
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = txdnspython.timer.TimerWheel(self.clock, resolution = 0.5)
+
+    def test_fires_late_not_early(self):
+        called = []
+        call = self.wheel.callLater(1.2, called.append, 'a')
+        self.assertEqual(1.2, call.getTime())
+        self.clock.advance(1.2)
+        self.assertEqual([], called)
+        self.clock.advance(0.3)
+        self.assertEqual(['a'], called)
+        self.assertFalse(call.active())
+        self.assertEqual(0, len(self.wheel))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_cancel(self):
+        called = []
+        call = self.wheel.callLater(1.0, called.append, 'a')
+        self.wheel.callLater(1.0, called.append, 'b')
+        call.cancel()
+        self.assertFalse(call.active())
+        self.clock.advance(1.0)
+        self.assertEqual(['b'], called)
+
+    def test_one_reactor_call(self):
+        for i in range(1000):
+            self.wheel.callLater(i / 100.0, lambda: None)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.pump([0.5] * 21)
+        self.assertEqual(0, len(self.wheel))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_cancel_from_callback(self):
+        called = []
+        calls = []
+        def run(name, other):
+            called.append(name)
+            if calls[other].active():
+                calls[other].cancel()
+        calls.append(self.wheel.callLater(1.0, run, 'a', 1))
+        calls.append(self.wheel.callLater(1.0, run, 'b', 0))
+        self.clock.advance(1.0)
+        self.assertEqual(1, len(called))
+        self.assertEqual(0, len(self.wheel))
+
+    def test_protocol_timeout(self):
+        proto = txdnspython.udp.UdpDnsClientProtocol(self.clock, '8.8.8.8', 53, False, timer = self.wheel)
+        proto.makeConnection(MyFakeDatagramTransport())
+        query_response = defer.Deferred()
+        proto.send_query(dns.message.make_query('www.google.com.', 'A'), query_response, 5.0)
+        self.assertEqual(1, len(self.wheel))
+        self.clock.advance(5.0)
+        self.assertFailure(query_response, dns.exception.Timeout)
+        self.assertEqual({}, proto.pending)
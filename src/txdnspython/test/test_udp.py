@@ -24,13 +24,18 @@ import struct
 from twisted.trial import unittest
 from twisted.test import proto_helpers
 from twisted.internet import selectreactor
+from twisted.internet import error
 from twisted.internet import task
 from twisted.internet import defer
 
+import txdnspython.generic
+import txdnspython.stats
 import txdnspython.udp
 
 import dns.message
 import dns.exception
+import dns.name
+import dns.rcode
 
 class MyFakeDatagramTransport(object):
     def __init__(self):
@@ -51,6 +56,22 @@ class MyFakeDatagramTransport(object):
         else:
             self.written.append((packet, address))
 
+    def loseConnection(self):
+        self.connected = False
+
+class MyFakeUdpReactor(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.callLater = clock.callLater
+        self.seconds = clock.seconds
+        self.listening = []
+
+    def listenUDP(self, port, protocol, interface = ''):
+        transport = MyFakeDatagramTransport()
+        protocol.makeConnection(transport)
+        self.listening.append((port, protocol, interface))
+        return transport
+
 class UdpTest(unittest.TestCase):
     def setUp(self):
         self.reactor = selectreactor.SelectReactor()
@@ -65,7 +86,7 @@ class UdpTest(unittest.TestCase):
         query_response = defer.Deferred()
         self.proto.send_query(query, query_response, None)
         wire_data = query.to_wire()
-        self.assertEqual(wire_data, self.transport.written[0][0])
+        self.assertEqual(wire_data[2:], self.transport.written[0][0][2:])
         self.assertEqual(('8.8.8.8', 53), self.transport.written[0][1])
 
     def test_timeout(self):
@@ -74,3 +95,349 @@ class UdpTest(unittest.TestCase):
         self.proto.send_query(query, query_response, 5.0)
         self.clock.advance(5.0)
         self.assertFailure(query_response, dns.exception.Timeout)
+
+    def test_duplicate_query_ids(self):
+        first = dns.message.make_query('www.google.com.', 'A')
+        second = dns.message.make_query('www.google.com.', 'AAAA')
+        second.id = first.id
+        first_response = defer.Deferred()
+        second_response = defer.Deferred()
+        self.proto.send_query(first, first_response, None)
+        self.proto.send_query(second, second_response, None)
+        self.assertEqual(2, len(self.proto.pending))
+
+        results = []
+        first_response.addCallback(results.append)
+        second_response.addCallback(results.append)
+
+        for packet, address in reversed(self.transport.written):
+            response = dns.message.make_response(dns.message.from_wire(packet))
+            self.proto.datagramReceived(response.to_wire(), address)
+
+        self.assertEqual(2, len(results))
+        self.assertTrue(second.is_response(results[0]))
+        self.assertTrue(first.is_response(results[1]))
+        self.assertEqual(65536, len(self.proto.ids))
+
+    def test_late_response_to_reused_id(self):
+        self.reactor.seconds = self.clock.seconds
+        self.proto.stats = txdnspython.stats.Stats()
+        self.proto.ids.free = self.proto.ids.free[:1]
+        first = dns.message.make_query('www.google.com.', 'A')
+        first_response = defer.Deferred()
+        self.proto.send_query(first, first_response, 1.0)
+        self.clock.advance(1.0)
+        self.assertFailure(first_response, dns.exception.Timeout)
+
+        second = dns.message.make_query('www.example.com.', 'A')
+        second_response = defer.Deferred()
+        self.proto.send_query(second, second_response, 5.0)
+        late, address = self.transport.written[0]
+        current, address = self.transport.written[1]
+        self.assertEqual(late[:2], current[:2])
+
+        # the late answer to the first query carries the reused ID
+        late_response = dns.message.make_response(dns.message.from_wire(late))
+        late_response.id = dns.message.from_wire(current).id
+        late_response.set_rcode(dns.rcode.SERVFAIL)
+        self.proto.datagramReceived(late_response.to_wire(), address)
+        self.assertFalse(second_response.called)
+        self.assertEqual(1, len(self.proto.pending))
+        self.assertEqual(1, self.proto.stats.unmatched)
+
+        # the question is compared without regard to case
+        response = dns.message.make_response(dns.message.from_wire(current))
+        response.question[0].name = dns.name.from_text('WWW.Example.COM.')
+        self.proto.datagramReceived(response.to_wire(), address)
+        self.assertTrue(second.is_response(self.successResultOf(second_response)))
+        self.assertEqual({}, self.proto.pending)
+
+    def test_truncated_response(self):
+        self.proto.stats = txdnspython.stats.Stats()
+        query = dns.message.make_query('www.google.com.', 'A')
+        query_response = defer.Deferred()
+        self.proto.send_query(query, query_response, None)
+        packet, address = self.transport.written[0]
+        response = dns.message.make_response(dns.message.from_wire(packet)).to_wire()
+
+        for size in (0, 1, 4, 11):
+            self.proto.datagramReceived(response[:size], address)
+        self.assertFalse(query_response.called)
+        self.assertEqual(4, self.proto.stats.unmatched)
+
+        self.proto.datagramReceived(response, address)
+        self.assertTrue(query.is_response(self.successResultOf(query_response)))
+
+    def test_ids_exhausted_queue(self):
+        self.reactor.seconds = self.clock.seconds
+        self.proto.ids.free = self.proto.ids.free[:1]
+        first = dns.message.make_query('www.google.com.', 'A')
+        second = dns.message.make_query('www.google.com.', 'AAAA')
+        first_response = defer.Deferred()
+        second_response = defer.Deferred()
+        self.proto.send_query(first, first_response, None)
+        self.proto.send_query(second, second_response, 5.0)
+        self.assertEqual(1, len(self.transport.written))
+        self.assertEqual(1, len(self.proto.waiting))
+
+        packet, address = self.transport.written[0]
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        self.proto.datagramReceived(response.to_wire(), address)
+        self.assertEqual(2, len(self.transport.written))
+        self.assertEqual(0, len(self.proto.waiting))
+
+        self.clock.advance(5.0)
+        self.assertFailure(second_response, dns.exception.Timeout)
+
+    def test_ids_exhausted_fail(self):
+        self.proto.exhausted_policy = txdnspython.generic.FAIL
+        self.proto.ids.free = self.proto.ids.free[:0]
+        query = dns.message.make_query('www.google.com.', 'A')
+        query_response = defer.Deferred()
+        self.proto.send_query(query, query_response, None)
+        self.assertEqual(0, len(self.transport.written))
+        self.assertFailure(query_response, txdnspython.generic.QueryIdsExhausted)
+
+class UdpPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+
+    def test_consecutive_source_ports(self):
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', source_port = 5300, sockets = 3)
+        self.assertEqual([5300, 5301, 5302], [port for port, protocol, interface in self.reactor.listening])
+        self.assertEqual(3, len(client.protocols))
+
+    def test_random_source_ports(self):
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', sockets = 4, randomize_source_ports = True)
+        for port, protocol, interface in self.reactor.listening:
+            self.assertTrue(1024 <= port <= 65535)
+
+    def test_least_loaded(self):
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', sockets = 3)
+        for i in range(6):
+            client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        self.assertEqual([2, 2, 2], [protocol.load() for protocol in client.protocols])
+
+        protocol = client.protocols[1]
+        packet, address = protocol.transport.written[0]
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        protocol.datagramReceived(response.to_wire(), address)
+
+        client.send_query(dns.message.make_query('www.google.com.', 'A'))
+        self.assertEqual([2, 2, 2], [protocol.load() for protocol in client.protocols])
+
+class UdpCallbacksTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+        self.client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8')
+        self.responses = []
+        self.errors = []
+
+    def send(self, timeout = None):
+        query = dns.message.make_query('www.google.com.', 'A')
+        self.client.send_query_callbacks(query, self.responses.append, self.errors.append, timeout)
+        return query
+
+    def answer(self):
+        protocol = self.client.protocol
+        packet, address = protocol.transport.written.pop(0)
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        protocol.datagramReceived(response.to_wire(), address)
+
+    def test_response(self):
+        query = self.send(5.0)
+        entry = list(self.client.protocol.pending.values())[0]
+        self.assertIsInstance(entry.query_response, txdnspython.generic.QueryCallbacks)
+
+        self.answer()
+        self.assertEqual([], self.errors)
+        self.assertEqual(1, len(self.responses))
+        self.assertTrue(query.is_response(self.responses[0]))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_timeout(self):
+        self.send(5.0)
+        self.clock.advance(5.0)
+        self.assertEqual([], self.responses)
+        self.assertEqual(1, len(self.errors))
+        self.assertIsInstance(self.errors[0], dns.exception.Timeout)
+        self.assertEqual({}, self.client.protocol.pending)
+
+    def test_connection_lost(self):
+        self.send()
+        self.client.protocol.stopProtocol()
+        self.assertEqual(1, len(self.errors))
+        self.assertIsInstance(self.errors[0], error.ConnectionDone)
+
+    def test_callback_error_logged(self):
+        self.client.send_query_callbacks(dns.message.make_query('www.google.com.', 'A'), lambda response: 1 / 0,
+                                         self.errors.append)
+        self.answer()
+        self.assertEqual(1, len(self.flushLoggedErrors(ZeroDivisionError)))
+        self.assertEqual([], self.errors)
+        self.assertEqual({}, self.client.protocol.pending)
+
+class UdpSocketLostTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+        self.client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', source_port = 5353)
+
+    def test_reopen(self):
+        lost = self.client.protocol
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 10.0)
+        lost.stopProtocol()
+        self.failureResultOf(query_response, error.ConnectionDone)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+        self.assertEqual(1, len(self.client.protocols))
+        self.assertNotIdentical(lost, self.client.protocol)
+        self.assertEqual(5353, self.reactor.listening[-1][0])
+        self.assertEqual(1, self.client.reopened)
+
+    def test_not_reopened_after_close(self):
+        protocol = self.client.protocol
+        self.client.close()
+        protocol.stopProtocol()
+        self.assertEqual([], self.client.protocols)
+        self.assertEqual(1, len(self.reactor.listening))
+
+class UdpRetransmitTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+        self.client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', retries = 3, initial_rto = 1.0,
+                                                   min_rto = 0.2, max_rto = 4.0)
+        self.proto = self.client.protocol
+        self.written = self.proto.transport.written
+
+    def answer(self):
+        packet, address = self.written[-1]
+        response = dns.message.make_response(dns.message.from_wire(packet))
+        self.proto.datagramReceived(response.to_wire(), address)
+
+    def test_retransmit_same_id(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 10.0)
+        self.clock.advance(1.0)
+        self.assertEqual(2, len(self.written))
+        self.assertEqual(self.written[0], self.written[1])
+        self.assertEqual(1, len(self.proto.pending))
+        self.clock.advance(2.0)
+        self.assertEqual(3, len(self.written))
+        self.assertEqual(2, self.proto.retransmissions)
+
+        self.answer()
+        self.assertTrue(query_response.called)
+        self.assertEqual({}, self.proto.retransmits)
+        self.assertEqual(0, len(self.clock.getDelayedCalls()))
+
+    def test_retries_limited(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 30.0)
+        self.clock.pump([1.0] * 29)
+        self.assertEqual(4, len(self.written))
+        self.clock.advance(1.0)
+        return self.assertFailure(query_response, dns.exception.Timeout)
+
+    def test_within_timeout(self):
+        query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 2.5)
+        self.clock.pump([0.5] * 4)
+        self.assertEqual(2, len(self.written))
+        self.assertEqual({}, self.proto.retransmits)
+        self.clock.advance(0.5)
+        return self.assertFailure(query_response, dns.exception.Timeout)
+
+    def test_rto_from_samples(self):
+        self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 10.0)
+        self.clock.advance(0.1)
+        self.answer()
+        self.assertAlmostEqual(0.1, self.client.rtt.srtt)
+        self.assertAlmostEqual(0.3, self.client.rtt.rto)
+
+        self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 10.0)
+        self.clock.advance(0.3)
+        self.assertEqual(3, len(self.written))
+
+    def test_karn(self):
+        self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 10.0)
+        self.clock.advance(1.5)
+        self.answer()
+        self.assertEqual(None, self.client.rtt.srtt)
+        self.assertEqual(2.0, self.client.rtt.rto)
+
+    def test_shared_between_sockets(self):
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', sockets = 2, retries = 3)
+        first, second = client.protocols
+        self.assertIs(first.rtt, second.rtt)
+
+        first_response = defer.Deferred()
+        first.send_query(dns.message.make_query('www.google.com.', 'A'), first_response, 10.0)
+        self.clock.advance(0.1)
+        packet, address = first.transport.written[0]
+        first.datagramReceived(dns.message.make_response(dns.message.from_wire(packet)).to_wire(), address)
+        self.assertAlmostEqual(0.3, client.rtt.rto)
+
+        # the other socket waits as long as the sample on the first says
+        second.send_query(dns.message.make_query('www.google.com.', 'A'), defer.Deferred(), 10.0)
+        self.clock.advance(0.3)
+        self.assertEqual(2, len(second.transport.written))
+
+    def test_no_retries(self):
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8')
+        client.send_query(dns.message.make_query('www.google.com.', 'A'), 10.0)
+        self.clock.advance(5.0)
+        self.assertEqual(1, len(client.protocol.transport.written))
+        self.assertEqual({}, client.protocol.retransmits)
+
+class UdpEdnsTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = MyFakeUdpReactor(self.clock)
+        self.client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', edns_payload = 4096)
+        self.client.edns.threshold = 2
+        self.proto = self.client.protocol
+        self.written = self.proto.transport.written
+
+    def sent(self):
+        return dns.message.from_wire(self.written[-1][0])
+
+    def test_adds_edns(self):
+        query = dns.message.make_query('www.google.com.', 'A')
+        query_response = self.client.send_query(query, 10.0)
+        sent = self.sent()
+        self.assertEqual(0, sent.edns)
+        self.assertEqual(4096, sent.payload)
+        self.assertEqual(-1, query.edns)
+
+        response = dns.message.make_response(sent)
+        self.proto.datagramReceived(response.to_wire(), self.written[-1][1])
+        self.assertTrue(query.is_response(self.successResultOf(query_response)))
+        self.assertEqual({}, self.proto.advertised)
+
+    def test_keeps_edns(self):
+        self.client.send_query(dns.message.make_query('www.google.com.', 'A', use_edns = 0, payload = 1400))
+        self.assertEqual(1400, self.sent().payload)
+        self.assertEqual({self.sent().id: 1400}, self.proto.advertised)
+
+    def test_learns_from_timeouts(self):
+        for i in range(2):
+            query_response = self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 1.0)
+            self.clock.advance(1.0)
+            self.failureResultOf(query_response, dns.exception.Timeout)
+
+        self.client.send_query(dns.message.make_query('www.google.com.', 'A'), 1.0)
+        self.assertEqual(1232, self.sent().payload)
+        self.assertEqual(1, self.client.edns.step_downs)
+
+    def test_retransmit_with_smaller_payload(self):
+        client = txdnspython.udp.UdpDnsClient(self.reactor, '8.8.8.8', edns_payload = 4096, retries = 1)
+        written = client.protocol.transport.written
+        client.send_query(dns.message.make_query('www.google.com.', 'A'), 10.0)
+        client.edns.timed_out(4096)
+        client.edns.timed_out(4096)
+        client.edns.timed_out(4096)
+        self.clock.advance(1.0)
+        self.assertEqual(2, len(written))
+        self.assertEqual(1232, dns.message.from_wire(written[1][0]).payload)
+        self.assertEqual([1232], list(client.protocol.advertised.values()))
@@ -0,0 +1,174 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import struct
+
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+from twisted.internet import defer
+from twisted.internet import error
+from twisted.python import failure
+
+import txdnspython.tcp
+import txdnspython.xfr
+
+import dns.exception
+import dns.message
+import dns.rdatatype
+import dns.rrset
+
+def soa(serial):
+    return dns.rrset.from_text('example.com.', 3600, 'IN', 'SOA',
+                               'ns.example.com. admin.example.com. {} 3600 600 86400 300'.format(serial))
+
+def a(name, address):
+    return dns.rrset.from_text(name, 3600, 'IN', 'A', address)
+
+class ZoneTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = proto_helpers.MemoryReactorClock()
+        self.client = txdnspython.tcp.TcpDnsClient(self.reactor, '127.0.0.1')
+        self.received = []
+
+    def consume(self, *item):
+        self.received.append(item)
+
+    def start(self, **kwargs):
+        done = self.client.zone_transfer('example.com.', kwargs.pop('consumer', self.consume), **kwargs)
+        host, port, factory, timeout, bindAddress = self.reactor.tcpClients[-1]
+        self.proto = factory.buildProtocol((host, port))
+        self.proto.makeConnection(proto_helpers.StringTransport())
+        data = self.proto.transport.value()
+        (length,) = struct.unpack('!H', data[:2])
+        self.query = dns.message.from_wire(data[2:2 + length])
+        return done
+
+    def send(self, *rrsets):
+        response = dns.message.make_response(self.query)
+        response.answer.extend(rrsets)
+        wire_data = response.to_wire()
+        self.proto.dataReceived(struct.pack('!H', len(wire_data)) + wire_data)
+
+    def test_axfr_messages(self):
+        done = self.start()
+        self.assertEqual(dns.rdatatype.AXFR, self.query.question[0].rdtype)
+        self.send(soa(5), a('www.example.com.', '192.0.2.1'))
+        self.assertEqual(1, len(self.received))
+        self.assertFalse(done.called)
+        self.send(a('mail.example.com.', '192.0.2.2'), soa(5))
+        self.assertEqual(2, len(self.received))
+
+        results = []
+        done.addCallback(results.append)
+        transfer = results[0]
+        self.assertEqual(2, transfer.messages)
+        self.assertEqual(4, transfer.rrsets)
+        self.assertEqual(5, transfer.soa[0].serial)
+        self.assertTrue(self.proto.transport.disconnecting)
+
+    def test_axfr_rrsets(self):
+        done = self.start(deliver = txdnspython.xfr.RRSETS)
+        self.send(soa(5), a('www.example.com.', '192.0.2.1'), soa(5))
+        self.assertEqual([(soa(5), False), (a('www.example.com.', '192.0.2.1'), False), (soa(5), False)],
+                         self.received)
+        self.assertTrue(done.called)
+
+    def test_ixfr(self):
+        done = self.start(rdtype = 'IXFR', serial = 1, deliver = txdnspython.xfr.RRSETS)
+        self.assertEqual(1, self.query.authority[0][0].serial)
+        self.send(soa(3),
+                  soa(1), a('old.example.com.', '192.0.2.1'), soa(2), a('new.example.com.', '192.0.2.2'),
+                  soa(2), soa(3), a('newer.example.com.', '192.0.2.3'))
+        self.assertFalse(done.called)
+        self.send(soa(3))
+
+        self.assertEqual([False, True, True, False, False, True, False, False, False],
+                         [deleting for rrset, deleting in self.received])
+        results = []
+        done.addCallback(results.append)
+        self.assertTrue(results[0].incremental)
+
+    def test_ixfr_answered_with_axfr(self):
+        done = self.start(rdtype = 'IXFR', serial = 1, deliver = txdnspython.xfr.RRSETS)
+        self.send(soa(3), a('www.example.com.', '192.0.2.1'), soa(3))
+        self.assertEqual([False, False, False], [deleting for rrset, deleting in self.received])
+        results = []
+        done.addCallback(results.append)
+        self.assertFalse(results[0].incremental)
+
+    def test_ixfr_up_to_date(self):
+        done = self.start(rdtype = 'IXFR', serial = 3)
+        self.send(soa(3))
+        results = []
+        done.addCallback(results.append)
+        self.assertTrue(results[0].up_to_date)
+
+    def test_backpressure(self):
+        waiting = []
+
+        def consumer(message):
+            waiting.append(defer.Deferred())
+            return waiting[-1]
+
+        done = self.start(consumer = consumer)
+        self.send(soa(5), a('www.example.com.', '192.0.2.1'))
+        self.send(a('mail.example.com.', '192.0.2.2'))
+        self.send(soa(5))
+        self.assertEqual(1, len(waiting))
+        self.assertEqual('paused', self.proto.transport.producerState)
+        self.assertEqual(2, len(self.proto.backlog))
+
+        waiting[0].callback(None)
+        self.assertEqual(2, len(waiting))
+        waiting[1].callback(None)
+        waiting[2].callback(None)
+        self.assertEqual('producing', self.proto.transport.producerState)
+        self.assertTrue(done.called)
+
+    def test_consumer_fails(self):
+        def consumer(message):
+            raise RuntimeError('full')
+
+        done = self.start(consumer = consumer)
+        self.send(soa(5))
+        self.assertTrue(self.proto.transport.disconnecting)
+        return self.assertFailure(done, RuntimeError)
+
+    def test_bad_start(self):
+        done = self.start()
+        self.send(a('www.example.com.', '192.0.2.1'))
+        return self.assertFailure(done, dns.exception.FormError)
+
+    def test_timeout(self):
+        done = self.start(timeout = 5.0)
+        self.send(soa(5))
+        self.reactor.advance(4.0)
+        self.send(a('www.example.com.', '192.0.2.1'))
+        self.reactor.advance(4.0)
+        self.assertFalse(done.called)
+        self.reactor.advance(1.0)
+        return self.assertFailure(done, dns.exception.Timeout)
+
+    def test_connection_closed_early(self):
+        done = self.start()
+        self.send(soa(5))
+        self.proto.connectionLost(failure.Failure(error.ConnectionDone()))
+        return self.assertFailure(done, dns.exception.FormError)
@@ -0,0 +1,365 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import random
+import struct
+
+from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.protocol import Factory
+from twisted.internet.protocol import Protocol
+from twisted.python import log
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+class StandInServer(object):
+    """
+    A DNS server that answers every query itself, over UDP and TCP on
+    the same port, after a configurable delay.  UDP responses can be
+    dropped or truncated at random to see how clients cope with a
+    lossy network and with falling back to TCP, and TCP connections
+    can be closed at random instead of answering a query on them.
+
+    By default A queries are answered with C{address} and every other
+    query gets an empty NOERROR response; pass C{answer} to answer
+    differently.
+    """
+
+    def __init__(self, reactor, latency = 0.0, loss = 0.0, truncate = 0.0, answer = None,
+                 address = '127.0.0.1', ttl = 300, seed = None, disconnect = 0.0):
+        """
+        Initialize.
+
+        @param reactor: the reactor to listen with and to delay
+        responses with
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorUDP},
+        L{twisted.internet.interfaces.IReactorTCP} and
+        L{twisted.internet.interfaces.IReactorTime}
+        @param latency: seconds to wait before each response is sent,
+        or a callable that returns the wait for each response
+        @type latency: C{float} or callable
+        @param loss: the fraction of UDP queries that are not answered
+        @type loss: C{float}
+        @param truncate: the fraction of UDP responses that are sent
+        with the TC flag set and no records
+        @type truncate: C{float}
+        @param answer: called with each query to build its response,
+        or C{None} to answer from C{address}.  It may return C{None}
+        to leave the query unanswered, or the wire data of a response,
+        which is sent with the ID of the query written into it and is
+        never truncated.
+        @type answer: callable
+        @param address: the address A queries are answered with
+        @type address: C{str}
+        @param ttl: the TTL of the default answers
+        @type ttl: C{int}
+        @param seed: seed for the random choice of queries to drop,
+        truncate and disconnect on, so that runs can be repeated
+        @type seed: hashable
+        @param disconnect: the fraction of TCP queries that are
+        answered by closing the connection they came over
+        @type disconnect: C{float}
+        """
+
+        self.reactor = reactor
+        self.latency = latency
+        self.loss = loss
+        self.truncate = truncate
+        self.disconnect = disconnect
+        self.address = address
+        self.ttl = ttl
+        self.random = random.Random(seed)
+
+        if answer is not None:
+            self.answer = answer
+
+        self.udp_port = None
+        self.tcp_port = None
+
+        self.queries = 0
+        """Number of queries received"""
+
+        self.dropped = 0
+        """Number of UDP queries that were not answered on purpose"""
+
+        self.truncated = 0
+        """Number of UDP responses that were truncated on purpose"""
+
+        self.disconnected = 0
+        """Number of TCP connections that were closed on purpose"""
+
+    def listen(self, port = 0, interface = '127.0.0.1', attempts = 16):
+        """
+        Start listening for UDP and TCP queries on the same port.
+
+        @param port: the port to listen on, or 0 to pick a free one
+        @type port: C{int}
+        @param interface: the address to listen on
+        @type interface: C{str}
+        @return: the port that is being listened on
+        @rtype: C{int}
+        """
+
+        for attempt in range(attempts):
+            self.udp_port = self.reactor.listenUDP(port, _StandInUdp(self), interface = interface)
+            chosen = self.udp_port.getHost().port
+
+            try:
+                self.tcp_port = self.reactor.listenTCP(chosen, _StandInTcpFactory(self), interface = interface)
+
+            except error.CannotListenError:
+                self.udp_port.stopListening()
+                if port or attempt == attempts - 1:
+                    raise
+
+            else:
+                return chosen
+
+    def stop(self):
+        """
+        Stop listening.
+
+        @return: a L{twisted.internet.defer.Deferred} that fires when
+        both ports have been closed
+        """
+
+        stopping = []
+        for port in (self.udp_port, self.tcp_port):
+            if port is not None:
+                stopping.append(defer.maybeDeferred(port.stopListening))
+
+        self.udp_port = self.tcp_port = None
+        return defer.gatherResults(stopping)
+
+    def answer(self, query):
+        """
+        Build the response to a query.
+
+        @param query: the query
+        @type query: L{dns.message.Message}
+        @rtype: L{dns.message.Message}
+        """
+
+        response = dns.message.make_response(query)
+
+        for question in query.question:
+            if question.rdtype == dns.rdatatype.A and question.rdclass == dns.rdataclass.IN:
+                response.answer.append(dns.rrset.from_text(question.name, self.ttl, 'IN', 'A', self.address))
+
+        return response
+
+    def respond(self, wire_data, over_tcp):
+        """
+        Work out the wire data to answer a query with.
+
+        @param wire_data: the query as it was received
+        @type wire_data: C{str}
+        @param over_tcp: whether the query came over TCP, in which case
+        it is never dropped or truncated
+        @type over_tcp: C{bool}
+        @return: the response or C{None} to send nothing
+        @rtype: C{str}
+        """
+
+        self.queries += 1
+
+        try:
+            query = dns.message.from_wire(wire_data)
+
+        except Exception:
+            log.err(None, 'Stand-in server received a malformed query')
+            return None
+
+        if not over_tcp and self.loss and self.random.random() < self.loss:
+            self.dropped += 1
+            return None
+
+        response = self.answer(query)
+        if response is None:
+            return None
+
+        if isinstance(response, bytes):
+            return wire_data[:2] + response[2:]
+
+        if not over_tcp and self.truncate and self.random.random() < self.truncate:
+            self.truncated += 1
+            response.flags |= dns.flags.TC
+            del response.answer[:]
+            del response.authority[:]
+            del response.additional[:]
+
+        return response.to_wire()
+
+    def hang_up(self):
+        """
+        Decide whether to close a TCP connection instead of answering
+        the query that came over it.
+
+        @rtype: C{bool}
+        """
+
+        if self.disconnect and self.random.random() < self.disconnect:
+            self.disconnected += 1
+            return True
+
+        return False
+
+    def delay(self):
+        """
+        @return: the number of seconds to wait before sending the next
+        response
+        @rtype: C{float}
+        """
+
+        if callable(self.latency):
+            return self.latency()
+
+        return self.latency
+
+    def send(self, write, wire_data):
+        """Write a response once the latency has passed."""
+
+        delay = self.delay()
+        if delay > 0:
+            self.reactor.callLater(delay, write, wire_data)
+
+        else:
+            write(wire_data)
+
+class ZoneAnswer(object):
+    """
+    An C{answer} for L{StandInServer} that serves zones the way an
+    authoritative server does, so that a hierarchy of stand-in
+    servers can be set up to resolve from, for example a root server
+    that delegates C{example.} to a server for that zone.
+
+    Names below a delegation (an NS RRset below the origin of a zone)
+    get a referral with the glue that the zone holds for the name
+    servers.  Other names are answered with the AA flag set: with the
+    RRset asked for, with a CNAME RRset if the name has one, or with
+    no answers and the zone's SOA record if the name does not exist
+    (NXDOMAIN) or has no records of the type asked for.  Names that
+    are not in any of the zones are refused.
+    """
+
+    def __init__(self, *zones):
+        """
+        @param zones: the zones to serve, loaded with C{relativize =
+        False}
+        @type zones: L{dns.zone.Zone}
+        """
+
+        self.zones = sorted(zones, key = lambda zone: len(zone.origin), reverse = True)
+
+    def __call__(self, query):
+        response = dns.message.make_response(query)
+        response.flags &= ~dns.flags.RA
+
+        question = query.question[0]
+        qname = question.name
+
+        for zone in self.zones:
+            if qname.is_subdomain(zone.origin):
+                break
+
+        else:
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+
+        # the delegation nearest to the zone's origin wins, as the
+        # records below it belong to the child zone
+        for depth in range(len(zone.origin) + 1, len(qname) + 1):
+            name = qname.split(depth)[1]
+            ns = zone.get_rrset(name, dns.rdatatype.NS)
+            if ns is not None:
+                response.authority.append(ns)
+                for rdata in ns:
+                    for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                        glue = zone.get_rrset(rdata.target, rdtype)
+                        if glue is not None:
+                            response.additional.append(glue)
+
+                return response
+
+        response.flags |= dns.flags.AA
+
+        if zone.get_node(qname) is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+
+        else:
+            rrset = zone.get_rrset(qname, question.rdtype) or zone.get_rrset(qname, dns.rdatatype.CNAME)
+            if rrset is not None:
+                response.answer.append(rrset)
+                return response
+
+        response.authority.append(zone.get_rrset(zone.origin, dns.rdatatype.SOA))
+        return response
+
+class _StandInUdp(DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagramReceived(self, data, address):
+        wire_data = self.server.respond(data, False)
+        if wire_data is not None:
+            self.server.send(lambda wire_data: self.transport.write(wire_data, address), wire_data)
+
+class _StandInTcp(Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.buffer = b''
+
+    def dataReceived(self, data):
+        self.buffer += data
+
+        while len(self.buffer) >= 2:
+            (length,) = struct.unpack('!H', self.buffer[:2])
+            if len(self.buffer) < 2 + length:
+                return
+
+            wire_data = self.server.respond(self.buffer[2:2 + length], True)
+            self.buffer = self.buffer[2 + length:]
+
+            if self.server.hang_up():
+                self.buffer = b''
+                self.transport.loseConnection()
+                return
+
+            if wire_data is not None:
+                self.server.send(self.write, wire_data)
+
+    def write(self, wire_data):
+        if self.transport.connected:
+            self.transport.write(struct.pack('!H', len(wire_data)) + wire_data)
+
+class _StandInTcpFactory(Factory):
+    def __init__(self, server):
+        self.server = server
+
+    def buildProtocol(self, addr):
+        return _StandInTcp(self.server)
@@ -0,0 +1,209 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import math
+
+from twisted.internet import error
+from twisted.python import log
+
+class TimerWheelCall(object):
+    """
+    A call scheduled with L{TimerWheel.callLater}.  Behaves like
+    L{twisted.internet.base.DelayedCall} as far as checking,
+    cancelling and reading the time of the call goes.
+    """
+
+    __slots__ = ('wheel', 'tick', 'time', 'func', 'args', 'kw', 'cancelled', 'called')
+
+    def __init__(self, wheel, tick, time, func, args, kw):
+        self.wheel = wheel
+        self.tick = tick
+        self.time = time
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.cancelled = False
+        self.called = False
+
+    def getTime(self):
+        """
+        @return: the time the call is due, which may be up to one
+        resolution of the wheel before it actually runs
+        @rtype: C{float}
+        """
+
+        return self.time
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled
+
+        if self.called:
+            raise error.AlreadyCalled
+
+        self.cancelled = True
+        self.wheel._remove(self)
+
+class TimerWheel(object):
+    """
+    Coarse grained timers for large numbers of timeouts.
+
+    Timers are hashed into buckets that are C{resolution} seconds
+    wide, so scheduling and cancelling a timer take constant time no
+    matter how many timers are outstanding.  A single reactor call,
+    repeated every C{resolution} seconds while any timer is
+    outstanding, runs the timers in the buckets that have come due.
+    Timers never run early, but may run up to C{resolution} seconds
+    late.
+
+    The wheel provides the C{callLater} and C{seconds} methods of
+    L{twisted.internet.interfaces.IReactorTime}, so it can be passed
+    as the C{timer} of the clients and protocols in place of the
+    reactor.  One wheel may be shared by any number of clients.
+    """
+
+    def __init__(self, reactor, resolution = 0.1):
+        """
+        Initialize.
+
+        @param reactor: reactor that drives the wheel
+        @type reactor: object that implements L{twisted.internet.interfaces.IReactorTime}
+        @param resolution: the width of a bucket in seconds
+        @type resolution: C{float}
+        """
+
+        self.reactor = reactor
+        self.resolution = resolution
+
+        self.buckets = {}
+        """
+        L{dict} of the outstanding timers, indexed by the tick
+        (the due time divided by the resolution, rounded up) they
+        are due in.  The values are L{set}s of L{TimerWheelCall}.
+        """
+
+        self.count = 0
+        """Number of outstanding timers"""
+
+        self.last_tick = int(reactor.seconds() / resolution)
+        self._call = None
+        self._running = False
+
+    def __len__(self):
+        return self.count
+
+    def seconds(self):
+        return self.reactor.seconds()
+
+    def callLater(self, delay, func, *args, **kw):
+        """
+        Schedule a function to be called after C{delay} seconds.
+
+        @rtype: L{TimerWheelCall}
+        """
+
+        if self._call is None and not self._running:
+            self._start()
+
+        time = self.reactor.seconds() + delay
+        tick = max(int(math.ceil(time / self.resolution)), self.last_tick + 1)
+
+        call = TimerWheelCall(self, tick, time, func, args, kw)
+
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = set()
+
+        bucket.add(call)
+        self.count += 1
+        return call
+
+    def _remove(self, call):
+        bucket = self.buckets.get(call.tick)
+        if bucket is None:
+            # the bucket is being run right now
+            return
+
+        bucket.discard(call)
+        if not bucket:
+            del self.buckets[call.tick]
+
+        self.count -= 1
+
+    def _start(self):
+        # skip the ticks that went by while the wheel was idle
+        self.last_tick = max(self.last_tick, int(self.reactor.seconds() / self.resolution))
+        self._schedule()
+
+    def _schedule(self):
+        delay = (self.last_tick + 1) * self.resolution - self.reactor.seconds()
+        self._call = self.reactor.callLater(max(delay, 0), self._advance)
+
+    def _advance(self):
+        self._call = None
+
+        now_tick = int(self.reactor.seconds() / self.resolution)
+        last_tick = self.last_tick
+        self.last_tick = max(last_tick, now_tick)
+
+        if now_tick - last_tick > len(self.buckets):
+            ticks = sorted(tick for tick in self.buckets if tick <= now_tick)
+
+        else:
+            ticks = range(last_tick + 1, now_tick + 1)
+
+        self._running = True
+        try:
+            for tick in ticks:
+                bucket = self.buckets.pop(tick, None)
+                if bucket is None:
+                    continue
+
+                self.count -= len(bucket)
+                for call in bucket:
+                    if call.cancelled:
+                        continue
+
+                    call.called = True
+                    try:
+                        call.func(*call.args, **call.kw)
+
+                    except Exception:
+                        log.err()
+
+        finally:
+            self._running = False
+
+        if self.count:
+            self._schedule()
+
+    def stop(self):
+        """Stop the wheel.  Outstanding timers will not run."""
+
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+
+        self._call = None
+        self.buckets.clear()
+        self.count = 0
@@ -19,42 +19,497 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from twisted.internet import defer
+import random
+
+from twisted.internet import error
 from twisted.internet.protocol import DatagramProtocol
-from twisted.python import log
+from twisted.python import failure
 
+import txdnspython.decode
+import txdnspython.edns
 import txdnspython.generic
+import txdnspython.rtt
+
+_random = random.SystemRandom()
+
+try:
+    _integer_types = (int, long)
+
+except NameError:
+    _integer_types = (int,)
 
 class UdpDnsClientProtocol(txdnspython.generic.GenericDnsClientProtocol, DatagramProtocol):
-    def __init__(self, reactor, address, port, one_rr_per_rrset):
-        txdnspython.generic.GenericDnsClientProtocol.__init__(self, reactor, one_rr_per_rrset)
+    def __init__(self, reactor, address, port, one_rr_per_rrset, exhausted_policy = txdnspython.generic.QUEUE,
+                 timer = None, retries = 0, rtt = None, stats = None, edns = None):
+        txdnspython.generic.GenericDnsClientProtocol.__init__(self, reactor, one_rr_per_rrset, exhausted_policy, timer,
+                                                              stats)
         self.address = address
         self.port = port
 
+        self.retries = retries
+        """The most times a query is sent again before it is left to time out"""
+
+        if rtt is None:
+            rtt = txdnspython.rtt.RoundTripTime()
+
+        self.rtt = rtt
+        """
+        L{txdnspython.rtt.RoundTripTime} of the server, shared by the
+        protocols of a client, which works out how long to wait for a
+        response before a query is sent again
+        """
+
+        self.retransmits = {}
+        """
+        L{dict} of the queries in L{pending} that may still be sent
+        again, indexed by query ID.  The values are lists of the wire
+        data, the time the query was first sent, the number of times
+        it has been sent, the current retransmission timeout and the
+        L{twisted.internet.base.DelayedCall} of the next
+        retransmission.
+        """
+
+        self.retransmissions = 0
+        """Number of queries that have been sent again"""
+
+        self.edns = edns
+        """
+        L{txdnspython.edns.PayloadSize} of the server, shared by the
+        protocols of a client, or C{None} to send queries as they are
+        """
+
+        self.lost = None
+        """
+        Callable that is called with the protocol when its socket has
+        been closed, or C{None}
+        """
+
+        self.advertised = {}
+        """
+        L{dict} of the EDNS0 payload sizes advertised by the queries
+        in L{pending}, indexed by query ID.  Only kept while L{edns}
+        is set.
+        """
+
     def startProtocol(self):
         self.transport.connect(self.address, self.port)
+
+    def stopProtocol(self):
+        self._fail_all(failure.Failure(error.ConnectionDone()))
+
+        if self.lost is not None:
+            self.lost(self)
         
-    def datagramReceived(self, data, (address, port)):
+    def datagramReceived(self, data, address):
         self._process_response(data)
 
-    def send_query(self, query, query_response, timeout = None):
+    def _matched(self, query_id, wire_data):
+        if self.retransmits:
+            self._sample(query_id)
+
+        if self.advertised:
+            payload = self.advertised.get(query_id)
+            if payload is not None:
+                self.edns.answered(payload, len(wire_data))
+
+    def send_query(self, query, query_response, timeout = None, decode = txdnspython.decode.MESSAGE):
         wire_data = query.to_wire()
+        if self.edns is not None and query.edns < 0 and query.keyring is None:
+            wire_data = txdnspython.edns.add_opt(wire_data, self.edns.current())
+
         self._send_query(wire_data,
                          query,
                          query_response,
-                         timeout)
+                         timeout,
+                         decode)
+
+    def _write(self, query_id, wire_data):
+        if self.edns is not None:
+            payload = txdnspython.edns.advertised(wire_data)
+            if payload is not None:
+                self.advertised[query_id] = payload
+
+        self.transport.write(wire_data)
+
+        if self.retries:
+            rto = self.rtt.rto
+            state = [wire_data, self.reactor.seconds(), 1, rto, None]
+            self.retransmits[query_id] = state
+            self._schedule_retransmit(query_id, state)
+
+    def _schedule_retransmit(self, query_id, state):
+        """
+        Schedule the next retransmission of a query unless it has
+        been sent as often as allowed or its timeout would go off
+        first.
+        """
+
+        if state[2] > self.retries:
+            del self.retransmits[query_id]
+            return
+
+        delayed_call = self.pending[query_id].delayed_call
+        if delayed_call and delayed_call.getTime() <= self.reactor.seconds() + state[3]:
+            del self.retransmits[query_id]
+            return
+
+        state[4] = self.timer.callLater(state[3], self._retransmit, query_id)
+
+    def _retransmit(self, query_id):
+        state = self.retransmits.get(query_id)
+        if state is None:
+            return
+
+        self.retransmissions += 1
+
+        # The copy that was sent may have been lost to fragmentation,
+        # so send the next one with a smaller payload size if the
+        # server's has come down in the meantime.
+        payload = self.advertised.get(query_id)
+        if payload is not None:
+            current = self.edns.current()
+            if current < payload:
+                state[0] = txdnspython.edns.set_advertised(state[0], current)
+                self.advertised[query_id] = current
+
+        self.transport.write(state[0])
+
+        if self.stats is not None:
+            self.stats.retransmitted(len(state[0]))
+
+        # Back off both the query and the protocol until a response
+        # gives a new sample.
+        self.rtt.back_off()
+        state[2] += 1
+        state[3] = min(state[3] * 2, self.rtt.max_rto)
+        self._schedule_retransmit(query_id, state)
+
+    def _sample(self, query_id):
+        """
+        Take a round trip time sample from the response to a query.
+        Following Karn's algorithm, queries that were sent more than
+        once are not sampled because it is not known which copy was
+        answered.
+        """
+
+        state = self.retransmits.get(query_id)
+        if state is None or state[2] > 1:
+            return
+
+        self.rtt.sample(self.reactor.seconds() - state[1])
+
+    def _timeout(self, query_id):
+        payload = self.advertised.get(query_id)
+        if payload is not None and query_id in self.pending:
+            self.edns.timed_out(payload)
+
+        txdnspython.generic.GenericDnsClientProtocol._timeout(self, query_id)
+
+    def _release_id(self, query_id):
+        if self.advertised:
+            self.advertised.pop(query_id, None)
+
+        state = self.retransmits.pop(query_id, None)
+        if state is not None and state[4] is not None and state[4].active():
+            state[4].cancel()
+
+        txdnspython.generic.GenericDnsClientProtocol._release_id(self, query_id)
+
+    def _fail_all(self, reason):
+        self.advertised = {}
+        retransmits, self.retransmits = self.retransmits, {}
+        for state in retransmits.values():
+            if state[4] is not None and state[4].active():
+                state[4].cancel()
+
+        txdnspython.generic.GenericDnsClientProtocol._fail_all(self, reason)
+
+class UdpDnsClient(txdnspython.generic.GenericDnsClient):
+    def __init__(self, reactor, address, port = 53, one_rr_per_rrset = False, source = '', source_port = 0,
+                 exhausted_policy = txdnspython.generic.QUEUE, sockets = 1, randomize_source_ports = False,
+                 cache = None, coalesce = False, timer = None, decode = txdnspython.decode.MESSAGE,
+                 retries = 0, initial_rto = 1.0, min_rto = 0.2, max_rto = 10.0, stats = None,
+                 edns_payload = None, limit = None, capture = None):
+        """
+        Initialize the client object.
+
+        @param reactor: Twisted reactor - used to open UDP sockets and schedule timeouts
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorUDP} (used to open UDP
+        sockets) and L{twisted.internet.interfaces.IReactorTime}
+        (used to schedule timeouts)
+
+        @param address: where to send the message
+        @type address: string containing an IPv4 address
+
+        @param port: The port to which to send the message.  The default is 53.
+        @type port: int
+
+        @param source: source address.  The default is the IPv4 wildcard address.
+        @type source: string
+
+        @param source_port: The port from which to send the message.
+        The default is 0, which lets the operating system pick a port.
+        If more than one socket is opened this may also be a list
+        with one port per socket; a single non-zero port is then the
+        first of a range of consecutive ports.
+        @type source_port: int or list of ints
+
+        @param one_rr_per_rrset: Put each RR into its own RRset
+        @type one_rr_per_rrset: bool
+
+        @param exhausted_policy: what to do with new queries when all
+        65,536 query IDs are in use on a socket, either
+        L{txdnspython.generic.QUEUE} or L{txdnspython.generic.FAIL}
+        @type exhausted_policy: str
+
+        @param sockets: The number of UDP sockets to open.  Each
+        socket has its own set of 65,536 query IDs, and queries are
+        sent from the socket with the fewest queries in flight.
+        @type sockets: int
+
+        @param randomize_source_ports: Bind each socket to a randomly
+        chosen port instead of C{source_port}.
+        @type randomize_source_ports: bool
+
+        @param cache: cache to answer queries from before sending
+        them, and to store responses in
+        @type cache: L{txdnspython.cache.DnsCache}
+
+        @param coalesce: If C{True}, a query that asks the same
+        question as a query that is already in flight is not sent,
+        but gets a copy of the response to that query.  Each query
+        still times out on its own: if the query in flight times out,
+        it is sent again for the queries that joined it and still have
+        time left.  If it fails otherwise, every query that joined it
+        fails the same way.
+        @type coalesce: bool
+
+        @param timer: what to schedule query timeouts with instead of
+        the reactor, for example a L{txdnspython.timer.TimerWheel}
+        shared with other clients
+        @type timer: object that implements
+        L{twisted.internet.interfaces.IReactorTime}
 
-class UdpDnsClient(object):
-    def __init__(self, reactor, address, port = 53, one_rr_per_rrset = False, source = '', source_port = 0):
-        self.reactor = reactor
-        self.protocol = UdpDnsClientProtocol(self.reactor, address, port, one_rr_per_rrset)
-        self.reactor.listenUDP(source_port, self.protocol, interface = source)
+        @param decode: how to decode responses unless a query asks
+        otherwise, one of the modes in L{txdnspython.decode}
+        @type decode: str
 
-    def send_query(self, query, timeout = None):
-        query_response = defer.Deferred()
-        self.protocol.send_query(query, query_response, timeout)
-        return query_response
+        @param retries: The most times a query that has not been
+        answered is sent again, on the same socket and with the same
+        query ID, before it is left to time out.  The default is 0,
+        which sends each query once.  Queries are only sent again
+        while there is time left before their timeout.
+        @type retries: int
+
+        @param initial_rto: Seconds to wait for a response before
+        sending a query again, until round trip times have been
+        measured.  After that the wait is the smoothed round trip
+        time plus four times its variation, as RFC 6298 works out the
+        retransmission timeout of TCP, and it doubles with every
+        retransmission.  What has been learnt about the server is
+        kept in L{rtt} and shared by all sockets.
+        @type initial_rto: float
+
+        @param min_rto: the shortest wait before sending a query again
+        @type min_rto: float
+
+        @param max_rto: the longest wait before sending a query again
+        @type max_rto: float
+
+        @param stats: what to count the queries, responses and
+        response latencies of every socket in
+        @type stats: L{txdnspython.stats.Stats}
+
+        @param edns_payload: If not C{None}, add EDNS0 to queries that
+        do not use it, advertising this UDP payload size or a smaller
+        one that has been found to work better with the server (see
+        L{txdnspython.edns.PayloadSize}).  What has been learnt about
+        the server is kept in L{edns} and shared by all sockets.
+        Queries that already use EDNS0 are sent as they are, but
+        count towards the learning.  TSIG signed queries are sent as
+        they are.
+        @type edns_payload: int
+
+        @param limit: what to hold queries back with, to limit their
+        rate, how many are in flight and how many wait to be sent.
+        If C{None}, the default, queries are sent at once.
+        @type limit: L{txdnspython.limit.Limiter}
+
+        @param capture: what to record the queries sent and the
+        responses received over every socket in, to replay them
+        later.  If C{None}, the default, nothing is recorded.
+        @type capture: L{txdnspython.capture.Capture}
+        """
+
+        txdnspython.generic.GenericDnsClient.__init__(self, reactor, cache, coalesce, timer, decode, stats, limit,
+                                                      capture)
+
+        self.rtt = txdnspython.rtt.RoundTripTime(initial_rto, min_rto, max_rto)
+        """L{txdnspython.rtt.RoundTripTime} of the server, shared by the sockets"""
+
+        if edns_payload is None:
+            self.edns = None
+
+        else:
+            self.edns = txdnspython.edns.PayloadSize(self.reactor, edns_payload)
+
+        if isinstance(source_port, _integer_types):
+            if source_port:
+                source_ports = range(source_port, source_port + sockets)
+
+            else:
+                source_ports = [0] * sockets
+
+        else:
+            source_ports = list(source_port)
+            if len(source_ports) != sockets:
+                raise ValueError('need one source port per socket')
+
+        self.protocols = []
+        """The L{UdpDnsClientProtocol} bound to each socket"""
+
+        self.ports = []
+        """The L{twisted.internet.interfaces.IListeningPort} of each socket"""
+
+        self.source_ports = []
+        """The port each socket was asked to bind to"""
+
+        self.reopened = 0
+        """Number of sockets that were opened again after the reactor closed them"""
+
+        self.closed = False
+
+        self._protocol_args = (address, port, one_rr_per_rrset, exhausted_policy, timer, retries, self.rtt,
+                               stats, self.edns)
+        self._source = source
+        self._randomize_source_ports = randomize_source_ports
+
+        for source_port in source_ports:
+            self._open(source_port)
+
+        self.protocol = self.protocols[0]
+        self._next_protocol = 0
+
+    def _build_protocol(self):
+        """
+        Create the protocol for a socket.
+
+        @rtype: L{UdpDnsClientProtocol}
+        """
+
+        return UdpDnsClientProtocol(self.reactor, *self._protocol_args)
+
+    def _open(self, source_port):
+        """Open a socket and put it into rotation."""
+
+        protocol = self._build_protocol()
+        protocol.lost = self._lost
+
+        if self.capture is not None:
+            protocol.capture = self.capture
+            protocol.capture_stream = self.capture.stream()
+
+        if self._randomize_source_ports:
+            listening_port = self._listen_random(protocol, self._source)
+
+        else:
+            listening_port = self.reactor.listenUDP(source_port, protocol, interface = self._source)
+
+        self.protocols.append(protocol)
+        self.ports.append(listening_port)
+        self.source_ports.append(source_port)
+        self.protocol = self.protocols[0]
+
+    def _lost(self, protocol):
+        """
+        Replace a socket that the reactor closed, as some reactors do
+        when an ICMP error arrives for a connected UDP socket, for
+        example because nothing listens on the server's port.
+        """
+
+        if self.closed or protocol not in self.protocols:
+            return
+
+        index = self.protocols.index(protocol)
+        del self.protocols[index]
+        del self.ports[index]
+        source_port = self.source_ports.pop(index)
+
+        self.reopened += 1
+
+        try:
+            self._open(source_port)
+
+        except error.CannotListenError:
+            # the old socket still holds the port until it has been
+            # closed, which happens right after this
+            self.reactor.callLater(0, self._reopen, source_port)
+
+    def _reopen(self, source_port):
+        if not self.closed:
+            self._open(source_port)
+
+    def _listen_random(self, protocol, source, attempts = 16):
+        """
+        Bind a protocol to a randomly chosen unprivileged port,
+        retrying with a different port if the chosen one is in use.
+        """
+
+        for attempt in range(attempts - 1):
+            try:
+                return self.reactor.listenUDP(_random.randint(1024, 65535), protocol, interface = source)
+
+            except error.CannotListenError:
+                pass
+
+        return self.reactor.listenUDP(_random.randint(1024, 65535), protocol, interface = source)
+
+    def _select_protocol(self):
+        """
+        Pick the socket with the fewest queries in flight.  The
+        search starts at a different socket each time so that idle
+        sockets share the traffic.
+
+        @rtype: L{UdpDnsClientProtocol}
+        """
+
+        protocols = self.protocols
+        count = len(protocols)
+        if count == 1:
+            return protocols[0]
+
+        start = self._next_protocol = (self._next_protocol + 1) % count
+        best = None
+        best_load = None
+        for index in range(start, start + count):
+            protocol = protocols[index % count]
+            load = protocol.load()
+            if load == 0:
+                return protocol
+
+            if best is None or load < best_load:
+                best = protocol
+                best_load = load
+
+        return best
+
+    def _dispatch(self, query, query_response, timeout, decode):
+        if not self.protocols:
+            query_response.errback(failure.Failure(error.ConnectionLost('no UDP socket is open')))
+            return
+
+        self._select_protocol().send_query(query, query_response, timeout, decode)
 
     def close(self):
-        self.protocol.transport.loseConnection()
+        self.closed = True
+        self._cancel_limited()
+
+        protocols, self.protocols = self.protocols, []
+        for protocol in protocols:
+            if protocol.transport is not None:
+                protocol.transport.loseConnection()
+
+        self.ports = []
+        self.source_ports = []
         self.protocol = None
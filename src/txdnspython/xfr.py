@@ -0,0 +1,415 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# 
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import collections
+
+from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet.protocol import ClientFactory
+from twisted.internet.protocol import Protocol
+from twisted.python import failure
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.rdataclass
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import dns.tsig
+
+import txdnspython.framing
+
+MESSAGES = 'messages'
+"""Hand the consumer each response message of a transfer"""
+
+RRSETS = 'rrsets'
+"""Hand the consumer each RRset of a transfer"""
+
+class ZoneTransfer(object):
+    """
+    An AXFR or IXFR zone transfer over its own TCP connection.
+
+    The responses are handed to the consumer as they are read, either
+    message by message or RRset by RRset, so the zone is never held
+    in memory.  If the consumer returns a
+    L{twisted.internet.defer.Deferred} the connection stops reading
+    until it fires, so a slow consumer holds back the server instead
+    of letting responses pile up.
+
+    In L{RRSETS} mode the consumer is called with each RRset and
+    whether it is being deleted.  An IXFR response lists the changes
+    of each version as the old SOA and the RRsets to delete, then the
+    new SOA and the RRsets to add; the RRsets from each old SOA up to
+    the following new SOA are the ones flagged as deleted.  Full zone
+    transfers, including an IXFR that the server answered with the
+    whole zone, never flag anything as deleted.
+
+    The L{twisted.internet.defer.Deferred} returned by L{start} fires
+    with the transfer itself once the final SOA has been read, and
+    its counters describe what was transferred.
+    """
+
+    def __init__(self, reactor, address, zone, consumer, rdtype = dns.rdatatype.AXFR, serial = 0, port = 53,
+                 source = '', source_port = 0, deliver = MESSAGES, timeout = None, keyring = None,
+                 keyname = None, keyalgorithm = None):
+        """
+        Initialize.
+
+        @param reactor: the reactor to connect and to schedule the
+        timeout with
+        @type reactor: object that implements
+        L{twisted.internet.interfaces.IReactorTCP} and
+        L{twisted.internet.interfaces.IReactorTime}
+        @param address: the server to transfer the zone from
+        @type address: C{str}
+        @param zone: the name of the zone
+        @type zone: L{dns.name.Name} or C{str}
+        @param consumer: called with each message, or with each RRset
+        and whether it is deleted (see L{RRSETS}).  If it returns a
+        L{twisted.internet.defer.Deferred} nothing more is handed to
+        it until that fires.  If it raises an exception, or the
+        Deferred fails, the transfer is aborted.
+        @type consumer: callable
+        @param rdtype: L{dns.rdatatype.AXFR} or L{dns.rdatatype.IXFR}
+        @type rdtype: C{int} or C{str}
+        @param serial: for IXFR, the serial of the copy of the zone
+        that the changes are wanted from
+        @type serial: C{int}
+        @param deliver: L{MESSAGES} or L{RRSETS}
+        @type deliver: C{str}
+        @param timeout: The number of seconds to wait for each
+        response message.  The wait stops while the consumer holds the
+        transfer back.  If None, the default, wait forever.
+        @type timeout: C{float}
+        @param keyring: TSIG keyring to sign the query and check the
+        responses with
+        @type keyring: C{dict}
+        @param keyname: the TSIG key to use
+        @type keyname: L{dns.name.Name} or C{str}
+        @param keyalgorithm: the TSIG algorithm to use
+        @type keyalgorithm: L{dns.name.Name} or C{str}
+        """
+
+        if isinstance(zone, str):
+            zone = dns.name.from_text(zone)
+
+        if isinstance(rdtype, str):
+            rdtype = dns.rdatatype.from_text(rdtype)
+
+        if rdtype not in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+            raise ValueError('rdtype must be AXFR or IXFR')
+
+        self.reactor = reactor
+        self.address = address
+        self.port = port
+        self.bind_address = (source, source_port)
+        self.zone = zone
+        self.consumer = consumer
+        self.rdtype = rdtype
+        self.serial = serial
+        self.deliver = deliver
+        self.timeout = timeout
+
+        self.query = dns.message.make_query(zone, rdtype)
+        if rdtype == dns.rdatatype.IXFR:
+            self.query.authority.append(dns.rrset.from_text(zone, 0, dns.rdataclass.IN, dns.rdatatype.SOA,
+                                                            '. . {} 0 0 0 0'.format(serial)))
+
+        if keyring is not None:
+            self.query.use_tsig(keyring, keyname, algorithm = keyalgorithm or dns.tsig.default_algorithm)
+
+        self.done = defer.Deferred()
+        """Fires with the transfer when it has finished"""
+
+        self.messages = 0
+        """Number of response messages read"""
+
+        self.rrsets = 0
+        """Number of RRsets read, counting both SOA records at the ends"""
+
+        self.incremental = False
+        """Whether an IXFR was answered with changes rather than the whole zone"""
+
+        self.up_to_date = False
+        """Whether an IXFR found that the copy at C{serial} is current"""
+
+        self.soa = None
+        """The SOA RRset of the zone that was transferred, once it has been read"""
+
+        self.finished = False
+        """Whether the final SOA has been read"""
+
+        self.protocol = None
+        self._tsig_ctx = None
+        self._expecting_soa = False
+        self._deleting = False
+
+    def start(self):
+        """
+        Connect and send the query.
+
+        @return: L{done}
+        @rtype: L{twisted.internet.defer.Deferred}
+        """
+
+        self.reactor.connectTCP(self.address, self.port, _ZoneTransferFactory(self),
+                                bindAddress = self.bind_address)
+        return self.done
+
+    def parse(self, wire_data):
+        """
+        Parse a response message and work out which of its RRsets are
+        deleted, following the rules of C{dns.query.xfr}.
+
+        @param wire_data: the message without its length
+        @type wire_data: C{str}
+        @return: the message and a list of tuples of each RRset and
+        whether it is deleted
+        @raise dns.exception.FormError: if the response does not
+        belong to the transfer
+        """
+
+        query = self.query
+        response = dns.message.from_wire(wire_data, keyring = query.keyring, request_mac = query.mac, xfr = True,
+                                         tsig_ctx = self._tsig_ctx, multi = True, first = self.messages == 0,
+                                         one_rr_per_rrset = self.rdtype == dns.rdatatype.IXFR)
+
+        if response.id != query.id:
+            raise dns.exception.FormError('transfer response has the wrong ID')
+
+        rcode = response.rcode()
+        if rcode != dns.rcode.NOERROR:
+            raise dns.exception.FormError('transfer failed with rcode {}'.format(dns.rcode.to_text(rcode)))
+
+        self._tsig_ctx = response.tsig_ctx
+        self.messages += 1
+
+        rrsets = []
+        answer = response.answer
+        index = 0
+
+        if self.soa is None:
+            if not answer or answer[0].rdtype != dns.rdatatype.SOA or answer[0].name != self.zone:
+                raise dns.exception.FormError('transfer does not start with the SOA of the zone')
+
+            self.soa = answer[0]
+            rrsets.append((answer[0], False))
+            index = 1
+
+            if self.rdtype == dns.rdatatype.IXFR:
+                if self.soa[0].serial <= self.serial:
+                    self.up_to_date = True
+                    self.finished = True
+
+                else:
+                    self._expecting_soa = True
+
+        for rrset in answer[index:]:
+            if self.finished:
+                raise dns.exception.FormError('records after the final SOA')
+
+            if rrset.rdtype == dns.rdatatype.SOA and rrset.name == self.zone:
+                if self._expecting_soa:
+                    if rrset[0].serial != self.serial:
+                        raise dns.exception.FormError('IXFR base serial mismatch')
+
+                    self._expecting_soa = False
+                    self.incremental = True
+                    self._deleting = True
+
+                elif self.incremental:
+                    self._deleting = not self._deleting
+
+                # the SOA of the new version closes the transfer when
+                # it comes where the next deletions would start
+                if rrset == self.soa and (not self.incremental or self._deleting):
+                    self.finished = True
+                    self._deleting = False
+
+            elif self._expecting_soa:
+                # an IXFR that is answered with the whole zone
+                self._expecting_soa = False
+
+            rrsets.append((rrset, self._deleting))
+
+        if self.finished and query.keyring is not None and not response.had_tsig:
+            raise dns.exception.FormError('missing TSIG')
+
+        self.rrsets += len(rrsets)
+        return response, rrsets
+
+class _ZoneTransferProtocol(txdnspython.framing.MessageFraming, Protocol):
+    """
+    Reads the responses of a L{ZoneTransfer} and hands them to its
+    consumer, pausing the transport while the consumer is busy.
+    """
+
+    def __init__(self, transfer):
+        txdnspython.framing.MessageFraming.__init__(self)
+        self.transfer = transfer
+
+        self.backlog = collections.deque()
+        """Messages that were read while the consumer was busy, not parsed yet"""
+
+        self.items = collections.deque()
+        """What is still to be handed to the consumer from the current message"""
+
+        self.paused = False
+        self.timeout_call = None
+        self.stopped = False
+
+    def connectionMade(self):
+        self.transfer.protocol = self
+        self.transport.write(txdnspython.framing.frame(self.transfer.query.to_wire()))
+        self._start_timeout()
+
+    def _start_timeout(self):
+        if self.transfer.timeout:
+            self.timeout_call = self.transfer.reactor.callLater(self.transfer.timeout, self._timed_out)
+
+    def _stop_timeout(self):
+        if self.timeout_call is not None:
+            if self.timeout_call.active():
+                self.timeout_call.cancel()
+
+            self.timeout_call = None
+
+    def _timed_out(self):
+        self.timeout_call = None
+        self._fail(failure.Failure(dns.exception.Timeout()))
+
+    def _process_response(self, wire_data):
+        if self.stopped:
+            return
+
+        self.backlog.append(wire_data)
+        if not self.paused:
+            self._drain()
+
+    def _drain(self):
+        transfer = self.transfer
+        consumer = transfer.consumer
+        by_rrset = transfer.deliver == RRSETS
+
+        while not self.stopped:
+            if self.items:
+                item = self.items.popleft()
+
+                try:
+                    if by_rrset:
+                        result = consumer(*item)
+
+                    else:
+                        result = consumer(item)
+
+                except Exception:
+                    self._fail(failure.Failure())
+                    return
+
+                if isinstance(result, defer.Deferred):
+                    if not result.called:
+                        self._pause()
+
+                    result.addCallbacks(self._cbConsumed, self._fail)
+                    if self.paused:
+                        return
+
+                continue
+
+            if transfer.finished:
+                self._finish()
+                return
+
+            if not self.backlog:
+                self._stop_timeout()
+                self._start_timeout()
+                return
+
+            try:
+                response, rrsets = transfer.parse(self.backlog.popleft())
+
+            except Exception:
+                self._fail(failure.Failure())
+                return
+
+            if by_rrset:
+                self.items.extend(rrsets)
+
+            else:
+                self.items.append(response)
+
+    def _pause(self):
+        self.paused = True
+        self._stop_timeout()
+        self.transport.pauseProducing()
+
+    def _cbConsumed(self, result):
+        if self.paused:
+            self.paused = False
+            self.transport.resumeProducing()
+            self._drain()
+
+    def _finish(self):
+        self._stop_timeout()
+        self.stopped = True
+        self.transport.loseConnection()
+
+        done = self.transfer.done
+        if not done.called:
+            done.callback(self.transfer)
+
+    def _fail(self, reason):
+        if self.stopped:
+            return
+
+        self.stopped = True
+        self._stop_timeout()
+        self.backlog.clear()
+        self.items.clear()
+        self.transport.abortConnection()
+
+        done = self.transfer.done
+        if not done.called:
+            done.errback(reason)
+
+    def connectionLost(self, reason):
+        self._stop_timeout()
+
+        if not self.stopped:
+            self.stopped = True
+            done = self.transfer.done
+            if not done.called:
+                if reason.check(error.ConnectionDone):
+                    reason = failure.Failure(dns.exception.FormError('connection closed before the final SOA'))
+
+                done.errback(reason)
+
+class _ZoneTransferFactory(ClientFactory):
+    def __init__(self, transfer):
+        self.transfer = transfer
+
+    def buildProtocol(self, addr):
+        return _ZoneTransferProtocol(self.transfer)
+
+    def clientConnectionFailed(self, connector, reason):
+        if not self.transfer.done.called:
+            self.transfer.done.errback(reason)